@@ -0,0 +1,317 @@
+# src/barnes_hut.py
+#--- START OF FILE barnes_hut.py ---
+# src/barnes_hut.py
+import numpy as np
+from numba import njit, prange
+from src.galactic_potential import G  # Gravitational Constant
+
+# Node storage layout. Float data: box center (x, y, z) and box half-width.
+# Integer data: first particle in the permutation, particle count, first child node, number of children.
+NODE_START, NODE_COUNT, NODE_FIRST_CHILD, NODE_NUM_CHILDREN = 0, 1, 2, 3
+
+DEFAULT_LEAF_SIZE = 8  # Maximum number of particles in a leaf
+MAX_DEPTH = 48  # Depth cap so coincident particles cannot recurse forever
+
+
+class Octree:
+    """
+    Array-backed octree with monopole and quadrupole moments.
+    Nodes are stored breadth-first, so every child has a larger index than its parent
+    and the children of a node are contiguous.
+    Attributes:
+        order (np.array): Permutation of particle indices; each node owns a contiguous slice.
+        node_box (np.array): (M,4) box center and half-width of each node.
+        node_links (np.array): (M,4) start, count, first child and number of children of each node.
+        node_mass (np.array): (M,) total mass of each node.
+        node_com (np.array): (M,3) center of mass of each node.
+        node_quad (np.array): (M,6) traceless quadrupole (xx, yy, zz, xy, xz, yz) about the center of mass.
+        node_delta (np.array): (M,) distance between box center and center of mass.
+    """
+    def __init__(self, positions, masses, leaf_size=DEFAULT_LEAF_SIZE):
+        """
+        Builds the octree and its multipole moments.
+        Args:
+            positions (np.array): (N,3) particle positions.
+            masses (np.array): (N,) particle masses.
+            leaf_size (int): Maximum number of particles in a leaf node.
+        """
+        positions = np.ascontiguousarray(positions, dtype=np.float64)
+        masses = np.ascontiguousarray(masses, dtype=np.float64)
+        self.order, self.node_box, self.node_links = _build_octree(positions, int(leaf_size), MAX_DEPTH)
+        self.node_mass, self.node_com, self.node_quad, self.node_delta = _compute_moments(
+            positions, masses, self.order, self.node_box, self.node_links)
+
+    @property
+    def num_nodes(self):
+        return self.node_box.shape[0]
+
+
+@njit(cache=True)
+def _grow(array, new_capacity):
+    grown = np.empty((new_capacity, array.shape[1]), dtype=array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
+
+
+@njit(cache=True)
+def _build_octree(positions, leaf_size, max_depth):
+    n = positions.shape[0]
+    order = np.arange(n)
+    scratch = np.empty(n, dtype=np.int64)
+    capacity = max(64, 2 * n // max(leaf_size, 1) + 64)
+    node_box = np.empty((capacity, 4), dtype=np.float64)
+    node_links = np.zeros((capacity, 4), dtype=np.int64)
+    node_depth = np.zeros(capacity, dtype=np.int64)
+
+    lo = np.empty(3)
+    hi = np.empty(3)
+    for axis in range(3):
+        lo[axis] = positions[:, axis].min() if n > 0 else 0.0
+        hi[axis] = positions[:, axis].max() if n > 0 else 0.0
+    half = 0.5 * max(hi[0] - lo[0], hi[1] - lo[1], hi[2] - lo[2])
+    half = half * (1.0 + 1e-9) + 1e-12  # Keep boundary particles strictly inside
+    for axis in range(3):
+        node_box[0, axis] = 0.5 * (lo[axis] + hi[axis])
+    node_box[0, 3] = half
+    node_links[0, NODE_START] = 0
+    node_links[0, NODE_COUNT] = n
+    num_nodes = 1
+
+    counts = np.zeros(8, dtype=np.int64)
+    offsets = np.zeros(8, dtype=np.int64)
+    k = 0
+    while k < num_nodes:
+        start = node_links[k, NODE_START]
+        count = node_links[k, NODE_COUNT]
+        if count <= leaf_size or node_depth[k] >= max_depth:
+            k += 1
+            continue
+
+        cx, cy, cz = node_box[k, 0], node_box[k, 1], node_box[k, 2]
+        counts[:] = 0
+        for idx in range(start, start + count):
+            p = order[idx]
+            octant = (positions[p, 0] >= cx) * 1 + (positions[p, 1] >= cy) * 2 + (positions[p, 2] >= cz) * 4
+            counts[octant] += 1
+        offsets[0] = 0
+        for octant in range(1, 8):
+            offsets[octant] = offsets[octant - 1] + counts[octant - 1]
+        for idx in range(start, start + count):  # Counting sort of this node's slice into octants
+            p = order[idx]
+            octant = (positions[p, 0] >= cx) * 1 + (positions[p, 1] >= cy) * 2 + (positions[p, 2] >= cz) * 4
+            scratch[offsets[octant]] = p
+            offsets[octant] += 1
+        order[start:start + count] = scratch[:count]
+
+        if num_nodes + 8 > node_box.shape[0]:
+            capacity = 2 * node_box.shape[0]
+            node_box = _grow(node_box, capacity)
+            node_links = _grow(node_links, capacity)
+            depth_grown = np.zeros(capacity, dtype=np.int64)
+            depth_grown[:node_depth.shape[0]] = node_depth
+            node_depth = depth_grown
+
+        child_half = 0.5 * node_box[k, 3]
+        node_links[k, NODE_FIRST_CHILD] = num_nodes
+        child_start = start
+        for octant in range(8):
+            if counts[octant] == 0:
+                continue
+            c = num_nodes
+            node_box[c, 0] = cx + (child_half if octant & 1 else -child_half)
+            node_box[c, 1] = cy + (child_half if octant & 2 else -child_half)
+            node_box[c, 2] = cz + (child_half if octant & 4 else -child_half)
+            node_box[c, 3] = child_half
+            node_links[c, NODE_START] = child_start
+            node_links[c, NODE_COUNT] = counts[octant]
+            node_links[c, NODE_FIRST_CHILD] = 0
+            node_links[c, NODE_NUM_CHILDREN] = 0
+            node_depth[c] = node_depth[k] + 1
+            child_start += counts[octant]
+            num_nodes += 1
+        node_links[k, NODE_NUM_CHILDREN] = num_nodes - node_links[k, NODE_FIRST_CHILD]
+        k += 1
+
+    return order, node_box[:num_nodes].copy(), node_links[:num_nodes].copy()
+
+
+@njit(cache=True)
+def _compute_moments(positions, masses, order, node_box, node_links):
+    num_nodes = node_box.shape[0]
+    node_mass = np.zeros(num_nodes)
+    node_com = np.zeros((num_nodes, 3))
+    node_quad = np.zeros((num_nodes, 6))
+    node_delta = np.zeros(num_nodes)
+    for k in range(num_nodes):
+        start = node_links[k, NODE_START]
+        count = node_links[k, NODE_COUNT]
+        mass = 0.0
+        cx = 0.0
+        cy = 0.0
+        cz = 0.0
+        for idx in range(start, start + count):
+            p = order[idx]
+            m = masses[p]
+            mass += m
+            cx += m * positions[p, 0]
+            cy += m * positions[p, 1]
+            cz += m * positions[p, 2]
+        if mass > 0.0:
+            cx /= mass
+            cy /= mass
+            cz /= mass
+        else:
+            cx, cy, cz = node_box[k, 0], node_box[k, 1], node_box[k, 2]
+        node_mass[k] = mass
+        node_com[k, 0] = cx
+        node_com[k, 1] = cy
+        node_com[k, 2] = cz
+        for idx in range(start, start + count):  # Traceless quadrupole about the center of mass
+            p = order[idx]
+            m = masses[p]
+            dx = positions[p, 0] - cx
+            dy = positions[p, 1] - cy
+            dz = positions[p, 2] - cz
+            r_sq = dx * dx + dy * dy + dz * dz
+            node_quad[k, 0] += m * (3.0 * dx * dx - r_sq)
+            node_quad[k, 1] += m * (3.0 * dy * dy - r_sq)
+            node_quad[k, 2] += m * (3.0 * dz * dz - r_sq)
+            node_quad[k, 3] += m * 3.0 * dx * dy
+            node_quad[k, 4] += m * 3.0 * dx * dz
+            node_quad[k, 5] += m * 3.0 * dy * dz
+        ddx = cx - node_box[k, 0]
+        ddy = cy - node_box[k, 1]
+        ddz = cz - node_box[k, 2]
+        node_delta[k] = np.sqrt(ddx * ddx + ddy * ddy + ddz * ddz)
+    return node_mass, node_com, node_quad, node_delta
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _walk(positions, masses, targets, order, node_box, node_links, node_mass, node_com, node_quad, node_delta,
+          theta, softening_sq, grav_const, max_depth):
+    num_targets = targets.shape[0]
+    accelerations = np.zeros((num_targets, 3))
+    stack_size = 8 * (max_depth + 2)
+    inv_theta = 1.0 / theta
+    for t in prange(num_targets):
+        i = targets[t]
+        xi = positions[i, 0]
+        yi = positions[i, 1]
+        zi = positions[i, 2]
+        ax = 0.0
+        ay = 0.0
+        az = 0.0
+        stack = np.empty(stack_size, dtype=np.int64)
+        stack[0] = 0
+        top = 1
+        while top > 0:
+            top -= 1
+            k = stack[top]
+            if node_mass[k] == 0.0:
+                continue
+            dx = xi - node_com[k, 0]
+            dy = yi - node_com[k, 1]
+            dz = zi - node_com[k, 2]
+            d_sq = dx * dx + dy * dy + dz * dz
+            size = 2.0 * node_box[k, 3]
+            open_radius = size * inv_theta + node_delta[k]  # Barnes (1994) offset-corrected opening criterion
+            if node_links[k, NODE_NUM_CHILDREN] == 0:
+                start = node_links[k, NODE_START]
+                for idx in range(start, start + node_links[k, NODE_COUNT]):  # Leaf: direct sum
+                    j = order[idx]
+                    if j == i:
+                        continue
+                    rx = positions[j, 0] - xi
+                    ry = positions[j, 1] - yi
+                    rz = positions[j, 2] - zi
+                    r_sq = rx * rx + ry * ry + rz * rz + softening_sq
+                    if r_sq == 0.0:
+                        continue
+                    inv_r3 = masses[j] / (r_sq * np.sqrt(r_sq))
+                    ax += rx * inv_r3
+                    ay += ry * inv_r3
+                    az += rz * inv_r3
+            elif d_sq > open_radius * open_radius:
+                r_sq = d_sq + softening_sq  # Monopole
+                inv_r = 1.0 / np.sqrt(r_sq)
+                inv_r2 = inv_r * inv_r
+                inv_r3 = inv_r * inv_r2
+                m_term = node_mass[k] * inv_r3
+                ax -= dx * m_term
+                ay -= dy * m_term
+                az -= dz * m_term
+                qxx = node_quad[k, 0]  # Quadrupole: a = Q r / r^5 - 5/2 (r.Q.r) r / r^7
+                qyy = node_quad[k, 1]
+                qzz = node_quad[k, 2]
+                qxy = node_quad[k, 3]
+                qxz = node_quad[k, 4]
+                qyz = node_quad[k, 5]
+                qrx = qxx * dx + qxy * dy + qxz * dz
+                qry = qxy * dx + qyy * dy + qyz * dz
+                qrz = qxz * dx + qyz * dy + qzz * dz
+                rqr = dx * qrx + dy * qry + dz * qrz
+                inv_r5 = inv_r3 * inv_r2
+                radial = 2.5 * rqr * inv_r5 * inv_r2
+                ax += qrx * inv_r5 - radial * dx
+                ay += qry * inv_r5 - radial * dy
+                az += qrz * inv_r5 - radial * dz
+            else:
+                first = node_links[k, NODE_FIRST_CHILD]
+                for c in range(first, first + node_links[k, NODE_NUM_CHILDREN]):
+                    stack[top] = c
+                    top += 1
+        accelerations[t, 0] = grav_const * ax
+        accelerations[t, 1] = grav_const * ay
+        accelerations[t, 2] = grav_const * az
+    return accelerations
+
+
+def barnes_hut_forces(positions, masses, opening_angle, softening_length, leaf_size=DEFAULT_LEAF_SIZE, targets=None):
+    """
+    Calculates the full self-gravity of all particles with a Barnes-Hut octree.
+    Cells are accepted with the offset-corrected opening criterion d > s/theta + delta and
+    contribute their monopole and quadrupole; leaves are summed directly with Plummer softening.
+    The tree always holds every particle; with targets only those particles walk it.
+    Args:
+        positions (np.array): (N,3) particle positions (kpc).
+        masses (np.array): (N,) particle masses.
+        opening_angle (float): Opening angle theta (smaller is more accurate).
+        softening_length (float): Plummer softening length (kpc).
+        leaf_size (int): Maximum number of particles in a leaf node.
+        targets (np.array): Indices of the particles to evaluate; None evaluates all of them.
+    Returns:
+        np.array: (N,3) array of gravitational forces, or (len(targets),3) when targets is given.
+    """
+    positions = np.ascontiguousarray(positions, dtype=np.float64)
+    masses = np.ascontiguousarray(masses, dtype=np.float64)
+    num_particles = len(positions)
+    targets = np.arange(num_particles) if targets is None else np.ascontiguousarray(targets, dtype=np.int64)
+    if num_particles < 2 or len(targets) == 0:
+        return np.zeros((len(targets), 3))
+
+    tree = Octree(positions, masses, leaf_size)
+    accelerations = _walk(positions, masses, targets, tree.order, tree.node_box, tree.node_links,
+                          tree.node_mass, tree.node_com, tree.node_quad, tree.node_delta,
+                          float(opening_angle), float(softening_length) ** 2, G, MAX_DEPTH)
+    return accelerations * masses[targets, None]
+
+
+if __name__ == '__main__':
+    import time
+    from src.direct_summation import sampled_force_error
+
+    rng = np.random.default_rng(42)
+    num_particles = 5000
+    positions_example = rng.normal(scale=5.0, size=(num_particles, 3))
+    masses_example = rng.uniform(0.5, 2.0, size=num_particles)
+    softening = 0.08
+
+    for theta in (0.3, 0.5, 0.7, 1.0):
+        barnes_hut_forces(positions_example[:10], masses_example[:10], theta, softening)  # Compile
+        start = time.perf_counter()
+        forces_bh = barnes_hut_forces(positions_example, masses_example, theta, softening)
+        elapsed = time.perf_counter() - start
+        error = sampled_force_error(positions_example, masses_example, forces_bh, softening, rng=rng)
+        print(f"theta = {theta:.1f}: {elapsed * 1e3:.1f} ms, median relative force error {error['median']:.2e}, "
+              f"99th percentile {error['p99']:.2e}")
+# --- END OF FILE barnes_hut.py ---
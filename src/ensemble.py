@@ -0,0 +1,313 @@
+# src/ensemble.py
+#--- START OF FILE ensemble.py ---
+# src/ensemble.py
+import random
+import logging
+import numpy as np
+from time import perf_counter
+from src.particles import ParticleSet, KIND_STAR, KIND_BLACK_HOLE
+from src.forces import background_forces
+from src.force_engines import ForceEngineState, compute_forces
+from src.integrator import timestep, kick, kick_drift
+from src.initialization import initialize_particles, form_disk
+from src.simulation import log_message
+
+# Ensemble runs advance E realizations of one configuration (one per rng_seed) together. The
+# state is stacked along a leading ensemble axis, so the integrator kernels make one pass over
+# all E * N particles and interpreter overhead is paid once per step instead of once per
+# member. For the localized engine the members are shifted apart along x by more than their
+# extent plus the interaction radius, so one k-d tree / tile pass serves all members without
+# any pair crossing between them. With force_precision="mixed" the localized engine runs per
+# member instead: the float32 copies are taken relative to one centre (single_precision_copy),
+# and the centre of the shifted members lies hundreds of kpc from most of them.
+MEMBER_SPACING_GROWTH = 1.5  # Headroom when the member spacing has to grow
+
+
+class ParticleEnsemble:
+    """
+    E realizations of the same particle configuration as stacked arrays.
+    Attributes:
+        positions (np.array): (E,N,3) positions.
+        velocities (np.array): (E,N,3) velocities.
+        masses (np.array): (E,N) masses.
+        kind (np.array): (N,) particle kinds (KIND_STAR or KIND_BLACK_HOLE), shared by all members.
+    """
+    def __init__(self, positions, velocities, masses, kind=None):
+        """
+        Initializes a ParticleEnsemble (the arrays are copied).
+        Args:
+            positions (np.array): (E,N,3) positions.
+            velocities (np.array): (E,N,3) velocities.
+            masses (np.array): (E,N) masses.
+            kind (np.array): (N,) kinds; None makes every particle a star.
+        """
+        self.positions = np.array(positions, dtype=np.float64)
+        if self.positions.ndim != 3 or self.positions.shape[2] != 3:
+            raise ValueError(f"Expected (E, N, 3) positions, got shape {self.positions.shape}.")
+        num_members, num_particles = self.positions.shape[:2]
+        self.velocities = np.array(velocities, dtype=np.float64).reshape(num_members, num_particles, 3)
+        self.masses = np.array(masses, dtype=np.float64).reshape(num_members, num_particles)
+        self.kind = np.zeros(num_particles, dtype=np.uint8) if kind is None else np.array(kind, dtype=np.uint8).reshape(num_particles)
+
+    @classmethod
+    def from_particle_sets(cls, particle_sets):
+        """
+        Stacks ParticleSets that share one particle layout (count and kinds).
+        Args:
+            particle_sets (list): ParticleSet per member.
+        Returns:
+            ParticleEnsemble: The stacked members.
+        """
+        if len(particle_sets) == 0:
+            raise ValueError("An ensemble needs at least one member.")
+        kind = particle_sets[0].kind
+        if any(len(member) != len(kind) or not np.array_equal(member.kind, kind) for member in particle_sets):
+            raise ValueError("All ensemble members must have the same number and kinds of particles.")
+        return cls(np.stack([member.positions for member in particle_sets]),
+                   np.stack([member.velocities for member in particle_sets]),
+                   np.stack([member.masses for member in particle_sets]), kind)
+
+    @property
+    def num_members(self):
+        return self.positions.shape[0]
+
+    @property
+    def num_particles(self):
+        return self.positions.shape[1]
+
+    @property
+    def is_black_hole(self):
+        return self.kind == KIND_BLACK_HOLE
+
+    def member(self, index):
+        """
+        Returns member index as a ParticleSet whose arrays are views into the ensemble, so
+        code written for a single ParticleSet (form_disk, compute_forces, ...) updates it in place.
+        """
+        return ParticleSet(self.positions[index], self.velocities[index], self.masses[index], self.kind, copy=False)
+
+    def flat(self):
+        """Returns (E*N,3) positions, (E*N,3) velocities and (E*N,) masses as views of the stacked arrays."""
+        num_rows = self.num_members * self.num_particles
+        return self.positions.reshape(num_rows, 3), self.velocities.reshape(num_rows, 3), self.masses.reshape(num_rows)
+
+
+def initialize_ensemble(rng_seeds, *args, **kwargs):
+    """
+    Draws one realization of initialize_particles per seed. Each member gets its own
+    random.Random(seed) and its own NumPy generator for the BH masses, so members are
+    independent of each other and of the global random state.
+    Args:
+        rng_seeds (list): One seed per member.
+        *args: Positional arguments of initialize_particles (num_stars, num_bhs, spheroid axes, velocity dispersion).
+        **kwargs: Keyword arguments of initialize_particles (except rng, bh_mass_rng and as_particle_set).
+    Returns:
+        ParticleEnsemble: The members, stars first and then black holes in every member.
+    """
+    return ParticleEnsemble.from_particle_sets([
+        initialize_particles(*args, rng=random.Random(seed), bh_mass_rng=np.random.default_rng(seed),
+                             as_particle_set=True, **kwargs)
+        for seed in rng_seeds])
+
+
+class EnsembleForceState:
+    """
+    Per-run state of ensemble force evaluations.
+    Attributes:
+        field_state (ForceEngineState): Holds the shell background and external field shared by all members.
+        pair_state (ForceEngineState or None): State of the single offset pass of the localized engine (float64).
+        member_states (list or None): One ForceEngineState per member for the other engines and mixed precision.
+        member_spacing (float): Current x offset between consecutive members (kpc).
+        num_evaluations (int): Number of ensemble force evaluations.
+        force_time (float): Wall-clock time spent in them (s).
+    """
+    def __init__(self, sim_params, num_members, external_field=None, spheroidal_params=None):
+        """
+        Initializes EnsembleForceState.
+        Args:
+            sim_params (SimulationParams): Simulation parameters.
+            num_members (int): Number of ensemble members.
+            external_field (GalacticPotential): Optional analytic external field.
+            spheroidal_params (SpheroidalParams): Spheroid for the SCF scale length (see ForceEngineState).
+        """
+        self.sim_params = sim_params
+        self.field_state = ForceEngineState(sim_params, external_field)
+        self.pair_state = None
+        self.member_states = None
+        if sim_params.force_engine == "localized" and sim_params.force_precision != "mixed":
+            self.pair_state = ForceEngineState(sim_params)
+        else:
+            self.member_states = [ForceEngineState(sim_params, None, spheroidal_params) for _ in range(num_members)]
+        self.member_spacing = 0.0
+        self.num_evaluations = 0
+        self.force_time = 0.0
+
+    def set_step(self, step):
+        """Sets the current step on every member state (SCF refit schedule)."""
+        for state in self.member_states or ():
+            state.step = step
+
+    def spacing_for(self, positions):
+        """Returns a member spacing that keeps the shifted members further apart than the interaction radius."""
+        span = float(positions[..., 0].max() - positions[..., 0].min())
+        needed = span + self.sim_params.interaction_radius_kpc
+        if self.member_spacing <= needed:  # Grow with headroom; a neighbour list rebuilds on the jump
+            self.member_spacing = MEMBER_SPACING_GROWTH * needed + 1.0
+        return self.member_spacing
+
+
+def ensemble_forces(ensemble, shells, sim_params, state, times):
+    """
+    Calculates the (E,N,3) forces on every member: self-gravity within each member, plus the
+    shell background and external field. The float64 localized engine runs once over all members
+    shifted apart along x; the other engines (whose interactions are not cut off) and mixed
+    precision (whose float32 copies are centred on each member) run per member.
+    Args:
+        ensemble (ParticleEnsemble): The members.
+        shells (list): List of SpheroidalShell objects for the background field.
+        sim_params (SimulationParams): Simulation parameters.
+        state (EnsembleForceState): Per-run state.
+        times (np.array): (E,) simulation time of each member, for time-dependent external fields.
+    Returns:
+        np.array: (E,N,3) forces.
+    """
+    start = perf_counter()
+    num_members, num_particles = ensemble.num_members, ensemble.num_particles
+    positions, _, masses = ensemble.flat()
+    if state.pair_state is not None:
+        offsets = np.zeros((num_members, 1, 3))
+        offsets[:, 0, 0] = state.spacing_for(ensemble.positions) * np.arange(num_members)
+        shifted = (ensemble.positions + offsets).reshape(-1, 3)
+        is_black_hole = np.tile(ensemble.is_black_hole, num_members)
+        forces = compute_forces((shifted, masses, is_black_hole), [], sim_params, state.pair_state)
+    else:
+        forces = np.empty((num_members * num_particles, 3))
+        for index, member_state in enumerate(state.member_states):
+            rows = slice(index * num_particles, (index + 1) * num_particles)
+            forces[rows] = compute_forces(ensemble.member(index), [], sim_params, member_state)
+
+    forces += background_forces(positions, state.field_state.background_for(shells))  # One pass over all members
+    forces = forces.reshape(num_members, num_particles, 3)
+    external_field = state.field_state.external_field
+    if external_field is not None:
+        for index in range(num_members):
+            forces[index] += ensemble.masses[index, :, None] * external_field.accelerations(ensemble.positions[index], times[index])
+    state.num_evaluations += 1
+    state.force_time += perf_counter() - start
+    return forces
+
+
+def _member_diagnostics(ensemble, index):
+    """Star positions, star count, velocity dispersion and largest BH mass of one member."""
+    stars = ensemble.kind == KIND_STAR
+    speeds = np.linalg.norm(ensemble.velocities[index, stars], axis=1)
+    return (ensemble.positions[index, stars].copy(), int(np.count_nonzero(stars)),
+            float(np.std(speeds)) if len(speeds) else 0.0,
+            float(np.max(ensemble.masses[index, ~stars], initial=0.0)))
+
+
+def run_ensemble_simulation_ga(n_steps, initial_ensemble, shells, sim_params, disk_formation_step, disk_params,
+                               spiral_params, spheroidal_params, rng_seeds, external_potential=None):
+    """
+    Runs E realizations with kick-drift-kick Verlet steps in one vectorized state. Every member
+    keeps its own adaptive time step, simulation time, random stream (random.Random(seed),
+    used for disk formation) and diagnostics. Morton re-sorting is not applied to ensembles.
+    Args:
+        n_steps (int): Number of steps.
+        initial_ensemble (ParticleEnsemble): Initial members (copied; see initialize_ensemble).
+        shells (list): List of SpheroidalShell objects for the background field.
+        sim_params (SimulationParams): Simulation parameters (Verlet integrator, no block time-steps).
+        disk_formation_step (int): Step at which every member forms its disk.
+        disk_params (DiskParams): Disk parameters.
+        spiral_params (SpiralParams): Spiral arm parameters.
+        spheroidal_params (SpheroidalParams): Spheroid parameters (SCF scale length).
+        rng_seeds (list): One seed per member.
+        external_potential (GalacticPotential): Optional analytic external field.
+    Returns:
+        tuple: (final ParticleEnsemble, list of per-member diagnostics dicts).
+    """
+    if sim_params.integrator != "verlet" or sim_params.block_timestep_levels > 0:
+        raise ValueError("Ensemble runs support the verlet integrator with a global time step only.")
+    num_members = initial_ensemble.num_members
+    if len(rng_seeds) != num_members:
+        raise ValueError(f"Expected {num_members} seeds, got {len(rng_seeds)}.")
+    ensemble = ParticleEnsemble(initial_ensemble.positions, initial_ensemble.velocities, initial_ensemble.masses,
+                                initial_ensemble.kind)
+    num_particles = ensemble.num_particles
+    rngs = [random.Random(seed) for seed in rng_seeds]
+    diagnostics = [{"star_positions_over_time": [], "star_counts": [], "velocity_dispersions": [], "max_bh_mass": [],
+                    "dt_per_step": [], "rng_seed": seed} for seed in rng_seeds]
+    log_message(sim_params, 1, f"Starting ensemble simulation of {num_members} members x {num_particles} particles...")
+
+    force_state = EnsembleForceState(sim_params, num_members, external_potential, spheroidal_params)
+    times = np.zeros(num_members)
+    forces = ensemble_forces(ensemble, shells, sim_params, force_state, times)
+    positions, velocities, masses = ensemble.flat()
+    for step in range(1, n_steps + 1):
+        dts = np.array([timestep(forces[index], ensemble.velocities[index], ensemble.masses[index], sim_params)
+                        for index in range(num_members)])
+        dt_rows = np.repeat(dts, num_particles)
+        kick_drift(positions, velocities, forces.reshape(-1, 3), masses, 0.5 * dt_rows, dt_rows) # Kick (half step) and drift
+        if step == disk_formation_step:
+            for index in range(num_members):
+                form_disk(ensemble.member(index), disk_params, spiral_params, rngs[index])
+        force_state.set_step(step)
+        forces = ensemble_forces(ensemble, shells, sim_params, force_state, times + dts)
+        kick(velocities, forces.reshape(-1, 3), masses, 0.5 * dt_rows) # Kick (half step)
+        times += dts
+
+        for index, member_diagnostics in enumerate(diagnostics):
+            member_diagnostics["dt_per_step"].append(float(dts[index]))
+            if step % sim_params.output_interval == 0:
+                star_positions, num_stars, dispersion, max_mass = _member_diagnostics(ensemble, index)
+                member_diagnostics["star_positions_over_time"].append(star_positions)
+                member_diagnostics["star_counts"].append(num_stars)
+                member_diagnostics["velocity_dispersions"].append(dispersion)
+                member_diagnostics["max_bh_mass"].append(max_mass)
+        logging.debug(f"Ensemble step {step}: dt from {dts.min():.3e} to {dts.max():.3e}")
+
+    log_message(sim_params, 1, f"Ensemble simulation complete: {force_state.num_evaluations} force evaluations, "
+                               f"{force_state.force_time:.2f} s in forces")
+    return ensemble, diagnostics
+
+
+if __name__ == '__main__':
+    import copy
+    import time
+    from run_simulations import create_default_shells
+    from src.galactic_potential import SpheroidalParams, DiskParams, SpiralParams
+    from src.simulation_params import SimulationParams
+    from src.simulation import run_n_body_simulation_ga
+
+    logging.disable(logging.INFO)
+    spheroid = SpheroidalParams(15.0, 15.0, 4.0, 80.0)
+    shells_example = create_default_shells(spheroid, total_mass=80.0)
+    disk = DiskParams(M=40.0, a=4.0, b=0.2, disk_radius=12.0, disk_thickness=0.8, v_circ_factor=0.9, velocity_dispersion=15.0)
+    spiral = SpiralParams(num_arms=2, pitch_angle=0.2, pattern_speed=0.8, amplitude_pos=0.05, amplitude_vel=5.0, scale_length=4.0)
+    seeds = list(range(100, 116))
+    num_steps = 20
+    disk_step = 5  # Inside the run, so both paths form the disk (from each member's seed)
+    members = initialize_ensemble(seeds, 200, 3, 15.0, 15.0, 4.0, 50.0, bh_mass_min=40.0, bh_mass_max=150.0,
+                                  bh_a_scale=0.4, bh_b_scale=0.4, bh_c_scale=0.4)
+
+    for engine, precision in (("localized", "float64"), ("localized", "mixed"), ("direct", "float64")):
+        params = SimulationParams(0.01, 0.5, 0.1, 0.08, 2.0, 0, 1000, "INFO", force_engine=engine, force_precision=precision)
+        run_ensemble_simulation_ga(2, members, shells_example, params, num_steps + 1, disk, spiral, spheroid, seeds)  # Warm up
+        start = time.perf_counter()
+        final, member_diagnostics = run_ensemble_simulation_ga(num_steps, members, shells_example, params, disk_step,
+                                                               disk, spiral, spheroid, seeds)
+        ensemble_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        deviation = 0.0
+        for index in range(members.num_members):  # The same members as separate runs
+            single, _ = run_n_body_simulation_ga(num_steps, members.member(index).copy(), shells_example, copy.copy(params),
+                                                 disk_step, disk, spiral, 1.0, spheroid, seeds[index])
+            deviation = max(deviation, float(np.max(np.abs(single.positions - final.positions[index]))))
+        separate_time = time.perf_counter() - start
+        print(f"{engine} ({precision}): {members.num_members} members x {members.num_particles} particles, {num_steps} steps: "
+              f"ensemble {ensemble_time:.2f} s, separate runs {separate_time:.2f} s ({separate_time / ensemble_time:.1f}x), "
+              f"max position difference {deviation:.1e} kpc")
+    final_dts = [diagnostics["dt_per_step"][-1] for diagnostics in member_diagnostics]
+    print(f"Final time steps across members: {np.min(final_dts):.3e} to {np.max(final_dts):.3e}")
+# --- END OF FILE ensemble.py ---
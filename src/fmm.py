@@ -0,0 +1,381 @@
+# src/fmm.py
+#--- START OF FILE fmm.py ---
+# src/fmm.py
+import numpy as np
+from numba import njit, prange
+from src.galactic_potential import G  # Gravitational Constant
+from src.barnes_hut import Octree, NODE_START, NODE_COUNT, NODE_FIRST_CHILD, NODE_NUM_CHILDREN
+from src.direct_summation import sampled_force_error
+
+# Cartesian Taylor-series Fast Multipole Method.
+#
+# With f(R) = 1/|R|, D_k(R) = d^k f / dR^k and multi-index powers x^k / k!, a node with centre c holds
+#   M_a = sum_j m_j (c - x_j)^a / a!                      (P2M, M2M)
+# and a node with centre z holds a local expansion of phi(y) = sum_j m_j / |y - x_j|
+#   phi(z + u) = sum_b L_b u^b / b!,   L_b = sum_a M_a D_{a+b}(z - c)   (M2L, L2L)
+# All expansions are truncated at total order p, so every translation is a fixed sparse table of
+# (output term, input term, shift monomial) triplets that the Numba kernels below apply.
+
+DEFAULT_LEAF_SIZE = 16
+
+
+class ExpansionTables:
+    """
+    Multi-index bookkeeping and translation tables for a given expansion order.
+    Attributes:
+        order (int): Expansion order p.
+        terms (np.array): (T,3) multi-indices with total degree <= p, grouped by degree.
+        inv_factorials (np.array): (T,) 1 / (a! b! c!) for each term.
+        m2m (np.array): (K,3) rows (output, input, shift) for M2M: M'_a += M_b s^(a-b)/(a-b)!.
+        l2l (np.array): (K,3) rows (output, input, shift) for L2L: L'_g += L_b s^(b-g)/(b-g)!.
+        m2l (np.array): (K,3) rows (output b, input a, derivative a+b) for M2L.
+        gradient (np.array): (3,T) index of the term g + e_axis, or -1 if it exceeds order p.
+    """
+    def __init__(self, order):
+        """
+        Builds the tables.
+        Args:
+            order (int): Expansion order p (>= 1).
+        """
+        self.order = int(order)
+        p = self.order
+        terms = [(a, b, n - a - b) for n in range(p + 1) for a in range(n, -1, -1) for b in range(n - a, -1, -1)]
+        self.terms = np.array(terms, dtype=np.int64)
+        lookup = -np.ones((p + 1, p + 1, p + 1), dtype=np.int64)
+        for t, (a, b, c) in enumerate(terms):
+            lookup[a, b, c] = t
+        factorial = np.cumprod(np.concatenate(([1.0], np.arange(1, p + 1, dtype=np.float64))))
+        self.inv_factorials = 1.0 / factorial[self.terms].prod(axis=1)
+
+        m2m, l2l, m2l = [], [], []
+        for out_t, out_k in enumerate(terms):
+            for in_t, in_k in enumerate(terms):
+                if all(i <= o for i, o in zip(in_k, out_k)):
+                    shift = lookup[out_k[0] - in_k[0], out_k[1] - in_k[1], out_k[2] - in_k[2]]
+                    m2m.append((out_t, in_t, shift))
+                if all(o <= i for i, o in zip(in_k, out_k)):
+                    shift = lookup[in_k[0] - out_k[0], in_k[1] - out_k[1], in_k[2] - out_k[2]]
+                    l2l.append((out_t, in_t, shift))
+                if sum(out_k) + sum(in_k) <= p:
+                    derivative = lookup[out_k[0] + in_k[0], out_k[1] + in_k[1], out_k[2] + in_k[2]]
+                    m2l.append((out_t, in_t, derivative))
+        self.m2m = np.array(m2m, dtype=np.int64)
+        self.l2l = np.array(l2l, dtype=np.int64)
+        self.m2l = np.array(m2l, dtype=np.int64)
+
+        self.gradient = -np.ones((3, len(terms)), dtype=np.int64)
+        for t, k in enumerate(terms):
+            for axis in range(3):
+                raised = list(k)
+                raised[axis] += 1
+                if sum(raised) <= p:
+                    self.gradient[axis, t] = lookup[raised[0], raised[1], raised[2]]
+        self.lookup = lookup
+
+
+@njit(cache=True)
+def _scaled_monomials(dx, dy, dz, terms, inv_factorials, out):
+    """Fills out[t] = d^k / k! for every term k."""
+    for t in range(terms.shape[0]):
+        out[t] = dx ** terms[t, 0] * dy ** terms[t, 1] * dz ** terms[t, 2] * inv_factorials[t]
+
+
+@njit(cache=True)
+def _derivative_tensor(rx, ry, rz, terms, lookup, inv_factorials, out):
+    """Fills out[t] = D_k (1/|R|) using the recurrence for the Taylor coefficients a_k = D_k / k!:
+    |R|^2 n a_k + (2n - 1) sum_i R_i a_(k - e_i) + (n - 1) sum_i a_(k - 2 e_i) = 0."""
+    r_sq = rx * rx + ry * ry + rz * rz
+    out[0] = 1.0 / np.sqrt(r_sq)
+    r_comp = (rx, ry, rz)
+    for t in range(1, terms.shape[0]):
+        k0, k1, k2 = terms[t, 0], terms[t, 1], terms[t, 2]
+        n = k0 + k1 + k2
+        first = 0.0
+        second = 0.0
+        for axis in range(3):
+            a = k0 - (1 if axis == 0 else 0)
+            b = k1 - (1 if axis == 1 else 0)
+            c = k2 - (1 if axis == 2 else 0)
+            if a >= 0 and b >= 0 and c >= 0:
+                first += r_comp[axis] * out[lookup[a, b, c]]
+            a = k0 - (2 if axis == 0 else 0)
+            b = k1 - (2 if axis == 1 else 0)
+            c = k2 - (2 if axis == 2 else 0)
+            if a >= 0 and b >= 0 and c >= 0:
+                second += out[lookup[a, b, c]]
+        out[t] = -((2 * n - 1) * first + (n - 1) * second) / (r_sq * n)
+    for t in range(terms.shape[0]):  # Taylor coefficients -> derivatives
+        out[t] /= inv_factorials[t]
+
+
+@njit(cache=True)
+def _node_radii(positions, order, node_links, node_com):
+    num_nodes = node_links.shape[0]
+    radii = np.zeros(num_nodes)
+    for k in range(num_nodes):
+        start = node_links[k, NODE_START]
+        r_max_sq = 0.0
+        for idx in range(start, start + node_links[k, NODE_COUNT]):
+            p = order[idx]
+            dx = positions[p, 0] - node_com[k, 0]
+            dy = positions[p, 1] - node_com[k, 1]
+            dz = positions[p, 2] - node_com[k, 2]
+            r_max_sq = max(r_max_sq, dx * dx + dy * dy + dz * dz)
+        radii[k] = np.sqrt(r_max_sq)
+    return radii
+
+
+@njit(cache=True)
+def _upward_pass(positions, masses, order, node_links, node_com, terms, inv_factorials, m2m):
+    """P2M at the leaves and M2M into the parents (children always follow their parent)."""
+    num_nodes = node_links.shape[0]
+    num_terms = terms.shape[0]
+    multipoles = np.zeros((num_nodes, num_terms))
+    monomials = np.empty(num_terms)
+    for k in range(num_nodes - 1, -1, -1):
+        if node_links[k, NODE_NUM_CHILDREN] == 0:
+            start = node_links[k, NODE_START]
+            for idx in range(start, start + node_links[k, NODE_COUNT]):
+                p = order[idx]
+                _scaled_monomials(node_com[k, 0] - positions[p, 0], node_com[k, 1] - positions[p, 1],
+                                  node_com[k, 2] - positions[p, 2], terms, inv_factorials, monomials)
+                for t in range(num_terms):
+                    multipoles[k, t] += masses[p] * monomials[t]
+        else:
+            first = node_links[k, NODE_FIRST_CHILD]
+            for c in range(first, first + node_links[k, NODE_NUM_CHILDREN]):
+                _scaled_monomials(node_com[k, 0] - node_com[c, 0], node_com[k, 1] - node_com[c, 1],
+                                  node_com[k, 2] - node_com[c, 2], terms, inv_factorials, monomials)
+                for row in range(m2m.shape[0]):
+                    multipoles[k, m2m[row, 0]] += multipoles[c, m2m[row, 1]] * monomials[m2m[row, 2]]
+    return multipoles
+
+
+@njit(cache=True)
+def _dual_tree_walk(node_links, node_com, node_radii, node_box, theta):
+    """Builds the M2L and P2P interaction lists as (target node, source node) pairs."""
+    stack = np.empty((64, 2), dtype=np.int64)
+    m2l_pairs = np.empty((64, 2), dtype=np.int64)
+    p2p_pairs = np.empty((64, 2), dtype=np.int64)
+    num_m2l = 0
+    num_p2p = 0
+    stack[0, 0] = 0
+    stack[0, 1] = 0
+    top = 1
+    while top > 0:
+        top -= 1
+        a = stack[top, 0]
+        b = stack[top, 1]
+        if a != b:
+            dx = node_com[a, 0] - node_com[b, 0]
+            dy = node_com[a, 1] - node_com[b, 1]
+            dz = node_com[a, 2] - node_com[b, 2]
+            separation = np.sqrt(dx * dx + dy * dy + dz * dz)
+            if node_radii[a] + node_radii[b] < theta * separation:  # Well separated: M2L from b into a
+                if num_m2l == m2l_pairs.shape[0]:
+                    grown = np.empty((2 * num_m2l, 2), dtype=np.int64)
+                    grown[:num_m2l] = m2l_pairs
+                    m2l_pairs = grown
+                m2l_pairs[num_m2l, 0] = a
+                m2l_pairs[num_m2l, 1] = b
+                num_m2l += 1
+                continue
+        a_leaf = node_links[a, NODE_NUM_CHILDREN] == 0
+        b_leaf = node_links[b, NODE_NUM_CHILDREN] == 0
+        if a_leaf and b_leaf:
+            if num_p2p == p2p_pairs.shape[0]:
+                grown = np.empty((2 * num_p2p, 2), dtype=np.int64)
+                grown[:num_p2p] = p2p_pairs
+                p2p_pairs = grown
+            p2p_pairs[num_p2p, 0] = a
+            p2p_pairs[num_p2p, 1] = b
+            num_p2p += 1
+            continue
+        if top + 8 > stack.shape[0]:
+            grown = np.empty((2 * stack.shape[0], 2), dtype=np.int64)
+            grown[:top] = stack[:top]
+            stack = grown
+        if b_leaf or (not a_leaf and node_box[a, 3] >= node_box[b, 3]):  # Split the larger node
+            first = node_links[a, NODE_FIRST_CHILD]
+            for c in range(first, first + node_links[a, NODE_NUM_CHILDREN]):
+                stack[top, 0] = c
+                stack[top, 1] = b
+                top += 1
+        else:
+            first = node_links[b, NODE_FIRST_CHILD]
+            for c in range(first, first + node_links[b, NODE_NUM_CHILDREN]):
+                stack[top, 0] = a
+                stack[top, 1] = c
+                top += 1
+    return m2l_pairs[:num_m2l].copy(), p2p_pairs[:num_p2p].copy()
+
+
+def _group_by_target(pairs, num_nodes):
+    """Sorts (target, source) pairs by target and returns CSR offsets and the sorted sources."""
+    order = np.argsort(pairs[:, 0], kind='stable')
+    sources = np.ascontiguousarray(pairs[order, 1])
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pairs[:, 0], minlength=num_nodes), out=offsets[1:])
+    return offsets, sources
+
+
+@njit(parallel=True, cache=True)
+def _m2l_pass(m2l_offsets, m2l_sources, node_com, multipoles, terms, lookup, inv_factorials, m2l):
+    num_nodes = node_com.shape[0]
+    num_terms = terms.shape[0]
+    locals_ = np.zeros((num_nodes, num_terms))
+    for a in prange(num_nodes):
+        derivatives = np.empty(num_terms)
+        for s in range(m2l_offsets[a], m2l_offsets[a + 1]):
+            b = m2l_sources[s]
+            _derivative_tensor(node_com[a, 0] - node_com[b, 0], node_com[a, 1] - node_com[b, 1],
+                               node_com[a, 2] - node_com[b, 2], terms, lookup, inv_factorials, derivatives)
+            for row in range(m2l.shape[0]):
+                locals_[a, m2l[row, 0]] += multipoles[b, m2l[row, 1]] * derivatives[m2l[row, 2]]
+    return locals_
+
+
+@njit(cache=True)
+def _downward_pass(locals_, node_links, node_com, terms, inv_factorials, l2l):
+    """L2L from every parent into its children (parents are processed first)."""
+    monomials = np.empty(terms.shape[0])
+    for k in range(node_links.shape[0]):
+        first = node_links[k, NODE_FIRST_CHILD]
+        for c in range(first, first + node_links[k, NODE_NUM_CHILDREN]):
+            _scaled_monomials(node_com[c, 0] - node_com[k, 0], node_com[c, 1] - node_com[k, 1],
+                              node_com[c, 2] - node_com[k, 2], terms, inv_factorials, monomials)
+            for row in range(l2l.shape[0]):
+                locals_[c, l2l[row, 0]] += locals_[k, l2l[row, 1]] * monomials[l2l[row, 2]]
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _evaluation_pass(positions, masses, order, node_links, node_com, locals_, p2p_offsets, p2p_sources,
+                     terms, inv_factorials, gradient, softening_sq, is_target):
+    """L2P and P2P for the flagged particles of every leaf; returns accelerations in units of G."""
+    num_nodes = node_links.shape[0]
+    num_terms = terms.shape[0]
+    accelerations = np.zeros((positions.shape[0], 3))
+    for a in prange(num_nodes):
+        if node_links[a, NODE_NUM_CHILDREN] != 0:
+            continue
+        monomials = np.empty(num_terms)
+        start = node_links[a, NODE_START]
+        for idx in range(start, start + node_links[a, NODE_COUNT]):
+            i = order[idx]
+            if not is_target[i]:
+                continue
+            xi = positions[i, 0]
+            yi = positions[i, 1]
+            zi = positions[i, 2]
+            _scaled_monomials(xi - node_com[a, 0], yi - node_com[a, 1], zi - node_com[a, 2],
+                              terms, inv_factorials, monomials)
+            ax = 0.0
+            ay = 0.0
+            az = 0.0
+            for t in range(num_terms):  # grad phi = sum_g L_(g + e_axis) u^g / g!
+                if gradient[0, t] >= 0:
+                    ax += locals_[a, gradient[0, t]] * monomials[t]
+                if gradient[1, t] >= 0:
+                    ay += locals_[a, gradient[1, t]] * monomials[t]
+                if gradient[2, t] >= 0:
+                    az += locals_[a, gradient[2, t]] * monomials[t]
+            for s in range(p2p_offsets[a], p2p_offsets[a + 1]):
+                b = p2p_sources[s]
+                source_start = node_links[b, NODE_START]
+                for jdx in range(source_start, source_start + node_links[b, NODE_COUNT]):
+                    j = order[jdx]
+                    if j == i:
+                        continue
+                    rx = positions[j, 0] - xi
+                    ry = positions[j, 1] - yi
+                    rz = positions[j, 2] - zi
+                    r_sq = rx * rx + ry * ry + rz * rz + softening_sq
+                    if r_sq == 0.0:
+                        continue
+                    inv_r3 = masses[j] / (r_sq * np.sqrt(r_sq))
+                    ax += rx * inv_r3
+                    ay += ry * inv_r3
+                    az += rz * inv_r3
+            accelerations[i, 0] = ax
+            accelerations[i, 1] = ay
+            accelerations[i, 2] = az
+    return accelerations
+
+
+_TABLES = {}
+
+
+def expansion_tables(order):
+    """Returns the (cached) ExpansionTables for an expansion order."""
+    if order not in _TABLES:
+        _TABLES[order] = ExpansionTables(order)
+    return _TABLES[order]
+
+
+def fmm_forces(positions, masses, order, theta, softening_length, leaf_size=DEFAULT_LEAF_SIZE, targets=None):
+    """
+    Calculates the full self-gravity of all particles with a Cartesian Fast Multipole Method.
+    The adaptive octree is shared with the Barnes-Hut engine. A dual tree walk splits node pairs
+    into well-separated M2L interactions and leaf-leaf direct sums; the cost is O(N) for a fixed
+    expansion order. Accuracy is controlled by the expansion order and the separation
+    parameter theta: a node pair interacts through expansions when r_a + r_b < theta * d.
+    Expansions use the unsoftened 1/r kernel, so softening only applies to the near field.
+    With targets the expansions are still built from all particles, but the leaf evaluation
+    (L2P and P2P, most of the cost) only runs for the targets.
+    Args:
+        positions (np.array): (N,3) particle positions (kpc).
+        masses (np.array): (N,) particle masses.
+        order (int): Expansion order p (higher is more accurate).
+        theta (float): Separation parameter in (0, 1) (smaller is more accurate).
+        softening_length (float): Plummer softening for the near-field direct sums (kpc).
+        leaf_size (int): Maximum number of particles in a leaf node.
+        targets (np.array): Indices of the particles to evaluate; None evaluates all of them.
+    Returns:
+        np.array: (N,3) array of gravitational forces, or (len(targets),3) when targets is given.
+    """
+    positions = np.ascontiguousarray(positions, dtype=np.float64)
+    masses = np.ascontiguousarray(masses, dtype=np.float64)
+    num_particles = len(positions)
+    targets = np.arange(num_particles) if targets is None else np.asarray(targets, dtype=np.int64)
+    if num_particles < 2 or len(targets) == 0:
+        return np.zeros((len(targets), 3))
+    is_target = np.zeros(num_particles, dtype=np.bool_)
+    is_target[targets] = True
+
+    tables = expansion_tables(int(order))
+    tree = Octree(positions, masses, leaf_size)
+    num_nodes = tree.num_nodes
+    radii = _node_radii(positions, tree.order, tree.node_links, tree.node_com)
+    multipoles = _upward_pass(positions, masses, tree.order, tree.node_links, tree.node_com,
+                              tables.terms, tables.inv_factorials, tables.m2m)
+    m2l_pairs, p2p_pairs = _dual_tree_walk(tree.node_links, tree.node_com, radii, tree.node_box, float(theta))
+    m2l_offsets, m2l_sources = _group_by_target(m2l_pairs, num_nodes)
+    p2p_offsets, p2p_sources = _group_by_target(p2p_pairs, num_nodes)
+    locals_ = _m2l_pass(m2l_offsets, m2l_sources, tree.node_com, multipoles,
+                        tables.terms, tables.lookup, tables.inv_factorials, tables.m2l)
+    _downward_pass(locals_, tree.node_links, tree.node_com, tables.terms, tables.inv_factorials, tables.l2l)
+    accelerations = _evaluation_pass(positions, masses, tree.order, tree.node_links, tree.node_com, locals_,
+                                     p2p_offsets, p2p_sources, tables.terms, tables.inv_factorials,
+                                     tables.gradient, float(softening_length) ** 2, is_target)
+    return G * accelerations[targets] * masses[targets, None]
+
+
+if __name__ == '__main__':
+    import time
+
+    rng = np.random.default_rng(42)
+    num_particles = 20000
+    positions_example = rng.normal(scale=5.0, size=(num_particles, 3))
+    masses_example = rng.uniform(0.5, 2.0, size=num_particles)
+    softening = 0.08
+
+    for order in (2, 4, 6):
+        for theta in (0.4, 0.6):
+            fmm_forces(positions_example[:100], masses_example[:100], order, theta, softening)  # Compile
+            start = time.perf_counter()
+            forces_fmm = fmm_forces(positions_example, masses_example, order, theta, softening)
+            elapsed = time.perf_counter() - start
+            error = sampled_force_error(positions_example, masses_example, forces_fmm, softening, rng=rng)
+            print(f"order = {order}, theta = {theta:.1f}: {elapsed * 1e3:.0f} ms, "
+                  f"median relative force error {error['median']:.2e}, max {error['max']:.2e}")
+# --- END OF FILE fmm.py ---
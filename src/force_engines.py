@@ -0,0 +1,378 @@
+# src/force_engines.py
+#--- START OF FILE force_engines.py ---
+# src/force_engines.py
+import copy
+import numpy as np
+from time import perf_counter
+from src.forces import (localized_gravity_forces, localized_force_derivatives, particle_arrays, background_forces,
+                        black_hole_mask)
+from src.direct_summation import direct_forces, direct_forces_and_jerks, relative_force_error
+from src.barnes_hut import barnes_hut_forces
+from src.fmm import fmm_forces
+from src.treepm import treepm_forces
+from src.neighbour_list import NeighbourList
+from src.shell_potential import build_shell_background
+from src.homoeoid import build_homoeoid_background
+from src.scf import SCFExpansion, scf_forces, scf_scale_length
+from src.simulation_params import FORCE_ENGINES, JERK_ENGINES
+
+# The shell background and external field have no jerk kernel; their force derivative along a
+# particle's path is taken by central differences over a displacement of FIELD_DIFFERENCE_LENGTH
+# (kpc), and the explicit time dependence of the external field over FIELD_DIFFERENCE_TIME (Myr)
+FIELD_DIFFERENCE_LENGTH = 1e-5
+FIELD_DIFFERENCE_TIME = 1e-5
+
+
+class ForceEngineState:
+    """
+    Per-run state carried between force evaluations.
+    Attributes:
+        neighbour_list (NeighbourList or None): Cached neighbour pairs for the localized engine.
+        shell_background (object or None): Prepared shell background (see background_for).
+        external_field (GalacticPotential or None): Analytic external field added to every force evaluation.
+        scf_expansion (SCFExpansion or None): Basis expansion of the SCF engine.
+        jerks (np.array or None): (N,3) force time derivatives at the current positions, carried
+            between Hermite steps by the caller (None when not evaluated yet).
+        step (int): Current simulation step, set by the caller; the SCF engine refits its
+            coefficients once step has advanced by scf_update_interval since the last fit.
+        num_evaluations (int): Number of compute_forces calls with this state.
+        num_particle_forces (int): Number of per-particle forces those calls evaluated (active particles only).
+        force_time (float): Wall-clock time spent in those calls (s).
+    """
+    def __init__(self, sim_params, external_field=None, spheroidal_params=None):
+        """
+        Initializes ForceEngineState.
+        Args:
+            sim_params (SimulationParams): Simulation parameters.
+            external_field (GalacticPotential): Optional analytic external field.
+            spheroidal_params (SpheroidalParams): Spheroid used to pick the SCF scale length when
+                sim_params.scf_scale_length is None (without it the particles' half-mass radius is used).
+        """
+        self.sim_params = sim_params
+        self.external_field = external_field
+        self.neighbour_list = None
+        self.shell_background = None
+        self._shell_source = None
+        self.scf_expansion = None
+        self.step = 0
+        self._scf_fit_step = None
+        self.jerks = None
+        self.num_evaluations = 0
+        self.num_particle_forces = 0
+        self.force_time = 0.0
+        if sim_params.force_engine == "localized" and sim_params.neighbour_skin > 0:
+            self.neighbour_list = NeighbourList(sim_params.interaction_radius_kpc, sim_params.neighbour_skin)
+        if sim_params.force_engine == "scf":
+            scale_length = sim_params.scf_scale_length
+            if scale_length is None and spheroidal_params is not None:
+                scale_length = scf_scale_length(spheroidal_params)
+            self.scf_expansion = SCFExpansion(sim_params.scf_nmax, sim_params.scf_lmax, scale_length)
+
+    def particles_reordered(self):
+        """Drops caches indexed by particle row after the particle arrays were permuted."""
+        if self.neighbour_list is not None:
+            self.neighbour_list.invalidate()
+
+    def scf_needs_fit(self):
+        """Returns True if the SCF coefficients are missing or scf_update_interval steps old."""
+        return self._scf_fit_step is None or self.step - self._scf_fit_step >= self.sim_params.scf_update_interval
+
+    def scf_fitted(self):
+        """Records that the SCF coefficients were fitted at the current step."""
+        self._scf_fit_step = self.step
+
+    def checkpoint_state(self):
+        """
+        Returns what a restarted run needs to continue bit-identically: the counters, the SCF
+        fit schedule and coefficients, the neighbour list and the carried jerks. The arrays are
+        not copied; evaluations replace them rather than writing into them (jerks excepted,
+        which the caller copies along with the particle arrays).
+        Returns:
+            tuple: (dict of JSON-serializable scalars, dict of arrays).
+        """
+        scalars = {"step": self.step, "scf_fit_step": self._scf_fit_step, "num_evaluations": self.num_evaluations,
+                   "num_particle_forces": self.num_particle_forces, "force_time": self.force_time}
+        arrays = {}
+        if self.jerks is not None:
+            arrays["jerks"] = self.jerks
+        neighbour_list = self.neighbour_list
+        if neighbour_list is not None:
+            scalars["neighbour_list_builds"] = neighbour_list.num_builds
+            scalars["neighbour_list_updates"] = neighbour_list.num_updates
+            if neighbour_list.reference_positions is not None:
+                arrays["neighbour_offsets"] = neighbour_list.offsets
+                arrays["neighbour_indices"] = neighbour_list.neighbours
+                arrays["neighbour_reference_positions"] = neighbour_list.reference_positions
+        expansion = self.scf_expansion
+        if expansion is not None:
+            scalars["scf_num_fits"] = expansion.num_fits
+            scalars["scf_fitted_scale_length"] = expansion.fitted_scale_length
+            scalars["scf_force_error"] = expansion.force_error
+            if expansion.S is not None:
+                arrays["scf_center"] = expansion.center
+                arrays["scf_S"] = expansion.S
+                arrays["scf_T"] = expansion.T
+        return scalars, arrays
+
+    def restore_checkpoint_state(self, scalars, arrays):
+        """
+        Restores the state saved by checkpoint_state (the arrays are copied).
+        Args:
+            scalars (dict): Scalars from checkpoint_state.
+            arrays (dict): Arrays from checkpoint_state.
+        """
+        self.step = scalars["step"]
+        self._scf_fit_step = scalars["scf_fit_step"]
+        self.num_evaluations = scalars["num_evaluations"]
+        self.num_particle_forces = scalars["num_particle_forces"]
+        self.force_time = scalars["force_time"]
+        self.jerks = np.array(arrays["jerks"]) if "jerks" in arrays else None
+        neighbour_list = self.neighbour_list
+        if neighbour_list is not None:
+            neighbour_list.num_builds = scalars.get("neighbour_list_builds", 0)
+            neighbour_list.num_updates = scalars.get("neighbour_list_updates", 0)
+            if "neighbour_reference_positions" in arrays:
+                neighbour_list.offsets = np.array(arrays["neighbour_offsets"])
+                neighbour_list.neighbours = np.array(arrays["neighbour_indices"])
+                neighbour_list.reference_positions = np.array(arrays["neighbour_reference_positions"])
+        expansion = self.scf_expansion
+        if expansion is not None:
+            expansion.num_fits = scalars.get("scf_num_fits", 0)
+            expansion.fitted_scale_length = scalars.get("scf_fitted_scale_length", expansion.scale_length)
+            expansion.force_error = scalars.get("scf_force_error")
+            if "scf_S" in arrays:
+                expansion.center = np.array(arrays["scf_center"])
+                expansion.S = np.array(arrays["scf_S"])
+                expansion.T = np.array(arrays["scf_T"])
+
+    def background_for(self, shells):
+        """
+        Returns the prepared shell background, building it on first use. Shells are assumed
+        not to change during a run; passing a different list object rebuilds it.
+        Args:
+            shells (list): List of SpheroidalShell objects.
+        Returns:
+            object: Background accepted by shell_forces.
+        """
+        if self.shell_background is None or shells is not self._shell_source:
+            self.shell_background = prepare_shell_background(shells, self.sim_params)
+            self._shell_source = shells
+        return self.shell_background
+
+
+def prepare_shell_background(shells, sim_params):
+    """
+    Prepares the shell background selected by sim_params.shell_model.
+    Args:
+        shells (list): List of SpheroidalShell objects.
+        sim_params (SimulationParams): Simulation parameters.
+    Returns:
+        object: Background accepted by shell_forces.
+    """
+    if sim_params.shell_model == "homoeoid":
+        return build_homoeoid_background(shells, sim_params.background_grid_size, sim_params.background_cache_dir)
+    return build_shell_background(shells)
+
+
+def compute_forces(particles_or_arrays, shells, sim_params, state=None, time=0.0, active=None):
+    """
+    Calculates the (N,3) forces on all particles with the engine selected in sim_params.
+    The "localized" engine sums neighbours inside interaction_radius_kpc on top of the shell
+    background. The "scf" engine evaluates a smooth basis-function expansion of the particles,
+    refitted every scf_update_interval steps (state.step) when a state is given. The other engines compute the full self-gravity of the particles, and the
+    shell background is added on top as a static external field (pass an empty shell list
+    to run on the live particles alone). Concentric shells are evaluated from a radial table
+    ("spherical" shell model) or an (R, z) grid ("homoeoid" shell model). If the state holds an
+    external_field (a GalacticPotential), its analytic field at the given time is added as well,
+    next to the shells or, with an empty shell list, instead of them.
+    With an active mask (block time-steps) only the flagged particles are evaluated: every
+    particle still acts as a source, but each engine restricts its per-target work (tree walks,
+    leaf sums, pairs, background and external field lookups) to the active subset.
+    Args:
+        particles_or_arrays (list, ParticleSet or tuple): List of particles, a ParticleSet, or a (positions[N,3], masses[N]) tuple.
+        shells (list): List of SpheroidalShell objects for the background field.
+        sim_params (SimulationParams): Simulation parameters (force_engine and engine settings).
+        state (ForceEngineState): Optional per-run caches reused across calls.
+        time (float): Simulation time, for time-dependent external fields (Myr).
+        active (np.array): Optional (N,) boolean mask of the particles to evaluate; None evaluates all of them.
+    Returns:
+        np.array: (N,3) array of total forces (zero rows for inactive particles).
+    """
+    start = perf_counter()
+    targets = None if active is None else np.flatnonzero(active)
+    forces = _self_and_shell_forces(particles_or_arrays, shells, sim_params, state, targets)
+    external_field = state.external_field if state is not None else None
+    if external_field is not None:
+        positions, masses = particle_arrays(particles_or_arrays)
+        if targets is not None:
+            positions, masses = positions[targets], masses[targets]
+        forces += masses[:, None] * external_field.accelerations(positions, time)
+    if targets is not None:  # Scatter the active rows back into an (N,3) array
+        active_forces = forces
+        forces = np.zeros((len(active), 3))
+        forces[targets] = active_forces
+    if state is not None:
+        state.num_evaluations += 1
+        state.num_particle_forces += len(forces) if targets is None else len(targets)
+        state.force_time += perf_counter() - start
+    return forces
+
+
+def _self_and_shell_forces(particles_or_arrays, shells, sim_params, state, targets=None):
+    """Self-gravity from the selected engine plus the shell background, for all particles or the targets."""
+    engine = sim_params.force_engine
+    shells = state.background_for(shells) if state is not None else prepare_shell_background(shells, sim_params)
+    if engine == "localized":
+        neighbour_list = state.neighbour_list if state is not None else None
+        return localized_gravity_forces(particles_or_arrays, shells, sim_params.interaction_radius_kpc, neighbour_list,
+                                        sim_params.force_precision, sim_params.pair_tile_size,
+                                        sim_params.pair_memory_limit_mb, targets)
+
+    positions, masses = particle_arrays(particles_or_arrays)
+    if engine == "direct":
+        forces = direct_forces(positions, masses, sim_params.softening_length, targets, sim_params.force_precision,
+                               black_hole_mask(particles_or_arrays))
+    elif engine == "barnes_hut":
+        forces = barnes_hut_forces(positions, masses, sim_params.opening_angle, sim_params.softening_length,
+                                   targets=targets)
+    elif engine == "fmm":
+        forces = fmm_forces(positions, masses, sim_params.fmm_order, sim_params.fmm_theta, sim_params.softening_length,
+                            targets=targets)
+    elif engine == "treepm":
+        forces = treepm_forces(positions, masses, sim_params.pm_grid_size, sim_params.pm_split_scale,
+                               sim_params.softening_length, sim_params.fft_workers, targets)
+    elif engine == "scf":
+        if state is not None:
+            refit = state.scf_needs_fit()
+            forces = scf_forces(positions, masses, state.scf_expansion, refit, targets)
+            if refit:
+                state.scf_fitted()
+                if state.scf_expansion.force_error is None:  # One-off accuracy check after the first fit
+                    state.scf_expansion.measure_force_error(positions, masses, sim_params.softening_length)
+        else:
+            expansion = SCFExpansion(sim_params.scf_nmax, sim_params.scf_lmax, sim_params.scf_scale_length)
+            forces = scf_forces(positions, masses, expansion, targets=targets)
+    else:
+        raise ValueError(f"Unknown force engine '{engine}'. Expected one of {FORCE_ENGINES}.")
+
+    forces += background_forces(positions if targets is None else positions[targets], shells)
+    return forces
+
+
+def compute_forces_and_jerks(particles, shells, sim_params, state=None, time=0.0):
+    """
+    Calculates the (N,3) forces and their time derivatives for Hermite integration. The
+    self-gravity derivative comes from the jerk kernel of the "direct" (softened, float64) or
+    "localized" (pairs inside interaction_radius_kpc) engine; the shell background and the
+    external field are differentiated along each particle's path by central differences.
+    Args:
+        particles (ParticleSet): Particles (positions, velocities and masses).
+        shells (list): List of SpheroidalShell objects for the background field.
+        sim_params (SimulationParams): Simulation parameters; force_engine must be one of JERK_ENGINES.
+        state (ForceEngineState): Optional per-run caches reused across calls.
+        time (float): Simulation time, for time-dependent external fields (Myr).
+    Returns:
+        tuple: ((N,3) forces, (N,3) force time derivatives).
+    """
+    engine = sim_params.force_engine
+    if engine not in JERK_ENGINES:
+        raise ValueError(f"Force engine '{engine}' has no jerk kernel. Expected one of {JERK_ENGINES}.")
+    start = perf_counter()
+    positions, velocities, masses = particles.positions, particles.velocities, particles.masses
+    background = state.background_for(shells) if state is not None else prepare_shell_background(shells, sim_params)
+    if engine == "direct":
+        forces, jerks = direct_forces_and_jerks(positions, velocities, masses, sim_params.softening_length)
+        forces += background_forces(positions, background)
+    else:
+        neighbour_list = state.neighbour_list if state is not None else None
+        forces = localized_gravity_forces(particles, background, sim_params.interaction_radius_kpc, neighbour_list,
+                                          sim_params.force_precision, sim_params.pair_tile_size,
+                                          sim_params.pair_memory_limit_mb)
+        jerks = localized_force_derivatives(positions, velocities, masses, sim_params.interaction_radius_kpc,
+                                            neighbour_list, sim_params.pair_tile_size, sim_params.pair_memory_limit_mb)
+
+    external_field = state.external_field if state is not None else None
+    if external_field is not None:
+        forces += masses[:, None] * external_field.accelerations(positions, time)
+    jerks += _field_force_derivatives(positions, velocities, masses, background, external_field, time)
+    if state is not None:
+        state.num_evaluations += 1
+        state.num_particle_forces += len(forces)
+        state.force_time += perf_counter() - start
+    return forces, jerks
+
+
+def _field_force_derivatives(positions, velocities, masses, background, external_field, time):
+    """Central-difference derivative of the background and external forces along each particle's path."""
+    speeds = np.linalg.norm(velocities, axis=1)
+    moving = speeds > 0
+    steps = np.zeros(len(positions))  # Time over which each particle moves FIELD_DIFFERENCE_LENGTH
+    steps[moving] = FIELD_DIFFERENCE_LENGTH / speeds[moving]
+    offsets = steps[:, None] * velocities
+    forward = background_forces(positions + offsets, background)
+    backward = background_forces(positions - offsets, background)
+    if external_field is not None:
+        forward += masses[:, None] * external_field.accelerations(positions + offsets, time)
+        backward += masses[:, None] * external_field.accelerations(positions - offsets, time)
+    derivatives = np.zeros((len(positions), 3))
+    derivatives[moving] = (forward[moving] - backward[moving]) / (2.0 * steps[moving, None])
+    if external_field is not None:  # Explicit time dependence (rotating spiral pattern)
+        dt = FIELD_DIFFERENCE_TIME
+        derivatives += masses[:, None] * (external_field.accelerations(positions, time + dt) -
+                                          external_field.accelerations(positions, time - dt)) / (2.0 * dt)
+    return derivatives
+
+
+def benchmark_force_precision(particles_or_arrays, shells, sim_params, repeats=3):
+    """
+    Times the float64 and mixed precision policies of the selected engine and measures the
+    force error of the mixed policy against float64. Mixed precision speeds up the direct
+    engine; on the localized engine it is slower, which the speedup reports as below 1.
+    Args:
+        particles_or_arrays (list, ParticleSet or tuple): List of particles, a ParticleSet, or a (positions, masses[, is_black_hole]) tuple.
+        shells (list): List of SpheroidalShell objects for the background field.
+        sim_params (SimulationParams): Simulation parameters; force_precision is overridden.
+        repeats (int): Number of timed calls per policy (the best time is kept).
+    Returns:
+        dict: Best times per policy (s), speedup of "mixed" over "float64" and relative force error summary.
+    """
+    timings = {}
+    results = {}
+    for precision in ("float64", "mixed"):
+        params = copy.copy(sim_params)
+        params.force_precision = precision
+        state = ForceEngineState(params)
+        compute_forces(particles_or_arrays, shells, params, state)  # Warm up (JIT compilation, neighbour list)
+        best = float("inf")
+        for _ in range(repeats):
+            start = perf_counter()
+            results[precision] = compute_forces(particles_or_arrays, shells, params, state)
+            best = min(best, perf_counter() - start)
+        timings[precision] = best
+    return {
+        "float64_time": timings["float64"],
+        "mixed_time": timings["mixed"],
+        "speedup": timings["float64"] / timings["mixed"],
+        "force_error": relative_force_error(results["mixed"], results["float64"]),
+    }
+
+
+if __name__ == '__main__':
+    from src.simulation_params import SimulationParams
+
+    rng = np.random.default_rng(42)
+    num_particles = 20000
+    positions_example = rng.normal(scale=5.0, size=(num_particles, 3))
+    masses_example = rng.uniform(0.5, 2.0, size=num_particles)
+    is_black_hole_example = np.zeros(num_particles, dtype=bool)
+    is_black_hole_example[:4] = True
+    masses_example[:4] = 1e4
+    arrays_example = (positions_example, masses_example, is_black_hole_example)
+
+    for engine, radius in (("localized", 1.0), ("direct", 1.0)):
+        params_example = SimulationParams(1e-3, 1e-1, 0.5, 0.08, radius, 0, 10, "INFO", force_engine=engine)
+        report = benchmark_force_precision(arrays_example, [], params_example)
+        print(f"{engine}: float64 {report['float64_time'] * 1e3:.1f} ms, mixed {report['mixed_time'] * 1e3:.1f} ms, "
+              f"speedup {report['speedup']:.2f}x, median relative force error {report['force_error']['median']:.2e}, "
+              f"max {report['force_error']['max']:.2e}")
+# --- END OF FILE force_engines.py ---
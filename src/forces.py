@@ -3,10 +3,13 @@
 # src/forces.py
 import numpy as np
 from src.ga_utils import to_ga_point, to_ga_vector, from_ga_vector, ga_vector_subtract, ga_dot_product, ga_vector_add, ga_vector_norm_sq, ga_vector_normalize, ga_scalar_mul  # Import GA utilities
-from src.shell_potential import spheroidal_shell_force_approximation  # Corrected import name
+from src.shell_potential import shell_forces
 from src.galactic_potential import G  # Gravitational Constant
+from src.particles import BlackHole, ParticleSet
+from src.pair_tiles import tiled_pair_forces, tiled_pair_jerks, pair_chunks, buffer_chunks, DEFAULT_TILE_SIZE
 import kingdon as kg  # Import kingdon
 from scipy.spatial import cKDTree  # Efficient k-d tree implementation
+from numba import njit, prange
 
 
 alg = kg.Algebra(p=3, q=0, r=0)  # Create Algebra instance here
@@ -31,54 +34,390 @@ def compute_average_interstellar_distance(particles):
     return avg_distance
 
 
-def localized_gravity_force(particle, particles, shells, interaction_radius_kpc):
+def particle_arrays(particles_or_arrays):
     """
-    Calculates the total gravitational force on a particle using localized N-body and Shell Theorem approximation.
+    Returns contiguous (positions, masses) arrays for a particle list, a ParticleSet or an arrays tuple.
     Args:
-        particle (AbstractParticle): The particle to calculate the force on.
-        particles (list): List of all particles in the simulation.
-        shells (list): List of SpheroidalShell objects for potential approximation.
+        particles_or_arrays (list, ParticleSet or tuple): List of particles, a ParticleSet (its arrays are
+            returned without copying), or a (positions[N,3], masses[N]) tuple (optionally followed by an
+            is_black_hole[N] mask).
+    Returns:
+        tuple: (positions, masses) as float64 NumPy arrays.
+    """
+    if isinstance(particles_or_arrays, ParticleSet):
+        return particles_or_arrays.positions, particles_or_arrays.masses
+    if isinstance(particles_or_arrays, tuple):
+        positions, masses = particles_or_arrays[0], particles_or_arrays[1]
+        positions = np.ascontiguousarray(positions, dtype=np.float64).reshape(-1, 3)
+        masses = np.ascontiguousarray(masses, dtype=np.float64).reshape(-1)
+        return positions, masses
+
+    positions = np.array([p.position for p in particles_or_arrays], dtype=np.float64).reshape(-1, 3)
+    masses = np.array([p.mass for p in particles_or_arrays], dtype=np.float64)
+    return positions, masses
+
+
+def black_hole_mask(particles_or_arrays):
+    """
+    Returns a boolean mask of the black holes in a particle list, a ParticleSet or an arrays tuple.
+    Arrays tuples without a third is_black_hole element are treated as all stars.
+    Args:
+        particles_or_arrays (list, ParticleSet or tuple): List of particles, a ParticleSet, or a
+            (positions, masses[, is_black_hole]) tuple.
+    Returns:
+        np.array: (N,) boolean mask.
+    """
+    if isinstance(particles_or_arrays, ParticleSet):
+        return particles_or_arrays.is_black_hole
+    if isinstance(particles_or_arrays, tuple):
+        if len(particles_or_arrays) > 2:
+            return np.asarray(particles_or_arrays[2], dtype=bool).reshape(-1)
+        return np.zeros(len(particles_or_arrays[1]), dtype=bool)
+    return np.array([isinstance(p, BlackHole) for p in particles_or_arrays], dtype=bool)
+
+
+def single_precision_copy(positions, masses):
+    """
+    Returns float32 copies of positions (relative to their mean, to keep separations precise) and masses.
+    Args:
+        positions (np.array): (N,3) float64 positions.
+        masses (np.array): (N,) float64 masses.
+    Returns:
+        tuple: (positions, masses) as float32 arrays.
+    """
+    origin = positions.mean(axis=0) if len(positions) else np.zeros(3)
+    return np.ascontiguousarray(positions - origin, dtype=np.float32), np.ascontiguousarray(masses, dtype=np.float32)
+
+
+def background_forces(positions, shells):
+    """
+    Evaluates the spheroidal shell background at every position.
+    Args:
+        positions (np.array): (N,3) Cartesian positions.
+        shells (list, ShellSet or ConcentricShellTable): SpheroidalShell objects, or a prepared background.
+    Returns:
+        np.array: (N,3) background forces.
+    """
+    return shell_forces(positions, shells)  # All positions and shells in one compiled pass
+
+
+def scatter_pair_forces(forces, i, j, pair_forces):
+    """
+    Adds pair forces to both ends of each pair (Newton's third law), in place.
+    Args:
+        forces (np.array): (N,3) force accumulator.
+        i (np.array): First index of each pair.
+        j (np.array): Second index of each pair.
+        pair_forces (np.array): (P,3) force on i from j; j receives the opposite force.
+    """
+    num_particles = len(forces)
+    for axis in range(3):
+        forces[:, axis] += np.bincount(i, weights=pair_forces[:, axis], minlength=num_particles)
+        forces[:, axis] -= np.bincount(j, weights=pair_forces[:, axis], minlength=num_particles)
+
+
+@njit(parallel=True, cache=True)
+def _pair_force_kernel(positions, masses, i, j, cutoff, grav_const, num_chunks):
+    """
+    Evaluates each listed pair once and scatters +F to i and -F to j.
+    Pairs are split into num_chunks contiguous chunks; each chunk accumulates into its own
+    force buffer, so no two threads write to the same memory and no atomics are needed.
+    """
+    num_particles = positions.shape[0]
+    num_pairs = i.shape[0]
+    buffers = np.zeros((num_chunks, num_particles, 3))
+    chunk_size = (num_pairs + num_chunks - 1) // num_chunks
+    for c in prange(num_chunks):
+        for p in range(c * chunk_size, min((c + 1) * chunk_size, num_pairs)):
+            a = i[p]
+            b = j[p]
+            rx = positions[b, 0] - positions[a, 0]
+            ry = positions[b, 1] - positions[a, 1]
+            rz = positions[b, 2] - positions[a, 2]
+            r_sq = rx * rx + ry * ry + rz * rz
+            r_mag = np.sqrt(r_sq)
+            if not 0.0 < r_mag < cutoff:
+                continue
+            scale = grav_const * masses[a] * masses[b] / (r_sq * r_mag)
+            buffers[c, a, 0] += scale * rx
+            buffers[c, a, 1] += scale * ry
+            buffers[c, a, 2] += scale * rz
+            buffers[c, b, 0] -= scale * rx
+            buffers[c, b, 1] -= scale * ry
+            buffers[c, b, 2] -= scale * rz
+    forces = np.zeros((num_particles, 3))
+    for k in prange(num_particles):  # Reduce the per-thread buffers
+        for c in range(num_chunks):
+            forces[k, 0] += buffers[c, k, 0]
+            forces[k, 1] += buffers[c, k, 1]
+            forces[k, 2] += buffers[c, k, 2]
+    return forces
+
+
+def pair_gravity_forces(positions, masses, i, j, cutoff, memory_limit_mb=256.0):
+    """
+    Calculates Newtonian pair forces, visiting every unordered pair exactly once.
+    Each pair costs one separation, one square root and one division; the result is added
+    to i and subtracted from j (Newton's third law). Pairs at zero separation or at or beyond
+    the cutoff are skipped.
+    Args:
+        positions (np.array): (N,3) particle positions (kpc), float64 or float32.
+        masses (np.array): (N,) particle masses, in the same precision as positions.
+        i (np.array): First index of each pair.
+        j (np.array): Second index of each pair.
+        cutoff (float): Pairs must be strictly closer than this (kpc); use np.inf for no cutoff.
+        memory_limit_mb (float): Budget for the per-thread force buffers (MB).
+    Returns:
+        np.array: (N,3) accumulated pair forces.
+    """
+    num_chunks = buffer_chunks(len(positions), len(i), 4096, memory_limit_mb)  # Per-thread buffers only pay off on large lists
+    real = positions.dtype.type  # Pair math runs in the storage precision; accumulators are always float64
+    return _pair_force_kernel(positions, masses, np.ascontiguousarray(i, dtype=np.int64),
+                              np.ascontiguousarray(j, dtype=np.int64), real(cutoff), real(G), num_chunks)
+
+
+def mixed_precision_pair_forces(positions, masses, is_black_hole, i, j, cutoff, memory_limit_mb=256.0):
+    """
+    Calculates pair forces with float32 storage and arithmetic for star-star pairs and
+    float64 for every pair that involves a black hole; all accumulation is in float64.
+    Args:
+        positions (np.array): (N,3) float64 particle positions (kpc).
+        masses (np.array): (N,) float64 particle masses.
+        is_black_hole (np.array): (N,) boolean black-hole mask.
+        i (np.array): First index of each pair.
+        j (np.array): Second index of each pair.
+        cutoff (float): Pairs must be strictly closer than this (kpc).
+        memory_limit_mb (float): Budget for the per-thread force buffers (MB).
+    Returns:
+        np.array: (N,3) accumulated pair forces.
+    """
+    positions32, masses32 = single_precision_copy(positions, masses)
+    exact = is_black_hole[i] | is_black_hole[j]
+    if not exact.any():
+        return pair_gravity_forces(positions32, masses32, i, j, cutoff, memory_limit_mb)
+    forces = pair_gravity_forces(positions, masses, i[exact], j[exact], cutoff, memory_limit_mb)
+    forces += pair_gravity_forces(positions32, masses32, i[~exact], j[~exact], cutoff, memory_limit_mb)
+    return forces
+
+
+def localized_gravity_forces(particles_or_arrays, shells, interaction_radius_kpc, neighbour_list=None, precision="float64",
+                             tile_size=DEFAULT_TILE_SIZE, pair_memory_limit_mb=256.0, targets=None):
+    """
+    Calculates the localized N-body + shell forces on all particles in one pass.
+    By default the pairs inside interaction_radius_kpc are evaluated tile by tile over the
+    leaves of one k-d tree (see tiled_pair_forces), so no pair list is built. The tile pairs,
+    whose number grows quadratically in a dense cusp, are streamed in batches of at most
+    pair_memory_limit_mb, so the extra memory stays within the budget (plus O(N)). With
+    tile_size=0 the pairs come from one query_pairs call instead. Each pair is evaluated once in a compiled kernel and its force is
+    scattered with opposite signs to both ends. When a NeighbourList is given, its cached pairs
+    are used and expanded in row chunks of at most pair_memory_limit_mb. With targets, only pairs
+    (or tile pairs) with a target at one end are evaluated and the background is only evaluated
+    at the targets; the neighbour list then expands only the target rows and their reverse
+    lookups, so the pair work scales with the targets' neighbours.
+    Args:
+        particles_or_arrays (list, ParticleSet or tuple): List of particles, a ParticleSet, or a (positions[N,3], masses[N]) tuple.
+        shells (list): List of SpheroidalShell objects (or a background from build_shell_background).
         interaction_radius_kpc (float): Radius within which to calculate direct N-body forces (kpc).
+        neighbour_list (NeighbourList): Optional persistent neighbour list covering interaction_radius_kpc.
+        precision (str): "float64", or "mixed" for float32 star-star pairs (see mixed_precision_pair_forces).
+        tile_size (int): Particles per tile of the tiled path, or 0 to build the full pair list.
+        pair_memory_limit_mb (float): Budget for expanded pair indices on the neighbour-list path or each
+            batch of tile pairs on the tiled path, and separately for the per-thread force buffers (MB).
+        targets (np.array): Indices of the particles to evaluate; None evaluates all of them.
     Returns:
-        kingdon.MultiVector: Total gravitational force on the particle as a GA vector.
+        np.array: (N,3) array of total forces, in the same order as the input particles, or
+            (len(targets),3) when targets is given.
     """
-    if not particles:  # Handle empty particles list
-        return kg.MultiVector(algebra=alg, values=None)
+    positions, masses = particle_arrays(particles_or_arrays)
+    num_particles = len(positions)
+    if targets is not None:
+        targets = np.asarray(targets, dtype=np.int64)
+        pair_forces = _localized_pair_forces(particles_or_arrays, positions, masses, interaction_radius_kpc,
+                                             neighbour_list, precision, tile_size, pair_memory_limit_mb, targets)
+        return background_forces(positions[targets], shells) + pair_forces[targets]
+    if num_particles == 0:
+        return np.zeros((0, 3))
 
-    positions = np.array([p.position for p in particles])
-    if positions.size == 0: # Handle case of no positions
-        return kg.MultiVector(algebra=alg, values=None)
+    forces = background_forces(positions, shells)  # Force from spheroidal background
+    forces += _localized_pair_forces(particles_or_arrays, positions, masses, interaction_radius_kpc, neighbour_list,
+                                     precision, tile_size, pair_memory_limit_mb)
+    return forces
+
+
+def _localized_pair_forces(particles_or_arrays, positions, masses, interaction_radius_kpc, neighbour_list, precision,
+                           tile_size, pair_memory_limit_mb, targets=None):
+    """Pair part of localized_gravity_forces; (N,3), complete in the target rows."""
+    num_particles = len(positions)
+    forces = np.zeros((num_particles, 3))
+    if num_particles < 2:
+        return forces
 
+    is_black_hole = black_hole_mask(particles_or_arrays) if precision == "mixed" else None
+    if neighbour_list is None and tile_size > 0:
+        if precision == "mixed":
+            positions32, masses32 = single_precision_copy(positions, masses)
+            forces += tiled_pair_forces(positions, masses, interaction_radius_kpc, tile_size, positions32, masses32,
+                                        is_black_hole, targets, pair_memory_limit_mb)
+        else:
+            forces += tiled_pair_forces(positions, masses, interaction_radius_kpc, tile_size, targets=targets,
+                                        memory_limit_mb=pair_memory_limit_mb)
+        return forces
 
-    tree = cKDTree(positions)  # Build k-d tree for quick neighbor search
-    neighbors_indices = tree.query_ball_point(particle.position, interaction_radius_kpc)  # Find nearby particles
+    is_target = None
+    if targets is not None:
+        is_target = np.zeros(num_particles, dtype=bool)
+        is_target[targets] = True
 
-    total_force_ga = kg.MultiVector(algebra=alg, values=None)  # Initialize force to zero using kingdon, adjust if needed - keyword values
-    shell_force_ga = spheroidal_shell_force_approximation(particle.position_ga, shells)  # Force from spheroidal background
-    total_force_ga = ga_vector_add(total_force_ga, shell_force_ga)  # Add shell force
+    filter_targets = is_target is not None
+    if neighbour_list is not None:
+        neighbour_list.update(positions)  # Rebuilds only when some particle moved more than skin / 2
+        target_offsets = None
+        if targets is not None:
+            target_rows = np.unique(targets)
+            target_offsets = np.zeros(len(target_rows) + 1, dtype=np.int64)
+            np.cumsum(neighbour_list.target_row_counts(target_rows), out=target_offsets[1:])
+        if target_offsets is not None and target_offsets[-1] < neighbour_list.num_pairs:
+            # Few targets: walk only their rows (and reverse lookups), in chunks within the budget
+            pair_sets = (neighbour_list.target_pairs(target_rows[start:stop], is_target)
+                         for start, stop in pair_chunks(target_offsets, pair_memory_limit_mb))
+            filter_targets = False
+        else:  # All rows (the targets touch about half the pairs or more)
+            pair_sets = (neighbour_list.pairs(start, stop) for start, stop in pair_chunks(neighbour_list.offsets, pair_memory_limit_mb))
+    else:
+        tree = cKDTree(positions)  # One k-d tree for the whole force pass
+        pairs = tree.query_pairs(interaction_radius_kpc, output_type='ndarray')  # Each unordered pair once (i < j)
+        pair_sets = [(pairs[:, 0], pairs[:, 1])]
 
-    # Local N-body force from nearby particles
-    for idx in neighbors_indices:
-        other_particle = particles[idx]
-        if other_particle is particle:
+    for i, j in pair_sets:
+        if filter_targets:  # Only pairs with a target at one end
+            keep = is_target[i] | is_target[j]
+            i, j = i[keep], j[keep]
+        if len(i) == 0:
             continue
+        if precision == "mixed":
+            forces += mixed_precision_pair_forces(positions, masses, is_black_hole, i, j, interaction_radius_kpc,
+                                                  pair_memory_limit_mb)
+        else:
+            forces += pair_gravity_forces(positions, masses, i, j, interaction_radius_kpc, pair_memory_limit_mb)  # query_pairs is inclusive, the cutoff is strict
+    return forces
 
-        r_vec_ga = ga_vector_subtract(other_particle.position_ga, particle.position_ga)  # Vector from particle to other
-        r_vec_cart = from_ga_vector(r_vec_ga)
-        r_mag = np.linalg.norm(r_vec_cart)
 
-        if 0.0 < r_mag < interaction_radius_kpc:  # Nearby particle
-            r_mag_sq_ga = ga_vector_norm_sq(r_vec_ga)  # Use kingdon GA norm_sq
-            r_mag_sq_val = r_mag_sq_ga.e
-            if float(r_mag_sq_val) == 0:  # Compare float value, adjust if needed
+@njit(parallel=True, cache=True)
+def _pair_jerk_kernel(positions, velocities, masses, i, j, cutoff, grav_const, num_chunks):
+    """
+    Evaluates the force time derivative of each listed pair once and scatters it with opposite
+    signs to i and j, with the chunked buffers of _pair_force_kernel.
+    """
+    num_particles = positions.shape[0]
+    num_pairs = i.shape[0]
+    buffers = np.zeros((num_chunks, num_particles, 3))
+    chunk_size = (num_pairs + num_chunks - 1) // num_chunks
+    for c in prange(num_chunks):
+        for p in range(c * chunk_size, min((c + 1) * chunk_size, num_pairs)):
+            a = i[p]
+            b = j[p]
+            rx = positions[b, 0] - positions[a, 0]
+            ry = positions[b, 1] - positions[a, 1]
+            rz = positions[b, 2] - positions[a, 2]
+            r_sq = rx * rx + ry * ry + rz * rz
+            r_mag = np.sqrt(r_sq)
+            if not 0.0 < r_mag < cutoff:
                 continue
-            force_magnitude = G * particle.mass * other_particle.mass / float(r_mag_sq_val)  # Use float value of norm_sq
-            r_hat_ga = ga_vector_normalize(r_vec_ga)  # Use kingdon GA normalize
+            vx = velocities[b, 0] - velocities[a, 0]
+            vy = velocities[b, 1] - velocities[a, 1]
+            vz = velocities[b, 2] - velocities[a, 2]
+            alpha = 3.0 * (rx * vx + ry * vy + rz * vz) / r_sq
+            scale = grav_const * masses[a] * masses[b] / (r_sq * r_mag)
+            buffers[c, a, 0] += scale * (vx - alpha * rx)
+            buffers[c, a, 1] += scale * (vy - alpha * ry)
+            buffers[c, a, 2] += scale * (vz - alpha * rz)
+            buffers[c, b, 0] -= scale * (vx - alpha * rx)
+            buffers[c, b, 1] -= scale * (vy - alpha * ry)
+            buffers[c, b, 2] -= scale * (vz - alpha * rz)
+    jerks = np.zeros((num_particles, 3))
+    for k in prange(num_particles):  # Reduce the per-thread buffers
+        for c in range(num_chunks):
+            jerks[k, 0] += buffers[c, k, 0]
+            jerks[k, 1] += buffers[c, k, 1]
+            jerks[k, 2] += buffers[c, k, 2]
+    return jerks
+
+
+def pair_force_derivatives(positions, velocities, masses, i, j, cutoff, memory_limit_mb=256.0):
+    """
+    Calculates the time derivatives of the pair forces of pair_gravity_forces (float64):
+    d/dt G m_i m_j r / r^3 = G m_i m_j (v - 3 (r.v) r / r^2) / r^3 for each listed pair with
+    0 < r < cutoff, added to i and subtracted from j.
+    Args:
+        positions (np.array): (N,3) particle positions (kpc).
+        velocities (np.array): (N,3) particle velocities.
+        masses (np.array): (N,) particle masses.
+        i (np.array): First index of each pair.
+        j (np.array): Second index of each pair.
+        cutoff (float): Pairs must be strictly closer than this (kpc).
+        memory_limit_mb (float): Budget for the per-thread buffers (MB).
+    Returns:
+        np.array: (N,3) accumulated force time derivatives.
+    """
+    num_chunks = buffer_chunks(len(positions), len(i), 4096, memory_limit_mb)
+    return _pair_jerk_kernel(positions, velocities, masses, np.ascontiguousarray(i, dtype=np.int64),
+                             np.ascontiguousarray(j, dtype=np.int64), float(cutoff), G, num_chunks)
+
 
-            pairwise_force_ga = ga_scalar_mul(force_magnitude, r_hat_ga)  # Use scalar_mul
-            total_force_ga = ga_vector_add(total_force_ga, pairwise_force_ga)  # Use vector_add
+def localized_force_derivatives(positions, velocities, masses, interaction_radius_kpc, neighbour_list=None,
+                                tile_size=DEFAULT_TILE_SIZE, pair_memory_limit_mb=256.0):
+    """
+    Calculates the time derivatives of the localized pair forces (for Hermite integration) from
+    the same pairs as localized_gravity_forces: tile by tile by default, from the NeighbourList's
+    cached rows in chunks of at most pair_memory_limit_mb when one is given, or from one
+    query_pairs call with tile_size=0. Always float64.
+    Args:
+        positions (np.array): (N,3) particle positions (kpc).
+        velocities (np.array): (N,3) particle velocities.
+        masses (np.array): (N,) particle masses.
+        interaction_radius_kpc (float): Pair cutoff (kpc).
+        neighbour_list (NeighbourList): Optional persistent neighbour list covering interaction_radius_kpc.
+        tile_size (int): Particles per tile of the tiled path, or 0 to build the full pair list.
+        pair_memory_limit_mb (float): Budget for expanded pair indices and for the per-thread buffers (MB).
+    Returns:
+        np.array: (N,3) force time derivatives.
+    """
+    derivatives = np.zeros((len(positions), 3))
+    if len(positions) < 2:
+        return derivatives
+    if neighbour_list is None and tile_size > 0:
+        return tiled_pair_jerks(positions, velocities, masses, interaction_radius_kpc, tile_size, pair_memory_limit_mb)
+    if neighbour_list is not None:
+        neighbour_list.update(positions)  # No-op when the force pass already refreshed it
+        pair_sets = (neighbour_list.pairs(start, stop) for start, stop in pair_chunks(neighbour_list.offsets, pair_memory_limit_mb))
+    else:
+        pairs = cKDTree(positions).query_pairs(interaction_radius_kpc, output_type='ndarray')
+        pair_sets = [(pairs[:, 0], pairs[:, 1])]
+    for i, j in pair_sets:
+        if len(i):
+            derivatives += pair_force_derivatives(positions, velocities, masses, i, j, interaction_radius_kpc,
+                                                  pair_memory_limit_mb)
+    return derivatives
+
+
+def localized_gravity_force(particle, particles, shells, interaction_radius_kpc):
+    """
+    Calculates the total gravitational force on a particle using localized N-body and Shell Theorem approximation.
+    Kept for compatibility; this is a thin wrapper around localized_gravity_forces.
+    Args:
+        particle (AbstractParticle): The particle to calculate the force on.
+        particles (list): List of all particles in the simulation.
+        shells (list): List of SpheroidalShell objects for potential approximation.
+        interaction_radius_kpc (float): Radius within which to calculate direct N-body forces (kpc).
+    Returns:
+        kingdon.MultiVector: Total gravitational force on the particle as a GA vector.
+    """
+    if not particles:  # Handle empty particles list
+        return kg.MultiVector(algebra=alg, values=None)
 
-    return total_force_ga
+    others = [p for p in particles if p is not particle]
+    forces = localized_gravity_forces([particle] + others, shells, interaction_radius_kpc)
+    return to_ga_vector(forces[0])
 
 
 if __name__ == '__main__':
@@ -103,6 +442,9 @@ if __name__ == '__main__':
     force_on_p1_ga = localized_gravity_force(particle1, particles_example, shells_example, interaction_radius)
     print(f"Force on particle 1: {from_ga_vector(force_on_p1_ga)}")
 
+    all_forces = localized_gravity_forces(particles_example, shells_example, interaction_radius)
+    print(f"Batched forces: {all_forces}")
+
     avg_dist = compute_average_interstellar_distance(particles_example)
     print(f"Average Interstellar Distance: {avg_dist}")
 
@@ -107,6 +107,119 @@ def ga_vector_normalize(v):
     norm_val = norm_mv.e # Extract scalar value *after* sqrt (now from MultiVector again)
     return v / norm_val if float(norm_val) != 0 else kg.MultiVector(0) # Avoid division by zero, return zero vector, adjust kingdon zero vector if needed
 
+
+# --- Batched GA: one MultiVector whose coefficients are (N,) arrays stands for N vectors ---
+# Every operation below runs once for all N vectors (kingdon applies its generated code to the
+# coefficient arrays), so there is no per-particle interpreter cost.
+
+def to_ga_points(cartesian_positions):
+    """
+    Converts an (N,3) array of Cartesian positions to one batched GA point.
+    Args:
+        cartesian_positions (np.array): (N,3) Cartesian positions.
+    Returns:
+        kingdon.MultiVector: Grade-1 MultiVector with (N,) coefficient arrays (a view of the input).
+    """
+    return to_ga_vectors(cartesian_positions)
+
+def to_ga_vectors(cartesian_vectors):
+    """
+    Converts an (N,3) array of Cartesian vectors to one batched GA vector without copying.
+    Args:
+        cartesian_vectors (np.array): (N,3) Cartesian vectors.
+    Returns:
+        kingdon.MultiVector: Grade-1 MultiVector whose coefficients are the (3,N) transposed view of the input.
+    """
+    cartesian_vectors = np.asarray(cartesian_vectors, dtype=np.float64)
+    if cartesian_vectors.ndim != 2 or cartesian_vectors.shape[1] != 3:
+        raise ValueError(f"Expected an (N,3) array, got shape {cartesian_vectors.shape}.")
+    return alg.vector(cartesian_vectors.T)
+
+def from_ga_vectors(ga_vectors):
+    """
+    Converts a batched GA vector (or point) back to an (N,3) Cartesian array.
+    A MultiVector built by to_ga_vectors returns a view of the original array (no copy);
+    results of GA operations hold one coefficient array per component and are stacked once.
+    Args:
+        ga_vectors (kingdon.MultiVector): Batched grade-1 MultiVector.
+    Returns:
+        np.array: (N,3) Cartesian vectors.
+    """
+    values = ga_vectors.values()
+    if isinstance(values, np.ndarray) and values.ndim == 2 and tuple(ga_vectors.keys()) == (1, 2, 4):
+        return values.T  # Zero-copy view
+    return np.stack(np.broadcast_arrays(ga_vectors.e1, ga_vectors.e2, ga_vectors.e3), axis=1)
+
+def from_ga_points(ga_points):
+    """
+    Converts a batched GA point back to an (N,3) Cartesian array (see from_ga_vectors).
+    Args:
+        ga_points (kingdon.MultiVector): Batched GA point.
+    Returns:
+        np.array: (N,3) Cartesian positions.
+    """
+    return from_ga_vectors(ga_points)
+
+def ga_vectors_add(ga_vecs1, ga_vecs2):
+    """Adds two batched GA vectors element-wise.
+    Args:
+        ga_vecs1 (kingdon.MultiVector): First batched GA vector.
+        ga_vecs2 (kingdon.MultiVector): Second batched GA vector.
+    Returns:
+        kingdon.MultiVector: Batched sum.
+    """
+    return ga_vecs1 + ga_vecs2
+
+def ga_vectors_subtract(ga_vecs1, ga_vecs2):
+    """Subtracts the second batched GA vector from the first element-wise.
+    Args:
+        ga_vecs1 (kingdon.MultiVector): First batched GA vector.
+        ga_vecs2 (kingdon.MultiVector): Second batched GA vector.
+    Returns:
+        kingdon.MultiVector: Batched difference.
+    """
+    return ga_vecs1 - ga_vecs2
+
+def ga_vectors_dot(ga_vecs1, ga_vecs2):
+    """Calculates the element-wise inner products of two batched GA vectors.
+    Args:
+        ga_vecs1 (kingdon.MultiVector): First batched GA vector.
+        ga_vecs2 (kingdon.MultiVector): Second batched GA vector.
+    Returns:
+        np.array: (N,) scalar products.
+    """
+    return np.asarray((ga_vecs1 | ga_vecs2).e, dtype=np.float64)
+
+def ga_vectors_scalar_mul(scalars, ga_vecs):
+    """Scales a batched GA vector by one scalar or by one scalar per vector.
+    Args:
+        scalars (float or np.array): Scalar, or (N,) scalars.
+        ga_vecs (kingdon.MultiVector): Batched GA vector.
+    Returns:
+        kingdon.MultiVector: Batched scaled vector.
+    """
+    return ga_vecs * scalars
+
+def ga_vectors_norm_sq(ga_vecs):
+    """Calculates the squared norms of a batched GA vector.
+    Args:
+        ga_vecs (kingdon.MultiVector): Batched GA vector.
+    Returns:
+        np.array: (N,) squared norms.
+    """
+    return ga_vectors_dot(ga_vecs, ga_vecs)
+
+def ga_vectors_normalize(ga_vecs):
+    """Normalizes a batched GA vector; zero vectors stay zero.
+    Args:
+        ga_vecs (kingdon.MultiVector): Batched GA vector.
+    Returns:
+        kingdon.MultiVector: Batched unit vectors.
+    """
+    norm = np.sqrt(ga_vectors_norm_sq(ga_vecs))
+    inverse_norm = np.divide(1.0, norm, out=np.zeros_like(norm), where=norm > 0)
+    return ga_vecs * inverse_norm
+
 if __name__ == '__main__':
     cart_pos = [1.0, 2.0, 3.0]
     ga_p = to_ga_point(cart_pos)
@@ -121,4 +234,24 @@ if __name__ == '__main__':
     ga_v2 = to_ga_vector([0.3, 0.4, -0.1])
     ga_sum = ga_vector_add(ga_v, ga_v2)
     print(f"Vector Sum: {ga_sum}, Cartesian Sum: {from_ga_vector(ga_sum)}")
+
+    # --- Batched API against per-particle MultiVectors ---
+    import time
+    rng = np.random.default_rng(42)
+    positions_example = rng.normal(size=(20000, 3))
+    velocities_example = rng.normal(size=(20000, 3))
+
+    start = time.perf_counter()
+    per_particle = [from_ga_vector(ga_vector_normalize(ga_vector_add(to_ga_point(p), to_ga_vector(v))))
+                    for p, v in zip(positions_example, velocities_example)]
+    loop_time = time.perf_counter() - start
+
+    ga_vectors_normalize(ga_vectors_add(to_ga_points(positions_example[:2]), to_ga_vectors(velocities_example[:2])))  # Code generation
+    start = time.perf_counter()
+    batched = from_ga_vectors(ga_vectors_normalize(ga_vectors_add(to_ga_points(positions_example), to_ga_vectors(velocities_example))))
+    batch_time = time.perf_counter() - start
+    print(f"add + normalize of {len(positions_example)} vectors: per particle {loop_time * 1e3:.0f} ms, "
+          f"batched {batch_time * 1e3:.2f} ms ({loop_time / batch_time:.0f}x), "
+          f"max difference {np.max(np.abs(batched - np.array(per_particle))):.1e}")
+    print(f"Zero-copy round trip: {np.shares_memory(from_ga_points(to_ga_points(positions_example)), positions_example)}")
 # --- END OF FILE ga_utils.py ---
\ No newline at end of file
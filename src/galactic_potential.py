@@ -2,6 +2,7 @@
 # src/galactic_potential.py
 import numpy as np
 import math
+from numba import njit, prange
 
 # Gravitational constant (consistent units: kpc, km/s, 10^9 Msun)
 G = 4.499e-6  # kpc^3 / (10^9 Msun Myr^2)  ->  kpc (km/s)^2 / (10^9 Msun)
@@ -59,7 +60,8 @@ class DiskParams:
 
 class SpiralParams:
     """Parameters for spiral arm potential."""
-    def __init__(self, num_arms, pitch_angle, pattern_speed, amplitude_pos, amplitude_vel, scale_length):
+    def __init__(self, num_arms, pitch_angle, pattern_speed, amplitude_pos, amplitude_vel, scale_length,
+                 potential_amplitude=0.0):
         """
         Initializes SpiralParams.
         Args:
@@ -69,6 +71,7 @@ class SpiralParams:
             amplitude_pos (float): Amplitude of position perturbation (kpc).
             amplitude_vel (float): Amplitude of velocity perturbation (km/s).
             scale_length (float): Radial scale length of spiral arms (kpc).
+            potential_amplitude (float): Peak depth of the spiral potential ((km/s)^2); 0 disables it.
         """
         self.num_arms = int(num_arms)
         self.pitch_angle = float(pitch_angle)
@@ -76,26 +79,238 @@ class SpiralParams:
         self.amplitude_pos = float(amplitude_pos)
         self.amplitude_vel = float(amplitude_vel)
         self.scale_length = float(scale_length)
+        self.potential_amplitude = float(potential_amplitude)
+
+# --- Analytic potentials ---
+# Every potential takes a single position (3,) or an (N,3) array and returns a float or an (N,)
+# array; the *_gradient functions return grad(Phi) with the same leading shape. All of them run
+# through one compiled kernel, _external_field, that evaluates any combination of components
+# in a single pass over the positions.
+
+@njit(cache=True)
+def _plummer_terms(x, y, z, mass, b, grav_const):
+    """Plummer sphere: Phi = -G M / sqrt(r^2 + b^2)."""
+    inv = 1.0 / np.sqrt(x * x + y * y + z * z + b * b)
+    phi = -grav_const * mass * inv
+    scale = grav_const * mass * inv * inv * inv
+    return phi, scale * x, scale * y, scale * z
+
+
+@njit(cache=True)
+def _spheroidal_terms(x, y, z, mass, a, b, c, grav_const):
+    """Ellipsoidal Plummer: Phi = -G M / (s sqrt(m^2 + 1)), m^2 = (x/a)^2 + (y/b)^2 + (z/c)^2, s = (abc)^(1/3)."""
+    scale_length = (a * b * c) ** (1.0 / 3.0)
+    inv = 1.0 / np.sqrt((x / a) ** 2 + (y / b) ** 2 + (z / c) ** 2 + 1.0)
+    phi = -grav_const * mass * inv / scale_length
+    scale = grav_const * mass * inv * inv * inv / scale_length
+    return phi, scale * x / (a * a), scale * y / (b * b), scale * z / (c * c)
+
+
+@njit(cache=True)
+def _miyamoto_nagai_terms(x, y, z, mass, a, b, grav_const):
+    """Miyamoto-Nagai disk: Phi = -G M / sqrt(R^2 + (a + sqrt(z^2 + b^2))^2)."""
+    zeta = np.sqrt(z * z + b * b)
+    inv = 1.0 / np.sqrt(x * x + y * y + (a + zeta) ** 2)
+    phi = -grav_const * mass * inv
+    scale = grav_const * mass * inv * inv * inv
+    return phi, scale * x, scale * y, scale * z * (a + zeta) / zeta
+
+
+@njit(cache=True)
+def _spiral_terms(x, y, z, time, num_arms, pitch_angle, pattern_speed, amplitude, scale_length):
+    """
+    Logarithmic spiral: Phi = -E(R) cos(psi), E(R) = A (R / r0) exp(1 - R / r0),
+    psi = m (phi - Omega_p t) - cot(alpha) ln(R / r0) (the phase used by add_spiral_perturbation).
+    """
+    R = np.sqrt(x * x + y * y)
+    if R == 0.0:
+        return 0.0, 0.0, 0.0, 0.0
+    cot_alpha = 1.0 / np.tan(pitch_angle)
+    psi = num_arms * (np.arctan2(y, x) - pattern_speed * time) - cot_alpha * np.log(R / scale_length)
+    envelope = amplitude * (R / scale_length) * np.exp(1.0 - R / scale_length)
+    d_envelope = envelope * (1.0 / R - 1.0 / scale_length)
+    cos_psi = np.cos(psi)
+    sin_psi = np.sin(psi)
+    phi = -envelope * cos_psi
+    d_R = -d_envelope * cos_psi - envelope * sin_psi * cot_alpha / R  # dPhi/dR
+    d_phi_over_R = envelope * sin_psi * num_arms / R  # (1/R) dPhi/dphi
+    cos_az = x / R
+    sin_az = y / R
+    return phi, cos_az * d_R - sin_az * d_phi_over_R, sin_az * d_R + cos_az * d_phi_over_R, 0.0
+
+
+@njit(parallel=True, cache=True)
+def _external_field(positions, time, grav_const,
+                    use_plummer, plummer_mass, plummer_b,
+                    use_spheroid, spheroid_mass, spheroid_a, spheroid_b, spheroid_c,
+                    use_disk, disk_mass, disk_a, disk_b,
+                    use_spiral, num_arms, pitch_angle, pattern_speed, spiral_amplitude, spiral_scale):
+    """Sums the enabled components in one pass; returns (potential (N,), gradient (N,3))."""
+    num_positions = positions.shape[0]
+    potential = np.zeros(num_positions)
+    gradient = np.zeros((num_positions, 3))
+    for n in prange(num_positions):
+        x = positions[n, 0]
+        y = positions[n, 1]
+        z = positions[n, 2]
+        phi = 0.0
+        gx = 0.0
+        gy = 0.0
+        gz = 0.0
+        if use_plummer:
+            p, dx, dy, dz = _plummer_terms(x, y, z, plummer_mass, plummer_b, grav_const)
+            phi += p
+            gx += dx
+            gy += dy
+            gz += dz
+        if use_spheroid:
+            p, dx, dy, dz = _spheroidal_terms(x, y, z, spheroid_mass, spheroid_a, spheroid_b, spheroid_c, grav_const)
+            phi += p
+            gx += dx
+            gy += dy
+            gz += dz
+        if use_disk:
+            p, dx, dy, dz = _miyamoto_nagai_terms(x, y, z, disk_mass, disk_a, disk_b, grav_const)
+            phi += p
+            gx += dx
+            gy += dy
+            gz += dz
+        if use_spiral:
+            p, dx, dy, dz = _spiral_terms(x, y, z, time, num_arms, pitch_angle, pattern_speed, spiral_amplitude, spiral_scale)
+            phi += p
+            gx += dx
+            gy += dy
+            gz += dz
+        potential[n] = phi
+        gradient[n, 0] = gx
+        gradient[n, 1] = gy
+        gradient[n, 2] = gz
+    return potential, gradient
+
+
+def _evaluate(position, time=0.0, disk_params=None, spiral_params=None, spheroidal_params=None, plummer_params=None):
+    """Runs the fused kernel on one position or an (N,3) array; returns (potential, gradient)."""
+    positions = np.ascontiguousarray(position, dtype=np.float64)
+    single = positions.ndim == 1
+    positions = positions.reshape(-1, 3)
+    use_spiral = spiral_params is not None and spiral_params.potential_amplitude != 0.0
+    potential, gradient = _external_field(
+        positions, float(time), G,
+        plummer_params is not None, *((plummer_params.M, plummer_params.b) if plummer_params is not None else (0.0, 1.0)),
+        spheroidal_params is not None,
+        *((spheroidal_params.M, spheroidal_params.a, spheroidal_params.b, spheroidal_params.c)
+          if spheroidal_params is not None else (0.0, 1.0, 1.0, 1.0)),
+        disk_params is not None, *((disk_params.M, disk_params.a, disk_params.b) if disk_params is not None else (0.0, 1.0, 1.0)),
+        use_spiral,
+        *((spiral_params.num_arms, spiral_params.pitch_angle, spiral_params.pattern_speed, spiral_params.potential_amplitude,
+           spiral_params.scale_length) if use_spiral else (0, 1.0, 0.0, 0.0, 1.0)))
+    if single:
+        return float(potential[0]), gradient[0]
+    return potential, gradient
+
 
-# --- Potential functions (Placeholders - not directly used in GA version for force calculation) ---
-# You can keep these for reference or remove them if not needed.
 def plummer_potential(position, params):
-    """Calculate the Plummer potential (placeholder)."""
-    return 0.0 # Placeholder
+    """Calculate the Plummer potential -G M / sqrt(r^2 + b^2) at one position or an (N,3) array."""
+    return _evaluate(position, plummer_params=params)[0]
+
+def plummer_gradient(position, params):
+    """Gradient of plummer_potential."""
+    return _evaluate(position, plummer_params=params)[1]
 
 def spheroidal_potential(position, spheroidal_params):
-    """Calculate spheroidal potential (placeholder)."""
-    return 0.0 # Placeholder
+    """Calculate the spheroidal (ellipsoidal Plummer) potential at one position or an (N,3) array."""
+    return _evaluate(position, spheroidal_params=spheroidal_params)[0]
+
+def spheroidal_gradient(position, spheroidal_params):
+    """Gradient of spheroidal_potential."""
+    return _evaluate(position, spheroidal_params=spheroidal_params)[1]
 
 def miyamoto_nagai_potential(position, params):
-    """Calculates the Miyamoto-Nagai potential (placeholder)."""
-    return 0.0 # Placeholder
+    """Calculates the Miyamoto-Nagai potential of a DiskParams disk at one position or an (N,3) array."""
+    return _evaluate(position, disk_params=params)[0]
+
+def miyamoto_nagai_gradient(position, params):
+    """Gradient of miyamoto_nagai_potential."""
+    return _evaluate(position, disk_params=params)[1]
 
 def spiral_arm_potential(position, time, spiral_params):
-    """Calculates the spiral arm potential (placeholder)."""
-    return 0.0 # Placeholder
+    """Calculates the rotating logarithmic spiral arm potential at one position or an (N,3) array."""
+    return _evaluate(position, time, spiral_params=spiral_params)[0]
+
+def spiral_arm_gradient(position, time, spiral_params):
+    """Gradient of spiral_arm_potential."""
+    return _evaluate(position, time, spiral_params=spiral_params)[1]
+
+def total_potential(position, time, disk_params, spiral_params, spheroidal_params, plummer_params=None):
+    """Calculate the total potential (any parameter object may be None to leave that component out)."""
+    return _evaluate(position, time, disk_params, spiral_params, spheroidal_params, plummer_params)[0]
+
+def total_potential_gradient(position, time, disk_params, spiral_params, spheroidal_params, plummer_params=None):
+    """Gradient of total_potential."""
+    return _evaluate(position, time, disk_params, spiral_params, spheroidal_params, plummer_params)[1]
+
+
+class GalacticPotential:
+    """
+    Static or rotating analytic external field for the force engines.
+    Attributes:
+        disk_params (DiskParams or None): Miyamoto-Nagai disk.
+        spiral_params (SpiralParams or None): Spiral arms (active when potential_amplitude != 0).
+        spheroidal_params (SpheroidalParams or None): Ellipsoidal Plummer spheroid.
+        plummer_params (PlummerParams or None): Plummer bulge.
+    """
+    def __init__(self, disk_params=None, spiral_params=None, spheroidal_params=None, plummer_params=None):
+        """
+        Initializes GalacticPotential. Components left as None are not included.
+        """
+        self.disk_params = disk_params
+        self.spiral_params = spiral_params
+        self.spheroidal_params = spheroidal_params
+        self.plummer_params = plummer_params
+
+    def potential(self, positions, time=0.0):
+        """
+        Args:
+            positions (np.array): (N,3) positions (kpc).
+            time (float): Simulation time (Myr).
+        Returns:
+            np.array: (N,) potential.
+        """
+        return _evaluate(positions, time, self.disk_params, self.spiral_params, self.spheroidal_params, self.plummer_params)[0]
+
+    def accelerations(self, positions, time=0.0):
+        """
+        Args:
+            positions (np.array): (N,3) positions (kpc).
+            time (float): Simulation time (Myr).
+        Returns:
+            np.array: (N,3) accelerations -grad(Phi).
+        """
+        return -_evaluate(positions, time, self.disk_params, self.spiral_params, self.spheroidal_params, self.plummer_params)[1]
+
+
+if __name__ == '__main__':
+    import time as timer
+
+    disk_example = DiskParams(M=40.0, a=4.0, b=0.2, disk_radius=12.0, disk_thickness=0.8, v_circ_factor=0.9, velocity_dispersion=15.0)
+    spiral_example = SpiralParams(num_arms=2, pitch_angle=0.2, pattern_speed=0.8, amplitude_pos=0.05, amplitude_vel=5.0,
+                                  scale_length=4.0, potential_amplitude=1e-5)
+    spheroid_example = SpheroidalParams(15.0, 15.0, 4.0, 100.0)
+    plummer_example = PlummerParams(M=10.0, b=0.5)
+    field = GalacticPotential(disk_example, spiral_example, spheroid_example, plummer_example)
+
+    # --- Analytic gradients against central differences ---
+    rng = np.random.default_rng(42)
+    sample = rng.normal(scale=5.0, size=(1000, 3))
+    step = 1e-6
+    numerical = np.stack([(field.potential(sample + step * e, 3.0) - field.potential(sample - step * e, 3.0)) / (2 * step)
+                          for e in np.eye(3)], axis=1)
+    analytic = -field.accelerations(sample, 3.0)
+    print(f"max relative gradient error: {np.max(np.abs(analytic - numerical)) / np.max(np.abs(analytic)):.1e}")
 
-def total_potential(position, time, disk_params, spiral_params, spheroidal_params):
-    """Calculate the total potential (placeholder)."""
-    return 0.0 # Placeholder
+    positions_example = rng.normal(scale=5.0, size=(1000000, 3))
+    field.accelerations(positions_example[:10])
+    start = timer.perf_counter()
+    field.accelerations(positions_example, 3.0)
+    print(f"fused external field for {len(positions_example)} positions: {(timer.perf_counter() - start) * 1e3:.0f} ms")
 # --- END OF FILE galactic_potential.py ---
\ No newline at end of file
@@ -0,0 +1,292 @@
+# src/homoeoid.py
+#--- START OF FILE homoeoid.py ---
+# src/homoeoid.py
+import hashlib
+import os
+import numpy as np
+from numba import njit, prange
+from src.shell_potential import ShellSet, as_shell_set, is_concentric, SHELL_G
+
+# Gravity of thin homoeoids (ellipsoidal shells) with semi-axes (a, a, c), a = semimajor_axis in
+# the plane and c = semiminor_axis along z. Outside the shell the potential is constant on
+# the confocal ellipsoids, Phi = -(G M / 2) int_lambda^inf du / Delta(u) with
+# Delta(u) = (a^2 + u) sqrt(c^2 + u) and lambda the largest root of
+# R^2 / (a^2 + lambda) + z^2 / (c^2 + lambda) = 1; inside, the force vanishes. Differentiating the
+# integral gives the field in closed form,
+#   g_i = -(G M / Delta(lambda)) (x_i / (a_i^2 + lambda)) / sum_j x_j^2 / (a_j^2 + lambda)^2,
+# and for two equal axes lambda solves a quadratic, so no quadrature is needed per evaluation.
+# Summed over many shells this is still O(S) per position, so for concentric shells the field
+# is tabulated once on an (R, |z|) grid and interpolated bilinearly.
+DEFAULT_GRID_SIZE = 256  # Grid points along R and along |z|
+DEFAULT_GRID_EXTENT = 2.0  # Grid half-size in units of the largest semi-major axis
+DEFAULT_CACHE_DIR = os.path.join("simulation_data", "background_cache")
+GRID_FORMAT_VERSION = 1  # Bump when the tabulated quantity changes, to invalidate old cache files
+
+
+@njit(cache=True)
+def _homoeoid_field(R, z, mass, a, c, grav_const):
+    """Returns (g_R, g_z) of one thin homoeoid at cylindrical offset (R, z) from its center."""
+    a_sq = a * a
+    c_sq = c * c
+    if R * R / a_sq + z * z / c_sq <= 1.0:
+        return 0.0, 0.0  # Inside the shell (or on it): no force
+    b = a_sq + c_sq - R * R - z * z
+    q = a_sq * c_sq - R * R * c_sq - z * z * a_sq  # Negative outside the shell
+    root = np.sqrt(b * b - 4.0 * q)
+    lam = -2.0 * q / (b + root) if b > 0.0 else 0.5 * (root - b)  # Largest root, without cancellation
+    ua = a_sq + lam
+    uc = c_sq + lam
+    delta = ua * np.sqrt(uc)
+    weight = grav_const * mass / (delta * (R * R / (ua * ua) + z * z / (uc * uc)))
+    return -weight * R / ua, -weight * z / uc
+
+
+@njit(parallel=True, cache=True)
+def _homoeoid_accelerations(positions, masses, semimajor_axes, semiminor_axes, centers, grav_const):
+    """Sums the exact field of every homoeoid (each with its own center) at every position."""
+    num_positions = positions.shape[0]
+    accelerations = np.zeros((num_positions, 3))
+    for n in prange(num_positions):
+        for s in range(masses.shape[0]):
+            dx = positions[n, 0] - centers[s, 0]
+            dy = positions[n, 1] - centers[s, 1]
+            dz = positions[n, 2] - centers[s, 2]
+            R = np.sqrt(dx * dx + dy * dy)
+            g_R, g_z = _homoeoid_field(R, dz, masses[s], semimajor_axes[s], semiminor_axes[s], grav_const)
+            if R > 0.0:
+                accelerations[n, 0] += g_R * dx / R
+                accelerations[n, 1] += g_R * dy / R
+            accelerations[n, 2] += g_z
+    return accelerations
+
+
+def homoeoid_accelerations(positions, shells, grav_const=SHELL_G):
+    """
+    Evaluates the exact gravitational field of a set of thin homoeoids.
+    Unlike shell_forces, which treats every shell as a sphere of radius semimajor_axis, this
+    uses the semi-minor axis along z and the physically attractive sign.
+    Args:
+        positions (np.array): (N,3) Cartesian positions.
+        shells (list or ShellSet): The shells.
+        grav_const (float): Gravitational constant (defaults to the shell background's).
+    Returns:
+        np.array: (N,3) field (force per unit mass) at each position.
+    """
+    positions = np.ascontiguousarray(positions, dtype=np.float64).reshape(-1, 3)
+    shell_set = as_shell_set(shells)
+    if len(shell_set) == 0:
+        return np.zeros((len(positions), 3))
+    if np.any(shell_set.semiminor_axes <= 0) or np.any(shell_set.semimajor_axes <= 0):
+        raise ValueError("Homoeoid shells need positive semi-major and semi-minor axes.")
+    return _homoeoid_accelerations(positions, shell_set.masses, shell_set.semimajor_axes, shell_set.semiminor_axes,
+                                   shell_set.centers, grav_const)
+
+
+class HomoeoidShells:
+    """
+    Exact homoeoid background for shells that do not share a center (no grid possible).
+    Attributes:
+        shell_set (ShellSet): The shells.
+        grav_const (float): Gravitational constant.
+    """
+    def __init__(self, shell_set, grav_const=SHELL_G):
+        self.shell_set = shell_set
+        self.grav_const = grav_const
+
+    def forces(self, positions):
+        return homoeoid_accelerations(positions, self.shell_set, self.grav_const)
+
+
+@njit(parallel=True, cache=True)
+def _grid_lookup(positions, center, spacing_R, spacing_z, num_R, num_z, g_R, g_z, outside):
+    """Bilinear (R, |z|) interpolation; flags positions beyond the grid in outside."""
+    num_positions = positions.shape[0]
+    accelerations = np.zeros((num_positions, 3))
+    for n in prange(num_positions):
+        dx = positions[n, 0] - center[0]
+        dy = positions[n, 1] - center[1]
+        dz = positions[n, 2] - center[2]
+        R = np.sqrt(dx * dx + dy * dy)
+        u = R / spacing_R
+        v = abs(dz) / spacing_z
+        i = int(u)
+        j = int(v)
+        if i >= num_R - 1 or j >= num_z - 1:
+            outside[n] = True
+            continue
+        fu = u - i
+        fv = v - j
+        w00 = (1.0 - fu) * (1.0 - fv)
+        w10 = fu * (1.0 - fv)
+        w01 = (1.0 - fu) * fv
+        w11 = fu * fv
+        radial = w00 * g_R[i, j] + w10 * g_R[i + 1, j] + w01 * g_R[i, j + 1] + w11 * g_R[i + 1, j + 1]
+        vertical = w00 * g_z[i, j] + w10 * g_z[i + 1, j] + w01 * g_z[i, j + 1] + w11 * g_z[i + 1, j + 1]
+        if R > 0.0:
+            accelerations[n, 0] = radial * dx / R
+            accelerations[n, 1] = radial * dy / R
+        accelerations[n, 2] = vertical if dz >= 0.0 else -vertical  # Field is odd in z
+    return accelerations
+
+
+class HomoeoidGrid:
+    """
+    Tabulated (R, |z|) field of concentric thin homoeoids, served by bilinear interpolation.
+    Positions beyond the grid are evaluated exactly.
+    Attributes:
+        shell_set (ShellSet): The shells (used beyond the grid).
+        center (np.array): (3,) common center.
+        spacing_R (float): Grid spacing along R.
+        spacing_z (float): Grid spacing along |z|.
+        g_R (np.array): (n_R, n_z) radial field at the grid nodes.
+        g_z (np.array): (n_R, n_z) vertical field at the grid nodes (z >= 0).
+        interpolation_error (dict): Median, 99th percentile and maximum relative error of the
+            interpolated field at the cell centres, against the exact field.
+        grav_const (float): Gravitational constant.
+    """
+    def __init__(self, shell_set, grid_size=DEFAULT_GRID_SIZE, extent=DEFAULT_GRID_EXTENT, grav_const=SHELL_G,
+                 cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Builds the grid, or loads it from cache_dir if it was built before for the same shells.
+        Args:
+            shell_set (ShellSet): Shells with a common center.
+            grid_size (int): Grid points along R and along |z|.
+            extent (float): Grid half-size in units of the largest semi-major axis.
+            grav_const (float): Gravitational constant.
+            cache_dir (str or None): Directory for cached grids; None disables the disk cache.
+        """
+        if not is_concentric(shell_set):
+            raise ValueError("HomoeoidGrid needs shells with a common center.")
+        self.shell_set = shell_set
+        self.center = shell_set.centers[0].copy()
+        self.grav_const = float(grav_const)
+        half_size = extent * float(np.max(shell_set.semimajor_axes))
+        self.spacing_R = half_size / (grid_size - 1)
+        self.spacing_z = half_size / (grid_size - 1)
+
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, f"homoeoid_{self.cache_key(grid_size, extent)}.npz")
+        if path is not None and os.path.exists(path):
+            with np.load(path) as cached:
+                self.g_R = cached["g_R"]
+                self.g_z = cached["g_z"]
+                self.interpolation_error = {key: float(cached[key]) for key in ("median", "p99", "max")}
+            self.loaded_from_cache = True
+            return
+
+        nodes = np.arange(grid_size) * self.spacing_R
+        R, z = np.meshgrid(nodes, np.arange(grid_size) * self.spacing_z, indexing='ij')
+        field = self._exact(np.column_stack((R.ravel(), np.zeros(R.size), z.ravel())) + self.center)
+        self.g_R = np.ascontiguousarray(field[:, 0].reshape(R.shape))
+        self.g_z = np.ascontiguousarray(field[:, 2].reshape(R.shape))
+        self.interpolation_error = self._measure_error()
+        self.loaded_from_cache = False
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_path = path + f".{os.getpid()}.tmp.npz"
+            np.savez(temp_path, g_R=self.g_R, g_z=self.g_z, **self.interpolation_error)
+            os.replace(temp_path, path)  # Atomic, so concurrent runs never read a partial file
+
+    def cache_key(self, grid_size, extent):
+        """Hash of everything the tabulated field depends on."""
+        digest = hashlib.sha1()
+        for array in (self.shell_set.masses, self.shell_set.semimajor_axes, self.shell_set.semiminor_axes, self.center):
+            digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        digest.update(repr((grid_size, float(extent), self.grav_const, GRID_FORMAT_VERSION)).encode())
+        return digest.hexdigest()[:16]
+
+    def _exact(self, positions):
+        return homoeoid_accelerations(positions, self.shell_set, self.grav_const)
+
+    def _measure_error(self):
+        """Compares the interpolated field with the exact field at the centres of the grid cells."""
+        num_R, num_z = self.g_R.shape
+        R_mid = (np.arange(num_R - 1) + 0.5) * self.spacing_R
+        z_mid = (np.arange(num_z - 1) + 0.5) * self.spacing_z
+        R, z = np.meshgrid(R_mid, z_mid, indexing='ij')
+        positions = np.column_stack((R.ravel(), np.zeros(R.size), z.ravel())) + self.center
+        exact = self._exact(positions)
+        interpolated = self.forces(positions)
+        norm = np.linalg.norm(exact, axis=1)
+        nonzero = norm > 0
+        error = np.linalg.norm(interpolated - exact, axis=1)[nonzero] / norm[nonzero]
+        if len(error) == 0:
+            return {"median": 0.0, "p99": 0.0, "max": 0.0}
+        return {"median": float(np.median(error)), "p99": float(np.percentile(error, 99)), "max": float(np.max(error))}
+
+    def forces(self, positions):
+        """
+        Args:
+            positions (np.array): (N,3) Cartesian positions.
+        Returns:
+            np.array: (N,3) field (force per unit mass) at each position.
+        """
+        positions = np.ascontiguousarray(positions, dtype=np.float64).reshape(-1, 3)
+        outside = np.zeros(len(positions), dtype=np.bool_)
+        accelerations = _grid_lookup(positions, self.center, self.spacing_R, self.spacing_z,
+                                     self.g_R.shape[0], self.g_R.shape[1], self.g_R, self.g_z, outside)
+        if outside.any():
+            accelerations[outside] = self._exact(positions[outside])
+        return accelerations
+
+
+def build_homoeoid_background(shells, grid_size=DEFAULT_GRID_SIZE, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Prepares the homoeoid background: a HomoeoidGrid for concentric shells, otherwise the
+    exact shell-by-shell field.
+    Args:
+        shells (list or ShellSet): The shells.
+        grid_size (int): Grid points along R and along |z|.
+        cache_dir (str or None): Directory for cached grids; None disables the disk cache.
+    Returns:
+        HomoeoidGrid or HomoeoidShells: Background accepted by shell_forces.
+    """
+    shell_set = as_shell_set(shells)
+    if is_concentric(shell_set):
+        return HomoeoidGrid(shell_set, grid_size, cache_dir=cache_dir)
+    return HomoeoidShells(shell_set)
+
+
+if __name__ == '__main__':
+    import time
+    from scipy.integrate import quad
+
+    # --- Closed form against a numerical derivative of the potential integral ---
+    mass, a, c = 2.0, 3.0, 1.2
+    point = np.array([2.5, 0.0, 1.4])
+
+    def potential(x):
+        R_sq, z_sq = x[0] ** 2 + x[1] ** 2, x[2] ** 2
+        b = a * a + c * c - R_sq - z_sq
+        lam = 0.5 * (-b + np.sqrt(b * b - 4.0 * (a * a * c * c - R_sq * c * c - z_sq * a * a)))
+        return -0.5 * SHELL_G * mass * quad(lambda u: 1.0 / ((a * a + u) * np.sqrt(c * c + u)), lam, np.inf)[0]
+
+    step = 1e-5
+    numerical = [-(potential(point + step * e) - potential(point - step * e)) / (2 * step) for e in np.eye(3)]
+    closed_form = homoeoid_accelerations(point[None, :], ShellSet([mass], [a], [c], [np.zeros(3)]))[0]
+    print(f"closed form {closed_form}, numerical {np.array(numerical)}")
+
+    # --- Grid accuracy and speed for a flattened spheroid ---
+    num_shells = 20
+    radii = np.linspace(0.4, 16.5, num_shells)
+    shells_example = ShellSet(np.full(num_shells, 5.0), radii, radii * 4.0 / 15.0, np.zeros((num_shells, 3)))
+    for grid_size in (128, 256, 512):
+        start = time.perf_counter()
+        grid = HomoeoidGrid(shells_example, grid_size, cache_dir=None)
+        build_time = time.perf_counter() - start
+        error = grid.interpolation_error
+        print(f"grid {grid_size}^2: built in {build_time:.2f} s, interpolation error median {error['median']:.1e}, "
+              f"99th percentile {error['p99']:.1e}, max {error['max']:.1e} (max sits on the shell surfaces)")
+
+    rng = np.random.default_rng(42)
+    positions_sample = rng.normal(scale=6.0, size=(200000, 3))
+    grid.forces(positions_sample[:10])
+    start = time.perf_counter()
+    grid.forces(positions_sample)
+    lookup_time = time.perf_counter() - start
+    start = time.perf_counter()
+    homoeoid_accelerations(positions_sample, shells_example)
+    exact_time = time.perf_counter() - start
+    print(f"{len(positions_sample)} positions: grid {lookup_time * 1e3:.1f} ms, exact {exact_time * 1e3:.1f} ms")
+# --- END OF FILE homoeoid.py ---
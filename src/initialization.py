@@ -4,9 +4,10 @@
 import numpy as np
 import random
 from scipy.stats import pareto
-from src.particles import Star, BlackHole
+from src.particles import Star, BlackHole, ParticleSet, KIND_STAR
 from src.galactic_potential import G
 from src.ga_utils import to_ga_point # Import to_ga_point
+from src.rotors import plane_rotor, apply_rotor
 
 
 def random_in_spheroid(a, b, c, rng=random):
@@ -27,6 +28,22 @@ def random_in_spheroid(a, b, c, rng=random):
         if (x**2 / a**2) + (y**2 / b**2) + (z**2 / c**2) <= 1.0:
             return np.array([x, y, z])
 
+def random_disk_coordinates(radius, thickness, rng=random):
+    """
+    Draws the cylindrical coordinates of a random point within a disk (uniform in radius and z).
+    This is the one place that fixes the order of the draws (radius, azimuth, height).
+    Args:
+        radius (float): Radius of the disk.
+        thickness (float): Thickness of the disk.
+        rng (random.Random): Random number generator.
+    Returns:
+        tuple: (r, theta, z).
+    """
+    r = np.sqrt(rng.random()) * radius
+    theta = 2 * np.pi * rng.random()
+    z = rng.uniform(-thickness/2, thickness/2)
+    return r, theta, z
+
 def random_in_disk(radius, thickness, rng=random):
     """
     Generate a random point within a disk (uniform in radius and z).
@@ -37,18 +54,40 @@ def random_in_disk(radius, thickness, rng=random):
     Returns:
         np.array: Random position within the disk.
     """
-    r = np.sqrt(rng.random()) * radius
-    theta = 2 * np.pi * rng.random()
+    r, theta, z = random_disk_coordinates(radius, thickness, rng)
     x = r * np.cos(theta)
     y = r * np.sin(theta)
-    z = rng.uniform(-thickness/2, thickness/2)
     return np.array([x, y, z])
 
+def _star_state(particles):
+    """Returns (handle, positions, velocities) of the stars in a particle list or ParticleSet.
+    The stars come in ID order (list order for a list), whatever the set's storage order."""
+    if isinstance(particles, ParticleSet):
+        handle = np.flatnonzero(particles.kind == KIND_STAR)
+        handle = handle[np.argsort(particles.ids[handle], kind='stable')] # Storage order changes under Morton re-sorts
+        return handle, particles.positions[handle], particles.velocities[handle]
+    handle = [p for p in particles if isinstance(p, Star)]
+    return (handle, np.array([p.position for p in handle], dtype=np.float64).reshape(-1, 3),
+            np.array([p.velocity for p in handle], dtype=np.float64).reshape(-1, 3))
+
+def _set_star_state(particles, handle, positions, velocities):
+    """Writes star positions and velocities back (handle from _star_state, or a subset of it)."""
+    if isinstance(particles, ParticleSet):
+        particles.positions[handle] = positions
+        particles.velocities[handle] = velocities
+        return
+    for p, position, velocity in zip(handle, positions, velocities):
+        p.position = position
+        p.velocity = velocity
+
 def add_spiral_perturbation(particles, spiral_params):
     """
     Adds a spiral arm perturbation to the positions and velocities of disk stars.
+    Stars are displaced along the spiral phase by scaling their cylindrical radius and rotating
+    them about the z axis with one plane rotor per star; the velocity kick is the rotated
+    azimuthal unit vector.
     Args:
-        particles (list): List of particle objects.
+        particles (list or ParticleSet): Particles.
         spiral_params (SpiralParams): Spiral arm parameters object.
     """
     m = spiral_params.num_arms
@@ -56,52 +95,68 @@ def add_spiral_perturbation(particles, spiral_params):
     A_pos = spiral_params.amplitude_pos
     A_vel = spiral_params.amplitude_vel
     r0 = spiral_params.scale_length
-    for p in particles:
-        if isinstance(p, Star):
-            r = np.sqrt(p.position[0]**2 + p.position[1]**2)
-            if r == 0.0:
-                continue
-            phi = np.arctan2(p.position[1], p.position[0])
-            phase = m * phi - (1/np.tan(alpha)) * np.log(r/r0)
-
-            delta_r = A_pos * np.cos(phase)
-            new_r = max(0.0, r + delta_r)
-
-            delta_phi = -(A_pos / (r * np.tan(alpha))) * np.cos(phase)
-            new_phi = phi + delta_phi
-
-            p.position = np.array([new_r * np.cos(new_phi), new_r * np.sin(new_phi), p.position[2]])
-
-            delta_vphi = A_vel * np.sin(phase)
-            p.velocity = np.array([p.velocity[0] - delta_vphi * np.sin(new_phi), p.velocity[1] + delta_vphi * np.cos(new_phi), p.velocity[2]])
-
-def form_disk(particles, disk_params, spiral_params):
+    handle, positions, velocities = _star_state(particles)
+    off_axis = (positions[:, 0] != 0.0) | (positions[:, 1] != 0.0)
+    if not np.any(off_axis):
+        return
+    handle = handle[off_axis] if isinstance(handle, np.ndarray) else [p for p, keep in zip(handle, off_axis) if keep]
+    positions = positions[off_axis]
+    velocities = velocities[off_axis]
+    r = np.hypot(positions[:, 0], positions[:, 1])
+    phi = np.arctan2(positions[:, 1], positions[:, 0])
+    phase = m * phi - (1/np.tan(alpha)) * np.log(r/r0)
+
+    new_r = np.maximum(0.0, r + A_pos * np.cos(phase))
+    delta_phi = -(A_pos / (r * np.tan(alpha))) * np.cos(phase)
+    rotors = plane_rotor(delta_phi)
+
+    planar = positions.copy()
+    planar[:, 2] = 0.0
+    new_positions = apply_rotor(rotors, planar) * (new_r / r)[:, None]
+    new_positions[:, 2] = positions[:, 2]
+
+    azimuthal = np.column_stack([-positions[:, 1] / r, positions[:, 0] / r, np.zeros(len(r))])
+    velocities += (A_vel * np.sin(phase))[:, None] * apply_rotor(rotors, azimuthal)
+    _set_star_state(particles, handle, new_positions, velocities)
+
+def form_disk(particles, disk_params, spiral_params, rng=None):
     """
     Forms a disk galaxy by repositioning star particles and setting their initial velocities.
+    Random numbers are drawn star by star in ID order, so a re-sorted ParticleSet gets the same
+    disk (random_disk_coordinates, as in random_in_disk, then the velocity dispersion); positions and circular velocities are then placed by rotating
+    (r, 0, 0) and (0, v_circ, 0) to each star's azimuth with a plane rotor.
     Args:
-        particles (list): List of particle objects.
+        particles (list or ParticleSet): Particles.
         disk_params (DiskParams): Disk parameters object.
         spiral_params (SpiralParams): Spiral arm parameters object.
+        rng (random.Random): Random number generator; None uses a fresh random.Random(1234), so
+            every call draws the same disk.
     Returns:
-        list: Updated list of particles.
+        list or ParticleSet: Updated particles.
     """
-    rng = random.Random(1234)
+    rng = random.Random(1234) if rng is None else rng
     disk_radius = disk_params.disk_radius
     disk_thickness = disk_params.disk_thickness
     v_circ_factor = disk_params.v_circ_factor
-
-    for p in particles:
-        if isinstance(p, Star):
-            new_pos = random_in_disk(disk_radius, disk_thickness, rng)
-            p.position = new_pos
-
-            r = np.sqrt(new_pos[0]**2 + new_pos[1]**2)
-            v_circ = v_circ_factor * np.sqrt(G * disk_params.M / (np.sqrt(r**2 + disk_params.a**2 + disk_params.b**2)))
-
-            phi = np.arctan2(new_pos[1], new_pos[0])
-            p.velocity = np.array([-v_circ * np.sin(phi) + rng.gauss(0, disk_params.velocity_dispersion),
-                                   v_circ * np.cos(phi) + rng.gauss(0, disk_params.velocity_dispersion),
-                                   rng.gauss(0, disk_params.velocity_dispersion * 0.2)])
+    sigma = disk_params.velocity_dispersion
+
+    handle, _, _ = _star_state(particles)
+    num_stars = len(handle)
+    radii = np.empty(num_stars)
+    azimuths = np.empty(num_stars)
+    heights = np.empty(num_stars)
+    dispersion = np.empty((num_stars, 3))
+    for k in range(num_stars):
+        radii[k], azimuths[k], heights[k] = random_disk_coordinates(disk_radius, disk_thickness, rng) # Same draws as random_in_disk
+        dispersion[k] = (rng.gauss(0, sigma), rng.gauss(0, sigma), rng.gauss(0, sigma * 0.2))
+
+    v_circ = v_circ_factor * np.sqrt(G * disk_params.M / (np.sqrt(radii**2 + disk_params.a**2 + disk_params.b**2)))
+    rotors = plane_rotor(azimuths)
+    zeros = np.zeros(num_stars)
+    positions = apply_rotor(rotors, np.column_stack([radii, zeros, zeros]))
+    positions[:, 2] = heights
+    velocities = apply_rotor(rotors, np.column_stack([zeros, v_circ, zeros])) + dispersion
+    _set_star_state(particles, handle, positions, velocities)
 
     add_spiral_perturbation(particles, spiral_params)
     return particles
@@ -109,7 +164,8 @@ def form_disk(particles, disk_params, spiral_params):
 
 def initialize_particles(num_stars, num_bhs, spheroid_a, spheroid_b, spheroid_c, velocity_dispersion,
                          bh_mass_min=50.0, bh_mass_max=200.0, bh_mass_alpha=2.35,
-                         bh_a_scale=0.5, bh_b_scale=0.5, bh_c_scale=0.5, rng=random):
+                         bh_a_scale=0.5, bh_b_scale=0.5, bh_c_scale=0.5, rng=random, as_particle_set=False,
+                         bh_mass_rng=None):
     """
     Initializes star and black hole particles with spheroidal distributions and power-law BH masses.
     Args:
@@ -126,8 +182,10 @@ def initialize_particles(num_stars, num_bhs, spheroid_a, spheroid_b, spheroid_c,
         bh_b_scale (float): Scaling factor for BH spheroid b-axis.
         bh_c_scale (float): Scaling factor for BH spheroid c-axis.
         rng (random.Random): Random number generator.
+        as_particle_set (bool): Return one ParticleSet (stars first, then black holes) instead of lists.
+        bh_mass_rng (np.random.Generator): Generator for the BH mass draws; None uses the global NumPy stream.
     Returns:
-        tuple: (stars, black_holes) - lists of Star and BlackHole objects.
+        tuple or ParticleSet: (stars, black_holes) - lists of Star and BlackHole objects, or a ParticleSet.
     """
     stars = []
     black_holes = []
@@ -144,7 +202,7 @@ def initialize_particles(num_stars, num_bhs, spheroid_a, spheroid_b, spheroid_c,
     alpha_minus_one = bh_mass_alpha - 1
     power_law_dist = pareto(alpha_minus_one)
 
-    bh_masses_cdf_vals = np.random.uniform(0, 1, num_bhs)
+    bh_masses_cdf_vals = (np.random if bh_mass_rng is None else bh_mass_rng).uniform(0, 1, num_bhs)
     lower_cdf = power_law_dist.cdf(bh_mass_min)
     upper_cdf = power_law_dist.cdf(bh_mass_max)
     normalized_cdf_values = lower_cdf + bh_masses_cdf_vals * (upper_cdf - lower_cdf)
@@ -156,5 +214,7 @@ def initialize_particles(num_stars, num_bhs, spheroid_a, spheroid_b, spheroid_c,
         bh_mass = bh_masses[_]
         black_holes.append(BlackHole(bh_pos, bh_vel, bh_mass))
 
+    if as_particle_set:
+        return ParticleSet.from_particles(stars + black_holes)
     return stars, black_holes
 # --- END OF FILE initialization.py ---
\ No newline at end of file
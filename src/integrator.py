@@ -2,51 +2,257 @@
 #--- START OF FILE integrator.py ---
 # src/integrator.py
 import numpy as np
-from src.ga_utils import from_ga_vector, to_ga_vector, ga_vector_add, ga_vector_norm_sq, to_ga_point # Added to_ga_point
+import kingdon as kg
+from numba import njit, prange
+from src.ga_utils import from_ga_vector, from_ga_vectors
+from src.particles import ParticleSet
+
+# Yoshida (1990) fourth-order composition: leapfrog steps of w1 dt, w0 dt and w1 dt, with
+# 2 w1 + w0 = 1 and 2 w1^3 + w0^3 = 0 cancelling the third-order error (w0 < 0 steps backwards)
+YOSHIDA_W1 = 1.0 / (2.0 - 2.0 ** (1.0 / 3.0))
+YOSHIDA_W0 = 1.0 - 2.0 * YOSHIDA_W1
+
+# The array kernels below update (N,3) velocity and position arrays in place in one compiled
+# pass, with no per-particle objects or temporaries. They keep the operation order of the
+# equivalent NumPy expressions (no fastmath), so results are bit-identical to them. Per-particle
+# arguments that may also be uniform (dt, the active mask) are passed as length-1 or length-N
+# arrays and indexed with a stride of 0 or 1, as in rotors._sandwich_kernel.
+
+
+@njit(parallel=True, cache=True)
+def _kick_kernel(velocities, forces, masses, dt, active):
+    """velocities[k] += dt[k] * (forces[k] / masses[k]) for the active particles."""
+    dt_stride = 0 if dt.shape[0] == 1 else 1
+    active_stride = 0 if active.shape[0] == 1 else 1
+    for k in prange(velocities.shape[0]):
+        if active[k * active_stride]:
+            step = dt[k * dt_stride]
+            for axis in range(3):
+                velocities[k, axis] += step * (forces[k, axis] / masses[k])
+
+
+@njit(parallel=True, cache=True)
+def _drift_kernel(positions, velocities, dt):
+    """positions[k] += dt[k] * velocities[k]."""
+    dt_stride = 0 if dt.shape[0] == 1 else 1
+    for k in prange(positions.shape[0]):
+        step = dt[k * dt_stride]
+        for axis in range(3):
+            positions[k, axis] += step * velocities[k, axis]
+
+
+@njit(parallel=True, cache=True)
+def _kick_drift_kernel(positions, velocities, forces, masses, kick_dt, drift_dt):
+    """A kick by kick_dt[k] followed by a drift by drift_dt[k], fused into one pass."""
+    dt_stride = 0 if kick_dt.shape[0] == 1 else 1
+    for k in prange(positions.shape[0]):
+        kick_step = kick_dt[k * dt_stride]
+        drift_step = drift_dt[k * dt_stride]
+        for axis in range(3):
+            velocities[k, axis] += kick_step * (forces[k, axis] / masses[k])
+            positions[k, axis] += drift_step * velocities[k, axis]
+
+
+@njit(parallel=True, cache=True)
+def _max_squares_kernel(forces, velocities, masses):
+    """Returns the largest squared acceleration and squared speed."""
+    num_particles = forces.shape[0]
+    acc_sq = np.zeros(num_particles)
+    vel_sq = np.zeros(num_particles)
+    for k in prange(num_particles):
+        ax = forces[k, 0] / masses[k]
+        ay = forces[k, 1] / masses[k]
+        az = forces[k, 2] / masses[k]
+        acc_sq[k] = ax * ax + ay * ay + az * az
+        vel_sq[k] = velocities[k, 0] * velocities[k, 0] + velocities[k, 1] * velocities[k, 1] + velocities[k, 2] * velocities[k, 2]
+    return acc_sq.max(), vel_sq.max()
+
+
+@njit(parallel=True, cache=True)
+def _particle_timestep_kernel(forces, velocities, masses, cfl, softening_length, dt_min, dt_max):
+    """Per-particle version of the adaptive_timestep criteria."""
+    num_particles = forces.shape[0]
+    timesteps = np.empty(num_particles)
+    for k in prange(num_particles):
+        ax = forces[k, 0] / masses[k]
+        ay = forces[k, 1] / masses[k]
+        az = forces[k, 2] / masses[k]
+        acc = np.sqrt(ax * ax + ay * ay + az * az)
+        vel = np.sqrt(velocities[k, 0] * velocities[k, 0] + velocities[k, 1] * velocities[k, 1] + velocities[k, 2] * velocities[k, 2])
+        acc = acc if acc > 0 else 1e-9
+        vel = vel if vel > 0 else 1e-9
+        step = min(cfl * softening_length / vel, np.sqrt(cfl * softening_length / acc))
+        timesteps[k] = min(max(step, dt_min), dt_max)
+    return timesteps
+
+
+def kick(velocities, forces, masses, dt, active=None):
+    """
+    Kicks velocities by dt * F / m, in place.
+    Args:
+        velocities (np.array): (N,3) float64 velocities (updated in place).
+        forces (np.array): (N,3) forces.
+        masses (np.array): (N,) masses.
+        dt (float or np.array): Kick duration, or (N,) per-particle durations.
+        active (np.array): Optional (N,) boolean mask of the particles to kick.
+    """
+    dt = np.ascontiguousarray(dt, dtype=np.float64).reshape(-1)
+    active = np.ones(1, dtype=np.bool_) if active is None else np.ascontiguousarray(active, dtype=np.bool_)
+    _kick_kernel(velocities, np.ascontiguousarray(forces, dtype=np.float64), masses, dt, active)
+
+
+def drift(positions, velocities, dt):
+    """
+    Drifts positions by dt * velocity, in place.
+    Args:
+        positions (np.array): (N,3) float64 positions (updated in place).
+        velocities (np.array): (N,3) velocities.
+        dt (float or np.array): Drift duration, or (N,) per-particle durations.
+    """
+    _drift_kernel(positions, velocities, np.ascontiguousarray(dt, dtype=np.float64).reshape(-1))
+
+
+def kick_drift(positions, velocities, forces, masses, kick_dt, drift_dt):
+    """
+    Kicks velocities by kick_dt * F / m and then drifts positions by drift_dt, in place and in
+    one pass over the particles.
+    Args:
+        positions (np.array): (N,3) float64 positions (updated in place).
+        velocities (np.array): (N,3) float64 velocities (updated in place).
+        forces (np.array): (N,3) forces.
+        masses (np.array): (N,) masses.
+        kick_dt (float or np.array): Kick duration, or (N,) per-particle durations.
+        drift_dt (float or np.array): Drift duration, or (N,) per-particle durations (same form as kick_dt).
+    """
+    kick_dt = np.ascontiguousarray(kick_dt, dtype=np.float64).reshape(-1)
+    drift_dt = np.ascontiguousarray(drift_dt, dtype=np.float64).reshape(-1)
+    if kick_dt.shape != drift_dt.shape:
+        raise ValueError("kick_dt and drift_dt must both be scalars or both have one entry per particle.")
+    _kick_drift_kernel(positions, velocities, np.ascontiguousarray(forces, dtype=np.float64), masses, kick_dt, drift_dt)
+
+
+def timestep(forces, velocities, masses, sim_params):
+    """
+    Calculates the adaptive global time step from the largest acceleration and speed:
+    min(sqrt(CFL * eps / a_max), CFL * eps / v_max), clamped to [dt_min, dt_max].
+    Args:
+        forces (np.array): (N,3) forces.
+        velocities (np.array): (N,3) velocities.
+        masses (np.array): (N,) masses.
+        sim_params (SimulationParams): Simulation parameters object.
+    Returns:
+        float: Adaptive time step.
+    """
+    max_acc_sq, max_vel_sq = 0.0, 0.0
+    if len(masses) > 0:
+        max_acc_sq, max_vel_sq = _max_squares_kernel(np.ascontiguousarray(forces, dtype=np.float64), velocities, masses)
+
+    max_acc = np.sqrt(max_acc_sq) if max_acc_sq > 0 else 1e-9
+    max_vel = np.sqrt(max_vel_sq) if max_vel_sq > 0 else 1e-9
+
+    dt_acc = np.sqrt(sim_params.CFL * sim_params.softening_length / max_acc)
+    dt_vel = sim_params.CFL * sim_params.softening_length / max_vel
+    dt_estimate = min(dt_vel, dt_acc)
+    dt_estimate = max(sim_params.dt_min, dt_estimate)
+    dt_estimate = min(sim_params.dt_max, dt_estimate)
+    return dt_estimate
+
+
+def particle_timesteps(forces, velocities, masses, sim_params):
+    """
+    Calculates each particle's own time step from the criteria of timestep.
+    Args:
+        forces (np.array): (N,3) forces.
+        velocities (np.array): (N,3) velocities.
+        masses (np.array): (N,) masses.
+        sim_params (SimulationParams): Simulation parameters object.
+    Returns:
+        np.array: (N,) time steps, clamped to [dt_min, dt_max].
+    """
+    return _particle_timestep_kernel(np.ascontiguousarray(forces, dtype=np.float64), velocities, masses,
+                                     sim_params.CFL, sim_params.softening_length, sim_params.dt_min, sim_params.dt_max)
+
+
+def max_timestep_level(sim_params):
+    """
+    Returns the finest block time-step level: block_timestep_levels, reduced so that
+    dt_max / 2^level stays at or above dt_min.
+    """
+    return max(0, min(sim_params.block_timestep_levels, int(np.floor(np.log2(sim_params.dt_max / sim_params.dt_min)))))
+
+
+def timestep_levels(timesteps, dt_max, max_level):
+    """
+    Places time steps in power-of-two bins: level k steps with dt_max / 2^k, the largest such
+    step that does not exceed the particle's own time step.
+    Args:
+        timesteps (np.array): (N,) per-particle time steps.
+        dt_max (float): Step of level 0.
+        max_level (int): Finest level.
+    Returns:
+        np.array: (N,) integer levels in [0, max_level].
+    """
+    levels = np.ceil(np.log2(dt_max / np.asarray(timesteps)))
+    return np.clip(levels, 0, max_level).astype(np.int64)
+
+
+def _force_array(forces_ga):
+    """Converts forces given as an (N,3) array, one batched GA vector or a list of GA vectors/rows to an (N,3) array."""
+    if isinstance(forces_ga, kg.MultiVector):
+        return from_ga_vectors(forces_ga)
+    if isinstance(forces_ga, np.ndarray):
+        return forces_ga
+    return np.array([force if isinstance(force, np.ndarray) else from_ga_vector(force) for force in forces_ga],
+                    dtype=np.float64).reshape(-1, 3)
+
+
+def _state_arrays(particles):
+    """Returns (positions, velocities, masses) arrays of a list of particles (copies)."""
+    positions = np.array([p.position for p in particles], dtype=np.float64).reshape(-1, 3)
+    velocities = np.array([p.velocity for p in particles], dtype=np.float64).reshape(-1, 3)
+    masses = np.array([p.mass for p in particles], dtype=np.float64)
+    return positions, velocities, masses
 
 
 def velocity_verlet_step(particles, forces_ga, dt):
     """
     Performs one step of Velocity Verlet integration (first half-kick and drift).
     Args:
-        particles (list): List of particles to integrate.
-        forces_ga (list): List of forces on each particle in GA vector form.
+        particles (list or ParticleSet): Particles to integrate.
+        forces_ga (list, np.array or MultiVector): Forces on each particle, as GA vectors, an (N,3) array or one batched GA vector.
         dt (float): Time step.
         Returns:
-        list: Updated list of particles (particles are updated in-place).
-    """
-    num_particles = len(particles)
-    accelerations_ga = [to_ga_vector([0.0, 0.0, 0.0])] * num_particles
-
-    # First half-kick of velocities
-    for i in range(num_particles):
-        force_cart = from_ga_vector(forces_ga[i])
-        # Corrected line: Convert force_cart to NumPy array before division
-        accel_cart = np.array(force_cart) / particles[i].mass # a = F/m (Cartesian for now)
-        particles[i].velocity += 0.5 * dt * np.array(accel_cart)
-
-    # Full drift of positions
-    for i in range(num_particles):
-        particles[i].position += dt * particles[i].velocity
-        particles[i].position_ga = to_ga_point(particles[i].position) # Update GA position using kingdon
+        list or ParticleSet: Updated particles (particles are updated in-place).
+    """
+    forces = _force_array(forces_ga)
+    if isinstance(particles, ParticleSet): # Fused kick and drift on the arrays
+        kick_drift(particles.positions, particles.velocities, forces, particles.masses, 0.5 * dt, dt)
+        return particles
+    positions, velocities, masses = _state_arrays(particles)
+    kick_drift(positions, velocities, forces, masses, 0.5 * dt, dt)
+    for p, position, velocity in zip(particles, positions, velocities):
+        p.velocity = velocity
+        p.position = position # position_ga is rebuilt lazily on access
     return particles
 
 def velocity_verlet_second_half_kick(particles, forces_ga, dt):
     """
     Performs the second half-kick of velocities in Velocity Verlet.
     Args:
-        particles (list): List of particles.
-        forces_ga (list): List of forces on each particle in GA vector form (at the *new* positions).
+        particles (list or ParticleSet): Particles.
+        forces_ga (list, np.array or MultiVector): Forces on each particle, as GA vectors, an (N,3) array or one batched GA vector (at the *new* positions).
         dt (float): Time step.
         Returns:
-        list: Updated list of particles (particles are updated in-place).
-    """
-    num_particles = len(particles)
-    for i in range(num_particles):
-        force_cart = from_ga_vector(forces_ga[i])
-        # Corrected line: Convert force_cart to NumPy array before division
-        accel_cart = np.array(force_cart) / particles[i].mass
-        particles[i].velocity += 0.5 * dt * np.array(accel_cart)
+        list or ParticleSet: Updated particles (particles are updated in-place).
+    """
+    forces = _force_array(forces_ga)
+    if isinstance(particles, ParticleSet):
+        kick(particles.velocities, forces, particles.masses, 0.5 * dt)
+        return particles
+    _, velocities, masses = _state_arrays(particles)
+    kick(velocities, forces, masses, 0.5 * dt)
+    for p, velocity in zip(particles, velocities):
+        p.velocity = velocity
     return particles
 
 
@@ -54,33 +260,201 @@ def adaptive_timestep(particles, sim_params, forces_ga):
     """
     Calculates an adaptive time step based on particle accelerations and velocities.
     Args:
-        particles (list): List of particles.
+        particles (list or ParticleSet): Particles.
         sim_params (SimulationParams): Simulation parameters object.
-        forces_ga (list): List of forces on each particle in GA vector form.
+        forces_ga (list, np.array or MultiVector): Forces on each particle, as GA vectors, an (N,3) array or one batched GA vector.
         Returns:
         float: Adaptive time step.
     """
-    max_acc_sq = 0.0
-    max_vel_sq = 0.0
+    forces = _force_array(forces_ga)
+    if isinstance(particles, ParticleSet):
+        return timestep(forces, particles.velocities, particles.masses, sim_params)
+    _, velocities, masses = _state_arrays(particles)
+    return timestep(forces, velocities, masses, sim_params)
 
-    for i, p in enumerate(particles):
-        force_cart = from_ga_vector(forces_ga[i])
-        # Corrected line: Convert force_cart to NumPy array before division
-        accel_cart = np.array(force_cart) / p.mass
-        accel_sq = np.sum(accel_cart**2) # Use numpy for squared sum of cartesian accel
-        vel_sq = np.sum(p.velocity**2)   # Use numpy for squared sum of cartesian velocity
 
-        max_acc_sq = max(max_acc_sq, accel_sq)
-        max_vel_sq = max(max_vel_sq, vel_sq)
+def yoshida4_step(particles, forces, dt, evaluate_forces):
+    """
+    Performs one fourth-order Yoshida step: three kick-drift-kick substeps whose end forces
+    are carried into the next substep (three force evaluations per step).
+    Args:
+        particles (ParticleSet): Particles (updated in place).
+        forces (np.array): (N,3) forces at the current positions.
+        dt (float): Time step.
+        evaluate_forces (callable): evaluate_forces(particles, elapsed) returns the (N,3) forces at
+            the particles' current positions, elapsed time into the step.
+    Returns:
+        np.array: (N,3) forces at the end of the step.
+    """
+    elapsed = 0.0
+    for weight in (YOSHIDA_W1, YOSHIDA_W0, YOSHIDA_W1):
+        substep = weight * dt
+        kick_drift(particles.positions, particles.velocities, forces, particles.masses, 0.5 * substep, substep)
+        elapsed += substep
+        forces = evaluate_forces(particles, elapsed)
+        kick(particles.velocities, forces, particles.masses, 0.5 * substep)
+    return forces
 
-    max_acc = np.sqrt(max_acc_sq) if max_acc_sq > 0 else 1e-9
-    max_vel = np.sqrt(max_vel_sq) if max_vel_sq > 0 else 1e-9
 
-    dt_acc = np.sqrt(sim_params.CFL * sim_params.softening_length / max_acc)
-    dt_vel = sim_params.CFL * sim_params.softening_length / max_vel
-    dt_estimate = min(dt_vel, dt_acc)
-    dt_estimate = max(sim_params.dt_min, dt_estimate)
-    dt_estimate = min(sim_params.dt_max, dt_estimate)
+def hermite4_step(particles, forces, jerks, dt, evaluate_forces_and_jerks):
+    """
+    Performs one fourth-order Hermite predictor-corrector step (Makino & Aarseth 1992): a
+    Taylor predictor from the accelerations and jerks, one evaluation at the predicted state,
+    and a corrector from both ends' accelerations and jerks.
+    Args:
+        particles (ParticleSet): Particles (updated in place).
+        forces (np.array): (N,3) forces at the current state.
+        jerks (np.array): (N,3) force time derivatives at the current state.
+        dt (float): Time step.
+        evaluate_forces_and_jerks (callable): evaluate_forces_and_jerks(particles, elapsed) returns
+            the (N,3) forces and force derivatives at the particles' current (predicted) state.
+    Returns:
+        tuple: ((N,3) forces, (N,3) force time derivatives) at the end of the step.
+    """
+    inverse_masses = 1.0 / particles.masses[:, None]
+    acc0 = forces * inverse_masses
+    jerk0 = jerks * inverse_masses
+    positions0 = particles.positions.copy()
+    velocities0 = particles.velocities.copy()
+    particles.positions[:] = positions0 + dt * (velocities0 + dt * (0.5 * acc0 + dt / 6.0 * jerk0))  # Predictor
+    particles.velocities[:] = velocities0 + dt * (acc0 + 0.5 * dt * jerk0)
 
-    return dt_estimate
+    forces, jerks = evaluate_forces_and_jerks(particles, dt)
+    acc1 = forces * inverse_masses
+    jerk1 = jerks * inverse_masses
+    particles.velocities[:] = velocities0 + 0.5 * dt * (acc0 + acc1) + dt * dt / 12.0 * (jerk0 - jerk1)  # Corrector
+    particles.positions[:] = positions0 + 0.5 * dt * (velocities0 + particles.velocities) + dt * dt / 12.0 * (acc0 - acc1)
+    return forces, jerks
+
+
+if __name__ == '__main__':
+    import time
+    from scipy.spatial.distance import pdist
+    from src.galactic_potential import G
+    from src.simulation_params import SimulationParams
+    from src.force_engines import compute_forces, compute_forces_and_jerks
+    from src.particles import Star
+
+    def best_time(function, repeats=3):
+        function()  # Warm up (JIT compilation)
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    # --- Kick + drift + time step throughput: NumPy expressions, compiled kernels, list wrappers ---
+    bench_rng = np.random.default_rng(7)  # Own generator, so the BH core setup below keeps its draws
+    num_particles = 10 ** 6
+    positions_bench = bench_rng.normal(size=(num_particles, 3))
+    velocities_bench = bench_rng.normal(size=(num_particles, 3))
+    forces_bench = bench_rng.normal(size=(num_particles, 3))
+    masses_bench = bench_rng.uniform(0.5, 2.0, size=num_particles)
+    params_bench = SimulationParams(1e-6, 1.0, 0.1, 0.01, 1.0, 0, 1, "INFO")
+
+    def numpy_step():
+        accelerations = forces_bench / masses_bench[:, None]
+        np.max(np.sum(accelerations ** 2, axis=1))
+        np.max(np.sum(velocities_bench ** 2, axis=1))
+        velocities_bench[:] += 0.5e-9 * accelerations
+        positions_bench[:] += 1e-9 * velocities_bench
+
+    def kernel_step():
+        timestep(forces_bench, velocities_bench, masses_bench, params_bench)
+        kick_drift(positions_bench, velocities_bench, forces_bench, masses_bench, 0.5e-9, 1e-9)
+
+    num_listed = 10 ** 4
+    stars_bench = [Star(positions_bench[k], velocities_bench[k], masses_bench[k]) for k in range(num_listed)]
+
+    def list_step():
+        adaptive_timestep(stars_bench, params_bench, forces_bench[:num_listed])
+        velocity_verlet_step(stars_bench, forces_bench[:num_listed], 1e-9)
+
+    print(f"Time step + kick + drift of {num_particles} particles:")
+    for label, elapsed in (("NumPy expressions", best_time(numpy_step)), ("compiled kernels", best_time(kernel_step)),
+                           ("list wrappers (scaled from 1e4 Star objects)", best_time(list_step) * num_particles / num_listed)):
+        print(f"  {label:46s} {elapsed * 1e3:9.1f} ms  {num_particles / elapsed / 1e6:8.1f} M particles/s")
+
+    # --- BH core: a heavy central black hole, a lighter one and a cold stellar disk around them ---
+    rng = np.random.default_rng(42)
+    num_stars = 256
+    radii = rng.uniform(0.05, 0.5, size=num_stars)
+    phi = rng.uniform(0.0, 2.0 * np.pi, size=num_stars)
+    positions_example = np.column_stack([radii * np.cos(phi), radii * np.sin(phi), rng.normal(scale=0.01, size=num_stars)])
+    masses_example = np.ones(num_stars)
+    positions_example = np.vstack([[0.0, 0.0, 0.0], [0.2, 0.0, 0.0], positions_example])
+    masses_example = np.concatenate([[2e4, 2e3], masses_example])
+    r_example = np.linalg.norm(positions_example[:, :2], axis=1)
+    v_circ = np.sqrt(G * 2e4 / np.maximum(r_example, 1e-12))
+    velocities_example = np.column_stack([-v_circ * positions_example[:, 1], v_circ * positions_example[:, 0],
+                                          np.zeros(len(r_example))]) / np.maximum(r_example, 1e-12)[:, None]
+    velocities_example[0] = 0.0
+    kind_example = np.zeros(len(masses_example), dtype=np.int64)
+    kind_example[:2] = 1
+    initial = ParticleSet(positions_example, velocities_example, masses_example, kind_example)
+    params_example = SimulationParams(1e-6, 1.0, 0.1, 0.01, 1.0, 0, 1, "INFO", force_engine="direct")
+
+    mass_products = pdist(initial.masses[:, None], lambda a, b: a[0] * b[0])  # Masses are fixed: build once
+
+    def total_energy(particle_set):
+        separations = pdist(particle_set.positions)
+        potential = -G * np.sum(mass_products / np.sqrt(separations ** 2 + params_example.softening_length ** 2))
+        return 0.5 * np.sum(particle_set.masses * np.sum(particle_set.velocities ** 2, axis=1)) + potential
+
+    def evaluate(particle_set, elapsed=0.0):
+        return compute_forces(particle_set, [], params_example)
+
+    def evaluate_with_jerks(particle_set, elapsed=0.0):
+        return compute_forces_and_jerks(particle_set, [], params_example)
+
+    def integrate(scheme, dt, end_time, energy0=None):
+        """Integrates the BH core; with energy0 also returns the largest |dE/E| seen at any step."""
+        particle_set = initial.copy()
+        max_error = 0.0
+        if scheme == "hermite4":
+            forces, jerks = evaluate_with_jerks(particle_set)
+        else:
+            forces = evaluate(particle_set)
+        evaluations = 1
+        for _ in range(int(round(end_time / dt))):
+            if scheme == "verlet":
+                velocity_verlet_step(particle_set, forces, dt)
+                forces = evaluate(particle_set)
+                velocity_verlet_second_half_kick(particle_set, forces, dt)
+                evaluations += 1
+            elif scheme == "yoshida4":
+                forces = yoshida4_step(particle_set, forces, dt, evaluate)
+                evaluations += 3
+            else:
+                forces, jerks = hermite4_step(particle_set, forces, jerks, dt, evaluate_with_jerks)
+                evaluations += 1
+            if energy0 is not None:
+                max_error = max(max_error, abs(total_energy(particle_set) / energy0 - 1.0))
+        return particle_set, evaluations, max_error
+
+    for scheme in ("verlet", "yoshida4", "hermite4"):  # Warm up (JIT compilation)
+        integrate(scheme, 0.1, 0.1)
+    energy0 = total_energy(initial)
+    end_time_example = 1.0
+    results = []
+    # The error is the maximum over every step, not the value at end_time: Verlet's error oscillates
+    # within each orbit, so a single end-point sample can land near a zero crossing
+    print(f"Maximum energy error up to t = {end_time_example} (inner orbital period ~0.2) for {len(initial)} particles:")
+    print(f"  {'scheme':10s} {'dt':>10s} {'evals':>6s} {'time (ms)':>10s} {'max |dE/E|':>11s}")
+    for scheme in ("verlet", "yoshida4", "hermite4"):
+        for dt in (1 / 64, 1 / 128, 1 / 256, 1 / 512, 1 / 1024, 1 / 2048):
+            start = time.perf_counter()
+            _, evaluations, _ = integrate(scheme, dt, end_time_example)
+            elapsed = time.perf_counter() - start
+            _, _, error = integrate(scheme, dt, end_time_example, energy0)  # Untimed: energy at every step
+            results.append((scheme, dt, elapsed, error))
+            print(f"  {scheme:10s} {dt:10.2e} {evaluations:6d} {elapsed * 1e3:10.1f} {error:11.2e}")
+    for tolerance in (1e-4, 1e-6, 1e-8):
+        passing = [result for result in results if result[3] <= tolerance]
+        if passing:
+            scheme, dt, elapsed, error = min(passing, key=lambda result: result[2])
+            print(f"Cheapest scheme for max |dE/E| <= {tolerance:.0e}: {scheme} with dt = {dt:.2e} ({elapsed * 1e3:.1f} ms)")
+        else:
+            print(f"No scheme reached max |dE/E| <= {tolerance:.0e} in this sweep")
 # --- END OF FILE integrator.py ---
\ No newline at end of file
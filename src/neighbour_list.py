@@ -0,0 +1,162 @@
+# src/neighbour_list.py
+#--- START OF FILE neighbour_list.py ---
+# src/neighbour_list.py
+import numpy as np
+from scipy.spatial import cKDTree  # Efficient k-d tree implementation
+
+
+class NeighbourList:
+    """
+    Verlet neighbour list with a skin radius, reused across force evaluations.
+    Every unordered pair closer than cutoff + skin is stored once (i < j) in CSR form: the
+    neighbours of particle i are neighbours[offsets[i]:offsets[i + 1]], sorted. The list stays
+    valid until some particle has moved more than skin / 2 since the last build, because no
+    pair can have closed the gap from cutoff + skin to cutoff before then.
+    Attributes:
+        cutoff (float): Interaction radius the list must cover (kpc).
+        skin (float): Extra radius kept in the list (kpc).
+        offsets (np.array): (N+1,) CSR row offsets.
+        neighbours (np.array): (P,) CSR column indices (j > i).
+        num_builds (int): Number of k-d tree rebuilds so far.
+        num_updates (int): Number of update calls so far.
+    """
+    def __init__(self, cutoff, skin):
+        """
+        Initializes an empty NeighbourList.
+        Args:
+            cutoff (float): Interaction radius (kpc).
+            skin (float): Skin radius added to the cutoff (kpc).
+        """
+        self.cutoff = float(cutoff)
+        self.skin = float(skin)
+        self.offsets = None
+        self.neighbours = None
+        self.reference_positions = None
+        self.num_builds = 0
+        self.num_updates = 0
+        self._reverse = None  # (offsets, neighbours) of the transposed list, built on first use
+        self._reverse_source = None
+
+    @property
+    def list_radius(self):
+        return self.cutoff + self.skin
+
+    @property
+    def num_pairs(self):
+        return 0 if self.neighbours is None else len(self.neighbours)
+
+    def invalidate(self):
+        """Forces a rebuild on the next update (e.g. after particles are reordered or replaced)."""
+        self.reference_positions = None
+
+    def needs_rebuild(self, positions):
+        """
+        Checks whether any particle has moved more than skin / 2 since the last build.
+        Args:
+            positions (np.array): (N,3) current positions.
+        Returns:
+            bool: True if the list must be rebuilt.
+        """
+        if self.reference_positions is None or self.reference_positions.shape != positions.shape:
+            return True
+        displacement = positions - self.reference_positions
+        max_displacement_sq = np.max(np.einsum('ij,ij->i', displacement, displacement), initial=0.0)
+        return max_displacement_sq > (0.5 * self.skin) ** 2
+
+    def rebuild(self, positions):
+        """
+        Rebuilds the list from scratch with one k-d tree query.
+        Args:
+            positions (np.array): (N,3) current positions.
+        """
+        num_particles = len(positions)
+        if num_particles > 1:
+            pairs = cKDTree(positions).query_pairs(self.list_radius, output_type='ndarray')
+        else:
+            pairs = np.zeros((0, 2), dtype=np.intp)
+        order = np.lexsort((pairs[:, 1], pairs[:, 0]))  # Sort by i, then j
+        pairs = pairs[order]
+        index_dtype = np.int32 if num_particles < np.iinfo(np.int32).max else np.int64
+        self.offsets = np.zeros(num_particles + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs[:, 0], minlength=num_particles), out=self.offsets[1:])
+        self.neighbours = pairs[:, 1].astype(index_dtype)
+        self.reference_positions = positions.copy()
+        self.num_builds += 1
+
+    def update(self, positions):
+        """
+        Rebuilds the list only if it is no longer valid for the given positions.
+        Args:
+            positions (np.array): (N,3) current positions.
+        Returns:
+            bool: True if the list was rebuilt.
+        """
+        self.num_updates += 1
+        if self.needs_rebuild(positions):
+            self.rebuild(positions)
+            return True
+        return False
+
+    def pairs(self, row_start=0, row_stop=None):
+        """
+        Expands the CSR list (or the rows row_start:row_stop of it) into pair index arrays.
+        Args:
+            row_start (int): First row to expand.
+            row_stop (int): One past the last row to expand; None expands to the end.
+        Returns:
+            tuple: (i, j) arrays with i < j for every listed pair.
+        """
+        row_stop = len(self.offsets) - 1 if row_stop is None else row_stop
+        counts = np.diff(self.offsets[row_start:row_stop + 1])
+        i = np.repeat(np.arange(row_start, row_stop), counts)
+        return i, self.neighbours[self.offsets[row_start]:self.offsets[row_stop]].astype(np.intp)
+
+    def reverse(self):
+        """
+        Returns the transposed list in CSR form: the particles i < j that list j as a neighbour
+        are reverse_neighbours[reverse_offsets[j]:reverse_offsets[j + 1]], sorted. Built once
+        per list (O(pairs)) on first use.
+        Returns:
+            tuple: (reverse_offsets, reverse_neighbours).
+        """
+        if self._reverse_source is not self.neighbours:
+            i, j = self.pairs()
+            order = np.argsort(j, kind='stable')  # Stable, so each row keeps i ascending
+            reverse_offsets = np.zeros(len(self.offsets), dtype=np.int64)
+            np.cumsum(np.bincount(j, minlength=len(self.offsets) - 1), out=reverse_offsets[1:])
+            self._reverse = (reverse_offsets, i[order].astype(self.neighbours.dtype))
+            self._reverse_source = self.neighbours
+        return self._reverse
+
+    def target_row_counts(self, targets):
+        """Returns the number of listed pairs at each target (both directions), for memory budgets."""
+        reverse_offsets, _ = self.reverse()
+        return (self.offsets[targets + 1] - self.offsets[targets]) + (reverse_offsets[targets + 1] - reverse_offsets[targets])
+
+    def target_pairs(self, targets, is_target):
+        """
+        Expands only the pairs with a target at one end, walking the target rows of the list
+        and of its transpose, so the work is proportional to the targets' neighbours rather
+        than to the whole list. Pairs with two targets are listed once.
+        Args:
+            targets (np.array): Sorted target indices.
+            is_target (np.array): (N,) boolean target mask.
+        Returns:
+            tuple: (i, j) arrays with i < j.
+        """
+        reverse_offsets, reverse_neighbours = self.reverse()
+        lower, upper_target = _expand_rows(reverse_offsets, reverse_neighbours, targets)
+        keep = ~is_target[lower]  # Pairs of two targets come from the forward rows
+        upper, lower_target = _expand_rows(self.offsets, self.neighbours, targets)
+        return np.concatenate([lower[keep], lower_target]), np.concatenate([upper_target[keep], upper])
+
+
+def _expand_rows(offsets, columns, rows):
+    """Expands selected CSR rows into (column, row) index arrays, rows in the given order."""
+    starts = offsets[rows]
+    counts = offsets[rows + 1] - starts
+    total = int(counts.sum())
+    row_ids = np.repeat(rows, counts).astype(np.intp)
+    first = np.repeat(starts - (np.cumsum(counts) - counts), counts)  # Per-row shift into columns
+    return columns[first + np.arange(total)].astype(np.intp), row_ids
+# --- END OF FILE neighbour_list.py ---
@@ -0,0 +1,478 @@
+# src/pair_tiles.py
+#--- START OF FILE pair_tiles.py ---
+# src/pair_tiles.py
+import numpy as np
+import numba
+from numba import njit, prange
+from scipy.spatial import cKDTree  # Efficient k-d tree implementation
+from src.galactic_potential import G  # Gravitational Constant
+
+# Tiled cutoff pair evaluation. Particles are sorted into k-d tree leaf order and every leaf
+# (at most tile_size particles) is a tile; every pair of tiles whose bounding boxes come
+# closer than the cutoff is evaluated in full inside a compiled kernel. No per-pair index
+# arrays are ever built. The tile-pair list itself still grows as (N_cusp / tile_size)^2 in a
+# dense cusp, so the dual-tree walk is paused and resumed to hand it to the kernel in batches
+# within the pair memory budget; together with the per-thread force buffers, whose number the
+# same budget caps (buffer_chunks), the extra memory is O(N) plus twice the budget at most.
+DEFAULT_TILE_SIZE = 32
+BYTES_PER_PAIR = 32  # (i, j) int64 indices plus their expanded copies, for pair-list memory budgets
+BYTES_PER_TILE_PAIR = 32  # (a, b) int64 tile indices plus one filtered copy (target or black-hole tile pairs)
+BYTES_PER_BUFFER_ROW = 24  # One float64 (x, y, z) row of a per-thread force buffer
+
+
+def buffer_chunks(num_particles, num_work_items, min_work_items, memory_limit_mb):
+    """
+    Chooses how many private (N,3) float64 force buffers a scatter kernel uses: one per thread
+    once there are at least min_work_items pairs (or tile pairs) to share out, but no more than
+    fit into memory_limit_mb, so the buffers never cost more than the budget (or one buffer).
+    Args:
+        num_particles (int): Rows per buffer.
+        num_work_items (int): Pairs or tile pairs the kernel splits between the chunks.
+        min_work_items (int): Work below which a single buffer is used.
+        memory_limit_mb (float): Budget for the buffers (MB).
+    Returns:
+        int: Number of chunks, at least 1.
+    """
+    if num_work_items < min_work_items:
+        return 1
+    affordable = int(memory_limit_mb * 2 ** 20 / (BYTES_PER_BUFFER_ROW * max(num_particles, 1)))
+    return max(1, min(numba.get_num_threads(), affordable))
+
+
+class PairTiles:
+    """
+    Spatial tiles of a particle set for cutoff pair evaluation.
+    The tiles are the leaves of a k-d tree built with leafsize=tile_size; their interaction
+    list comes from a dual-tree walk over the tree's (tight) node bounding boxes, produced in
+    bounded batches by tile_pair_batches.
+    Attributes:
+        order (np.array): (N,) particle indices in tile order (k-d tree leaf order).
+        tile_starts (np.array): (M+1,) offsets of each tile into order.
+    """
+    def __init__(self, positions, cutoff, tile_size=DEFAULT_TILE_SIZE):
+        """
+        Builds the tiles and the node bounding boxes of their interaction walk.
+        Args:
+            positions (np.array): (N,3) particle positions (kpc).
+            cutoff (float): Interaction radius (kpc).
+            tile_size (int): Maximum number of particles per tile.
+        """
+        tree = cKDTree(positions, leafsize=tile_size)  # Leaves are contiguous runs of tree.indices
+        self.order = np.ascontiguousarray(tree.indices, dtype=np.int64)
+        node_ranges, children = _tree_nodes(tree)
+        is_leaf = children[:, 0] < 0
+        leaf_nodes = np.flatnonzero(is_leaf)
+        leaf_nodes = leaf_nodes[np.argsort(node_ranges[leaf_nodes, 0])]
+        self.tile_starts = np.append(node_ranges[leaf_nodes, 0], tree.n).astype(np.int64)
+        node_tile = np.full(len(children), -1, dtype=np.int64)
+        node_tile[leaf_nodes] = np.arange(len(leaf_nodes))
+
+        sorted_positions = positions[self.order]
+        node_lo = np.empty((len(children), 3))
+        node_hi = np.empty((len(children), 3))
+        node_lo[leaf_nodes] = np.minimum.reduceat(sorted_positions, self.tile_starts[:-1], axis=0)
+        node_hi[leaf_nodes] = np.maximum.reduceat(sorted_positions, self.tile_starts[:-1], axis=0)
+        for node in np.flatnonzero(~is_leaf)[::-1]:  # Children come after their parent in pre-order
+            lesser, greater = children[node]
+            node_lo[node] = np.minimum(node_lo[lesser], node_lo[greater])
+            node_hi[node] = np.maximum(node_hi[lesser], node_hi[greater])
+        self._node_lo = node_lo
+        self._node_hi = node_hi
+        self._children = children
+        self._node_tile = node_tile
+        self._cutoff_sq = float(cutoff) ** 2
+
+    @property
+    def num_tiles(self):
+        return len(self.tile_starts) - 1
+
+    def tiles_containing(self, mask):
+        """
+        Args:
+            mask (np.array): (N,) boolean particle mask.
+        Returns:
+            np.array: (M,) boolean mask of the tiles holding at least one flagged particle.
+        """
+        flagged = np.add.reduceat(mask[self.order].astype(np.int64), self.tile_starts[:-1])
+        return flagged > 0
+
+    def tile_pair_batches(self, memory_limit_mb=256.0):
+        """
+        Yields the interaction list, (K,2) tile index pairs (a <= b) whose boxes are closer than
+        the cutoff, in batches of at most memory_limit_mb. The dual-tree walk resumes for each
+        batch and every batch is a view of one reused buffer, so the whole list never exists at
+        once; a batch is only valid until the next one is requested.
+        Args:
+            memory_limit_mb (float): Budget for one batch and one filtered copy of it (MB).
+        """
+        max_pairs = max(1, int(memory_limit_mb * 2 ** 20 / BYTES_PER_TILE_PAIR))
+        pairs = np.empty((min(max_pairs, max(16, 4 * self.num_tiles)), 2), dtype=np.int64)
+        stack = np.zeros((256, 2), dtype=np.int64)  # The walk starts with the root against itself
+        depth = 1
+        while depth > 0:
+            pairs, num_pairs, stack, depth = _dual_tree_join(self._node_lo, self._node_hi, self._children,
+                                                             self._node_tile, self._cutoff_sq, stack, depth, pairs,
+                                                             max_pairs)
+            if num_pairs:
+                yield pairs[:num_pairs]
+
+
+def _tree_nodes(tree):
+    """
+    Flattens a cKDTree into pre-order node arrays.
+    Returns:
+        tuple: ((K,2) [start, end) ranges into tree.indices, (K,2) child node ids, -1 for leaves).
+    """
+    ranges = []
+    children = []
+    stack = [(tree.tree, -1, 0)]
+    while stack:
+        node, parent, side = stack.pop()
+        node_id = len(ranges)
+        ranges.append((node.start_idx, node.end_idx))
+        children.append([-1, -1])
+        if parent >= 0:
+            children[parent][side] = node_id
+        if node.lesser is not None:
+            stack.append((node.greater, node_id, 1))
+            stack.append((node.lesser, node_id, 0))
+    return np.array(ranges, dtype=np.int64), np.array(children, dtype=np.int64)
+
+
+@njit(cache=True)
+def _box_gap_sq(lo, hi, a, b):
+    """Squared distance between the bounding boxes of nodes a and b."""
+    gap_sq = 0.0
+    for axis in range(3):
+        gap = max(lo[a, axis] - hi[b, axis], lo[b, axis] - hi[a, axis], 0.0)
+        gap_sq += gap * gap
+    return gap_sq
+
+
+@njit(cache=True)
+def _dual_tree_join(node_lo, node_hi, children, node_tile, cutoff_sq, stack, depth, pairs, max_pairs):
+    """
+    Walks the tree against itself and writes the leaf pairs (a <= b) closer than the cutoff
+    into pairs (grown as needed, up to max_pairs rows), stopping once it is full. Returns
+    (pairs, num_pairs, stack, depth): calling again with the returned pairs, stack and depth
+    resumes the walk and overwrites the pairs, and depth 0 means the walk is complete.
+    """
+    num_pairs = 0
+    while depth > 0 and num_pairs < max_pairs:
+        depth -= 1
+        a = stack[depth, 0]
+        b = stack[depth, 1]
+        if a != b and _box_gap_sq(node_lo, node_hi, a, b) >= cutoff_sq:
+            continue
+        leaf_a = children[a, 0] < 0
+        leaf_b = children[b, 0] < 0
+        if leaf_a and leaf_b:
+            if num_pairs == pairs.shape[0]:
+                grown = np.empty((min(2 * pairs.shape[0], max_pairs), 2), dtype=np.int64)
+                grown[:num_pairs] = pairs[:num_pairs]
+                pairs = grown
+            pairs[num_pairs, 0] = min(node_tile[a], node_tile[b])
+            pairs[num_pairs, 1] = max(node_tile[a], node_tile[b])
+            num_pairs += 1
+            continue
+        if depth + 3 > stack.shape[0]:
+            grown_stack = np.empty((2 * stack.shape[0], 2), dtype=np.int64)
+            grown_stack[:depth] = stack[:depth]
+            stack = grown_stack
+        if a == b:  # Self pair: both children with themselves and with each other
+            lesser = children[a, 0]
+            greater = children[a, 1]
+            stack[depth, 0] = lesser
+            stack[depth, 1] = lesser
+            stack[depth + 1, 0] = lesser
+            stack[depth + 1, 1] = greater
+            stack[depth + 2, 0] = greater
+            stack[depth + 2, 1] = greater
+            depth += 3
+            continue
+        extent_a = 0.0
+        extent_b = 0.0
+        for axis in range(3):
+            extent_a = max(extent_a, node_hi[a, axis] - node_lo[a, axis])
+            extent_b = max(extent_b, node_hi[b, axis] - node_lo[b, axis])
+        if leaf_b or (not leaf_a and extent_a >= extent_b):  # Split the larger internal node
+            stack[depth, 0] = children[a, 0]
+            stack[depth, 1] = b
+            stack[depth + 1, 0] = children[a, 1]
+            stack[depth + 1, 1] = b
+        else:
+            stack[depth, 0] = a
+            stack[depth, 1] = children[b, 0]
+            stack[depth + 1, 0] = a
+            stack[depth + 1, 1] = children[b, 1]
+        depth += 2
+    return pairs, num_pairs, stack, depth
+
+
+@njit(parallel=True, error_model='numpy', cache=True)
+def _tile_pair_kernel(positions, masses, flags, tile_starts, tile_pairs, cutoff, grav_const, mode, num_chunks):
+    """
+    Evaluates every particle pair of the listed tile pairs (positions are in tile order).
+    mode 0 evaluates all pairs, mode 1 skips pairs with a flagged end and mode 2 evaluates only
+    those. Tile pairs are split into num_chunks chunks with private float64 force buffers.
+    """
+    num_particles = positions.shape[0]
+    num_tile_pairs = tile_pairs.shape[0]
+    buffers = np.zeros((num_chunks, num_particles, 3))
+    chunk_size = (num_tile_pairs + num_chunks - 1) // num_chunks
+    for c in prange(num_chunks):
+        for k in range(c * chunk_size, min((c + 1) * chunk_size, num_tile_pairs)):
+            tile_a = tile_pairs[k, 0]
+            tile_b = tile_pairs[k, 1]
+            for a in range(tile_starts[tile_a], tile_starts[tile_a + 1]):
+                start_b = a + 1 if tile_a == tile_b else tile_starts[tile_b]
+                for b in range(start_b, tile_starts[tile_b + 1]):
+                    if mode != 0 and (flags[a] or flags[b]) != (mode == 2):
+                        continue
+                    rx = positions[b, 0] - positions[a, 0]
+                    ry = positions[b, 1] - positions[a, 1]
+                    rz = positions[b, 2] - positions[a, 2]
+                    r_sq = rx * rx + ry * ry + rz * rz
+                    r_mag = np.sqrt(r_sq)
+                    if not 0.0 < r_mag < cutoff:
+                        continue
+                    scale = grav_const * masses[a] * masses[b] / (r_sq * r_mag)
+                    buffers[c, a, 0] += scale * rx
+                    buffers[c, a, 1] += scale * ry
+                    buffers[c, a, 2] += scale * rz
+                    buffers[c, b, 0] -= scale * rx
+                    buffers[c, b, 1] -= scale * ry
+                    buffers[c, b, 2] -= scale * rz
+    forces = np.zeros((num_particles, 3))
+    for k in prange(num_particles):  # Reduce the per-thread buffers
+        for c in range(num_chunks):
+            forces[k, 0] += buffers[c, k, 0]
+            forces[k, 1] += buffers[c, k, 1]
+            forces[k, 2] += buffers[c, k, 2]
+    return forces
+
+
+def tiled_pair_forces(positions, masses, cutoff, tile_size=DEFAULT_TILE_SIZE, precision_positions=None,
+                      precision_masses=None, is_black_hole=None, targets=None, memory_limit_mb=256.0):
+    """
+    Calculates cutoff pair forces tile by tile, with the same pair rule as pair_gravity_forces
+    (0 < r < cutoff, unsoftened) but without materialising the pair list. With targets, only
+    tile pairs that hold a target are evaluated, so only the target rows are complete.
+    Args:
+        positions (np.array): (N,3) float64 particle positions (kpc).
+        masses (np.array): (N,) float64 particle masses.
+        cutoff (float): Pairs must be strictly closer than this (kpc).
+        tile_size (int): Maximum number of particles per tile.
+        precision_positions (np.array): Optional float32 copy of the positions for the star-star pairs.
+        precision_masses (np.array): Optional float32 copy of the masses for the star-star pairs.
+        is_black_hole (np.array): (N,) mask of particles whose pairs stay in float64 (with the float32 copies).
+        targets (np.array): Indices of the particles whose forces are needed; None means all of them.
+        memory_limit_mb (float): Budget for the per-thread force buffers and, separately, for each
+            batch of tile pairs (MB).
+    Returns:
+        np.array: (N,3) accumulated pair forces.
+    """
+    num_particles = len(positions)
+    if num_particles < 2:
+        return np.zeros((num_particles, 3))
+    tiles = PairTiles(positions, cutoff, tile_size)
+    order = tiles.order
+    target_tiles = None
+    if targets is not None:
+        is_target = np.zeros(num_particles, dtype=bool)
+        is_target[targets] = True
+        target_tiles = tiles.tiles_containing(is_target)
+    bh_tiles = None
+    if precision_positions is None:
+        pair_positions, pair_masses = positions[order], masses[order]
+        flags = np.zeros(num_particles, dtype=np.bool_)
+        real = np.float64
+        mode = 0
+    else:
+        is_black_hole = np.zeros(num_particles, dtype=bool) if is_black_hole is None else is_black_hole
+        pair_positions, pair_masses = precision_positions[order], precision_masses[order]
+        flags = np.ascontiguousarray(is_black_hole[order])
+        real = precision_positions.dtype.type
+        mode = 0
+        if flags.any():  # Pairs with a black hole are skipped here and redone in float64
+            mode = 1
+            bh_tiles = tiles.tiles_containing(is_black_hole)
+            exact_positions, exact_masses = positions[order], masses[order]
+
+    sorted_forces = np.zeros((num_particles, 3))
+    for tile_pairs in tiles.tile_pair_batches(memory_limit_mb):
+        if target_tiles is not None:  # Skip tile pairs without a target at either end
+            tile_pairs = np.ascontiguousarray(tile_pairs[target_tiles[tile_pairs[:, 0]] | target_tiles[tile_pairs[:, 1]]])
+        num_chunks = buffer_chunks(num_particles, len(tile_pairs), 64, memory_limit_mb)
+        sorted_forces += _tile_pair_kernel(pair_positions, pair_masses, flags, tiles.tile_starts, tile_pairs,
+                                           real(cutoff), real(G), mode, num_chunks)
+        if bh_tiles is not None:  # Pairs with a black hole, in float64, only on tile pairs that hold one
+            bh_pairs = np.ascontiguousarray(tile_pairs[bh_tiles[tile_pairs[:, 0]] | bh_tiles[tile_pairs[:, 1]]])
+            sorted_forces += _tile_pair_kernel(exact_positions, exact_masses, flags, tiles.tile_starts, bh_pairs,
+                                               float(cutoff), G, 2, 1)
+    forces = np.empty_like(sorted_forces)
+    forces[order] = sorted_forces
+    return forces
+
+
+@njit(parallel=True, error_model='numpy', cache=True)
+def _tile_pair_jerk_kernel(positions, velocities, masses, tile_starts, tile_pairs, cutoff, grav_const, num_chunks):
+    """
+    Force time derivatives of every particle pair of the listed tile pairs (arrays in tile
+    order), with the pair rule and buffer layout of _tile_pair_kernel.
+    """
+    num_particles = positions.shape[0]
+    num_tile_pairs = tile_pairs.shape[0]
+    buffers = np.zeros((num_chunks, num_particles, 3))
+    chunk_size = (num_tile_pairs + num_chunks - 1) // num_chunks
+    for c in prange(num_chunks):
+        for k in range(c * chunk_size, min((c + 1) * chunk_size, num_tile_pairs)):
+            tile_a = tile_pairs[k, 0]
+            tile_b = tile_pairs[k, 1]
+            for a in range(tile_starts[tile_a], tile_starts[tile_a + 1]):
+                start_b = a + 1 if tile_a == tile_b else tile_starts[tile_b]
+                for b in range(start_b, tile_starts[tile_b + 1]):
+                    rx = positions[b, 0] - positions[a, 0]
+                    ry = positions[b, 1] - positions[a, 1]
+                    rz = positions[b, 2] - positions[a, 2]
+                    r_sq = rx * rx + ry * ry + rz * rz
+                    r_mag = np.sqrt(r_sq)
+                    if not 0.0 < r_mag < cutoff:
+                        continue
+                    vx = velocities[b, 0] - velocities[a, 0]
+                    vy = velocities[b, 1] - velocities[a, 1]
+                    vz = velocities[b, 2] - velocities[a, 2]
+                    alpha = 3.0 * (rx * vx + ry * vy + rz * vz) / r_sq
+                    scale = grav_const * masses[a] * masses[b] / (r_sq * r_mag)
+                    jx = scale * (vx - alpha * rx)
+                    jy = scale * (vy - alpha * ry)
+                    jz = scale * (vz - alpha * rz)
+                    buffers[c, a, 0] += jx
+                    buffers[c, a, 1] += jy
+                    buffers[c, a, 2] += jz
+                    buffers[c, b, 0] -= jx
+                    buffers[c, b, 1] -= jy
+                    buffers[c, b, 2] -= jz
+    jerks = np.zeros((num_particles, 3))
+    for k in prange(num_particles):  # Reduce the per-thread buffers
+        for c in range(num_chunks):
+            jerks[k, 0] += buffers[c, k, 0]
+            jerks[k, 1] += buffers[c, k, 1]
+            jerks[k, 2] += buffers[c, k, 2]
+    return jerks
+
+
+def tiled_pair_jerks(positions, velocities, masses, cutoff, tile_size=DEFAULT_TILE_SIZE, memory_limit_mb=256.0):
+    """
+    Calculates the time derivatives of the cutoff pair forces of tiled_pair_forces (float64),
+    tile by tile, so the Hermite jerks need no pair list either.
+    Args:
+        positions (np.array): (N,3) particle positions (kpc).
+        velocities (np.array): (N,3) particle velocities.
+        masses (np.array): (N,) particle masses.
+        cutoff (float): Pairs must be strictly closer than this (kpc).
+        tile_size (int): Maximum number of particles per tile.
+        memory_limit_mb (float): Budget for the per-thread buffers and, separately, for each batch
+            of tile pairs (MB).
+    Returns:
+        np.array: (N,3) accumulated force time derivatives.
+    """
+    num_particles = len(positions)
+    if num_particles < 2:
+        return np.zeros((num_particles, 3))
+    tiles = PairTiles(positions, cutoff, tile_size)
+    order = tiles.order
+    sorted_positions, sorted_velocities, sorted_masses = positions[order], velocities[order], masses[order]
+    sorted_jerks = np.zeros((num_particles, 3))
+    for tile_pairs in tiles.tile_pair_batches(memory_limit_mb):
+        num_chunks = buffer_chunks(num_particles, len(tile_pairs), 64, memory_limit_mb)
+        sorted_jerks += _tile_pair_jerk_kernel(sorted_positions, sorted_velocities, sorted_masses, tiles.tile_starts,
+                                               tile_pairs, float(cutoff), G, num_chunks)
+    jerks = np.empty_like(sorted_jerks)
+    jerks[order] = sorted_jerks
+    return jerks
+
+
+def pair_chunks(offsets, memory_limit_mb):
+    """
+    Splits the rows of a CSR pair list into consecutive row ranges whose expanded (i, j)
+    index arrays stay within a memory budget.
+    Args:
+        offsets (np.array): (N+1,) CSR row offsets.
+        memory_limit_mb (float): Budget for the expanded pair indices of one chunk (MB).
+    Returns:
+        list: (row_start, row_stop) tuples covering all rows.
+    """
+    max_pairs = max(1, int(memory_limit_mb * 2 ** 20 / BYTES_PER_PAIR))
+    num_rows = len(offsets) - 1
+    chunks = []
+    row = 0
+    while row < num_rows:
+        stop = int(np.searchsorted(offsets, offsets[row] + max_pairs, side='right')) - 1
+        stop = min(max(stop, row + 1), num_rows)  # A single over-budget row still forms its own chunk
+        chunks.append((row, stop))
+        row = stop
+    return chunks
+
+
+if __name__ == '__main__':
+    import time
+    from src.forces import pair_gravity_forces
+
+    def resident_kb(field):
+        """Reads VmRSS (current) or VmHWM (peak since the last reset) of this process in kB (Linux)."""
+        with open('/proc/self/status') as status:
+            return next(int(line.split()[1]) for line in status if line.startswith(field + ':'))
+
+    def measure(evaluate):
+        """Runs evaluate() and returns (result, seconds, peak resident memory above the starting level in MB).
+        Resident memory covers Numba's own allocations (per-thread buffers, kernel temporaries) as well."""
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')  # Reset the peak to the current resident size
+        baseline = resident_kb('VmRSS')
+        start = time.perf_counter()
+        result = evaluate()
+        elapsed = time.perf_counter() - start
+        return result, elapsed, (resident_kb('VmHWM') - baseline) / 1024
+
+    rng = np.random.default_rng(42)
+    num_particles = 20000
+    cusp = rng.normal(scale=0.05, size=(num_particles // 4, 3))  # A quarter of the stars packed into a cusp
+    disk = rng.normal(scale=5.0, size=(num_particles - len(cusp), 3))
+    positions_example = np.vstack((cusp, disk))
+    masses_example = rng.uniform(0.5, 2.0, size=num_particles)
+    cutoff_example = 1.0
+
+    tiled_pair_forces(positions_example[:100], masses_example[:100], cutoff_example)  # Compile
+    pair_gravity_forces(positions_example[:2], masses_example[:2], np.array([0]), np.array([1]), cutoff_example)
+    for label, evaluate in (
+            ("query_pairs", lambda: pair_gravity_forces(
+                positions_example, masses_example,
+                *cKDTree(positions_example).query_pairs(cutoff_example, output_type='ndarray').T, cutoff_example)),
+            ("tiled", lambda: tiled_pair_forces(positions_example, masses_example, cutoff_example))):
+        result, elapsed, peak_mb = measure(evaluate)
+        if label == "query_pairs":
+            reference = result
+        print(f"{label}: {elapsed * 1e3:.0f} ms, peak extra resident memory {peak_mb:.1f} MB, "
+              f"max deviation {np.abs(result - reference).max() / np.abs(reference).max():.1e}")
+
+    # --- Dense cusps: the tile-pair list outgrows the budget and is streamed in batches ---
+    dense_cusp = rng.normal(scale=0.05, size=(200000, 3))
+    dense_tiles = PairTiles(dense_cusp, cutoff_example)
+    num_tile_pairs, _, peak_mb = measure(lambda: sum(len(batch) for batch in dense_tiles.tile_pair_batches()))
+    print(f"Interaction walk of a {len(dense_cusp)}-particle cusp: {num_tile_pairs} tile pairs "
+          f"({num_tile_pairs * 16 / 2 ** 20:.0f} MB as one list), peak extra resident memory {peak_mb:.0f} MB "
+          f"with the default 256 MB budget")
+    small_cusp = dense_cusp[:30000]
+    small_masses = rng.uniform(0.5, 2.0, size=len(small_cusp))
+    reference = tiled_pair_forces(small_cusp, small_masses, cutoff_example)
+    for budget_mb in (256.0, 2.0):
+        # Resident memory is too coarse at this size (freed blocks are reused), so the batches are counted instead
+        batch_mb = [len(batch) * 16 / 2 ** 20 for batch in PairTiles(small_cusp, cutoff_example).tile_pair_batches(budget_mb)]
+        start = time.perf_counter()
+        result = tiled_pair_forces(small_cusp, small_masses, cutoff_example, memory_limit_mb=budget_mb)
+        elapsed = time.perf_counter() - start
+        print(f"Forces in a {len(small_cusp)}-particle cusp, budget {budget_mb:5.1f} MB: {elapsed * 1e3:.0f} ms, "
+              f"{len(batch_mb)} tile-pair batch(es) of at most {max(batch_mb):.2f} MB ({sum(batch_mb):.1f} MB in all), "
+              f"max deviation {np.abs(result - reference).max() / np.abs(reference).max():.1e}")
+# --- END OF FILE pair_tiles.py ---
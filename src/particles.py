@@ -2,18 +2,22 @@
 #--- START OF FILE particles.py ---
 # src/particles.py
 import numpy as np
-from src.ga_utils import to_ga_point, to_ga_vector # Import to_ga_point, to_ga_vector
+from src.ga_utils import to_ga_point, to_ga_vector, from_ga_point, from_ga_vector # Import GA conversions
 import kingdon as kg # Import kingdon
 
 class AbstractParticle:
     """
     Abstract base class for particles.
+    The GA representations are lazy views: they are built on first access and cached together
+    with the three Cartesian components they were built from, and rebuilt on access whenever
+    those differ, so assignments (p.velocity += dv) and element writes (p.position[0] = x) are
+    both picked up.
     Attributes:
         position (np.array): Cartesian position (3D).
         velocity (np.array): Cartesian velocity (3D).
         mass (float): Mass of the particle.
-        position_ga (kingdon.MultiVector): Position in GA representation.
-        velocity_ga (kingdon.MultiVector): Velocity in GA representation.
+        position_ga (kingdon.MultiVector): Position in GA representation (cached view of position).
+        velocity_ga (kingdon.MultiVector): Velocity in GA representation (cached view of velocity).
     """
     def __init__(self, position, velocity, mass):
         """
@@ -23,11 +27,53 @@ class AbstractParticle:
             velocity (np.array): Initial Cartesian velocity.
             mass (float): Mass of the particle.
         """
+        self._position_ga = None
+        self._position_ga_key = None
+        self._velocity_ga = None
+        self._velocity_ga_key = None
         self.position = np.array(position, dtype=np.float64)
         self.velocity = np.array(velocity, dtype=np.float64)
         self.mass = float(mass)
-        self.position_ga = to_ga_point(self.position) # Use kingdon version
-        self.velocity_ga = to_ga_vector(self.velocity) # Use kingdon version
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, value):
+        self._position = np.asarray(value, dtype=np.float64)
+
+    @property
+    def velocity(self):
+        return self._velocity
+
+    @velocity.setter
+    def velocity(self, value):
+        self._velocity = np.asarray(value, dtype=np.float64)
+
+    @property
+    def position_ga(self):
+        key = self._position.tolist()
+        if key != self._position_ga_key:  # Rebuild only after position changed
+            self._position_ga = to_ga_point(self._position)
+            self._position_ga_key = key
+        return self._position_ga
+
+    @position_ga.setter
+    def position_ga(self, value):
+        self.position = np.array(from_ga_point(value), dtype=np.float64)
+
+    @property
+    def velocity_ga(self):
+        key = self._velocity.tolist()
+        if key != self._velocity_ga_key:  # Rebuild only after velocity changed
+            self._velocity_ga = to_ga_vector(self._velocity)
+            self._velocity_ga_key = key
+        return self._velocity_ga
+
+    @velocity_ga.setter
+    def velocity_ga(self, value):
+        self.velocity = np.array(from_ga_vector(value), dtype=np.float64)
 
 class Star(AbstractParticle):
     """Represents a star particle."""
@@ -36,4 +82,221 @@ class Star(AbstractParticle):
 class BlackHole(AbstractParticle):
     """Represents a black hole particle."""
     pass
+
+
+# Particle kinds stored in ParticleSet.kind
+KIND_STAR = 0
+KIND_BLACK_HOLE = 1
+
+
+class _ParticleView:
+    """
+    Mixin for a per-particle view into a ParticleSet row. position and velocity are (3,)
+    views of the set's arrays (writes go straight to the set); GA representations are built
+    on every access, since the set's arrays can change without going through the view.
+    """
+    __slots__ = ()
+
+    def __init__(self, particle_set, index):
+        object.__setattr__(self, "particle_set", particle_set)
+        object.__setattr__(self, "index", index)
+
+    @property
+    def id(self):
+        return int(self.particle_set.ids[self.index])
+
+    @property
+    def position(self):
+        return self.particle_set.positions[self.index]
+
+    @position.setter
+    def position(self, value):
+        self.particle_set.positions[self.index] = value
+
+    @property
+    def velocity(self):
+        return self.particle_set.velocities[self.index]
+
+    @velocity.setter
+    def velocity(self, value):
+        self.particle_set.velocities[self.index] = value
+
+    @property
+    def mass(self):
+        return float(self.particle_set.masses[self.index])
+
+    @mass.setter
+    def mass(self, value):
+        self.particle_set.masses[self.index] = value
+
+    @property
+    def position_ga(self):
+        return to_ga_point(self.position)
+
+    @position_ga.setter
+    def position_ga(self, value):
+        self.position = from_ga_point(value)
+
+    @property
+    def velocity_ga(self):
+        return to_ga_vector(self.velocity)
+
+    @velocity_ga.setter
+    def velocity_ga(self, value):
+        self.velocity = from_ga_vector(value)
+
+
+class StarView(_ParticleView, Star):
+    """View of a star row in a ParticleSet (isinstance(view, Star) holds)."""
+    __slots__ = ("particle_set", "index")
+
+
+class BlackHoleView(_ParticleView, BlackHole):
+    """View of a black-hole row in a ParticleSet (isinstance(view, BlackHole) holds)."""
+    __slots__ = ("particle_set", "index")
+
+
+class ParticleSet:
+    """
+    Struct-of-arrays particle storage: one contiguous array per attribute instead of one
+    Star/BlackHole object per particle. Indexing with an integer (or iterating) yields cheap
+    StarView/BlackHoleView objects for code written against the particle classes.
+    Attributes:
+        positions (np.array): (N,3) Cartesian positions.
+        velocities (np.array): (N,3) Cartesian velocities.
+        masses (np.array): (N,) masses.
+        kind (np.array): (N,) uint8 particle kinds (KIND_STAR or KIND_BLACK_HOLE).
+        ids (np.array): (N,) int64 particle IDs, stable under reordering.
+    """
+    def __init__(self, positions, velocities, masses, kind=None, ids=None, copy=True):
+        """
+        Initializes a ParticleSet.
+        Args:
+            positions (np.array): (N,3) positions.
+            velocities (np.array): (N,3) velocities.
+            masses (np.array): (N,) masses.
+            kind (np.array): (N,) kinds; None makes every particle a star.
+            ids (np.array): (N,) IDs; None numbers the particles 0..N-1.
+            copy (bool): Copy the arrays; False wraps arrays that already have the right dtype
+                without copying, so writes go through to them (e.g. one member of an ensemble).
+        """
+        array = np.array if copy else np.asarray
+        self.positions = array(positions, dtype=np.float64).reshape(-1, 3)
+        num_particles = len(self.positions)
+        self.velocities = array(velocities, dtype=np.float64).reshape(num_particles, 3)
+        self.masses = array(masses, dtype=np.float64).reshape(num_particles)
+        self.kind = np.zeros(num_particles, dtype=np.uint8) if kind is None else array(kind, dtype=np.uint8).reshape(num_particles)
+        self.ids = np.arange(num_particles, dtype=np.int64) if ids is None else array(ids, dtype=np.int64).reshape(num_particles)
+
+    @classmethod
+    def from_particles(cls, particles):
+        """
+        Builds a ParticleSet from a list of Star/BlackHole objects (IDs follow list order).
+        Args:
+            particles (list): List of particle objects.
+        Returns:
+            ParticleSet: The particles as arrays.
+        """
+        if isinstance(particles, ParticleSet):
+            return particles.copy()
+        kind = [KIND_BLACK_HOLE if isinstance(p, BlackHole) else KIND_STAR for p in particles]
+        return cls(np.array([p.position for p in particles], dtype=np.float64).reshape(-1, 3),
+                   np.array([p.velocity for p in particles], dtype=np.float64).reshape(-1, 3),
+                   np.array([p.mass for p in particles], dtype=np.float64), kind)
+
+    def to_particles(self):
+        """
+        Returns independent Star/BlackHole objects for every row.
+        Returns:
+            list: List of particle objects, in set order.
+        """
+        return [(BlackHole if k == KIND_BLACK_HOLE else Star)(position, velocity, mass)
+                for position, velocity, mass, k in zip(self.positions, self.velocities, self.masses, self.kind)]
+
+    def copy(self):
+        return ParticleSet(self.positions, self.velocities, self.masses, self.kind, self.ids)
+
+    def permute(self, order):
+        """
+        Reorders all rows in place; row k afterwards holds the particle previously at row
+        order[k]. Views taken before the call refer to rows, not particles, so take new ones.
+        Args:
+            order (np.array): (N,) permutation of the row indices.
+        """
+        self.positions = self.positions[order]
+        self.velocities = self.velocities[order]
+        self.masses = self.masses[order]
+        self.kind = self.kind[order]
+        self.ids = self.ids[order]
+
+    @property
+    def is_black_hole(self):
+        return self.kind == KIND_BLACK_HOLE
+
+    @property
+    def is_star(self):
+        return self.kind == KIND_STAR
+
+    @property
+    def nbytes(self):
+        return self.positions.nbytes + self.velocities.nbytes + self.masses.nbytes + self.kind.nbytes + self.ids.nbytes
+
+    def __len__(self):
+        return len(self.masses)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            index = int(index) + (len(self) if index < 0 else 0)
+            if not 0 <= index < len(self):
+                raise IndexError("ParticleSet index out of range.")
+            return (BlackHoleView if self.kind[index] == KIND_BLACK_HOLE else StarView)(self, index)
+        return ParticleSet(self.positions[index], self.velocities[index], self.masses[index], self.kind[index], self.ids[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+if __name__ == '__main__':
+    import time
+    import tracemalloc
+
+    # --- Memory per particle at N = 10^6: objects against arrays ---
+    rng = np.random.default_rng(42)
+    num_particles = 10 ** 6
+    positions_example = rng.normal(size=(num_particles, 3))
+    velocities_example = rng.normal(size=(num_particles, 3))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    objects = [Star(position, velocity, 1.0) for position, velocity in zip(positions_example, velocities_example)]
+    object_time = time.perf_counter() - start
+    object_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    sample = objects[:10000]  # GA views as built eagerly before (measured on a sample and scaled)
+    tracemalloc.start()
+    for p in sample:
+        p.position_ga
+        p.velocity_ga
+    ga_bytes = tracemalloc.get_traced_memory()[0] * num_particles / len(sample)
+    tracemalloc.stop()
+    del objects, sample
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    particle_set = ParticleSet(positions_example, velocities_example, np.ones(num_particles))
+    set_time = time.perf_counter() - start
+    set_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"N = {num_particles}:")
+    print(f"  Star objects (list):             {object_bytes / num_particles:6.0f} B/particle, built in {object_time:.2f} s")
+    print(f"  Star objects + GA views:         {(object_bytes + ga_bytes) / num_particles:6.0f} B/particle")
+    print(f"  ParticleSet (arrays):            {set_bytes / num_particles:6.0f} B/particle "
+          f"(nbytes {particle_set.nbytes / num_particles:.0f}), built in {set_time * 1e3:.1f} ms")
+    view = particle_set[5]
+    view.velocity += 1.0
+    print(f"  View write-through: {np.allclose(particle_set.velocities[5], velocities_example[5] + 1.0)}, "
+          f"isinstance(view, Star): {isinstance(view, Star)}, id {view.id}")
 # --- END OF FILE particles.py ---
\ No newline at end of file
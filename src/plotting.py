@@ -6,7 +6,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import imageio
 import os
-from src.particles import Star, BlackHole
+from src.particles import Star, BlackHole, ParticleSet
 
 def configure_matplotlib():
     """Sets up matplotlib parameters for consistent plot style."""
@@ -196,12 +196,16 @@ def plot_max_bh_mass_evolution(diagnostics, output_dir="simulation_data", sim_pa
     plt.close(fig)
 
 def plot_particle_distribution(final_particles, output_dir="simulation_data", step=None):
-    """Generates 3D and 2D particle distribution plots."""
-    stars = [p for p in final_particles if isinstance(p, Star)]
-    bhs = [p for p in final_particles if isinstance(p, BlackHole)]
-
-    star_positions = np.array([p.position for p in stars]) if stars else np.empty((0,3))
-    bh_positions = np.array([p.position for p in bhs]) if bhs else np.empty((0,3))
+    """Generates 3D and 2D particle distribution plots (final_particles: list of particles or a ParticleSet)."""
+    if isinstance(final_particles, ParticleSet):
+        star_positions = final_particles.positions[final_particles.is_star]
+        bh_positions = final_particles.positions[final_particles.is_black_hole]
+    else:
+        stars = [p for p in final_particles if isinstance(p, Star)]
+        bhs = [p for p in final_particles if isinstance(p, BlackHole)]
+
+        star_positions = np.array([p.position for p in stars]) if stars else np.empty((0,3))
+        bh_positions = np.array([p.position for p in bhs]) if bhs else np.empty((0,3))
 
     fig_3d = plt.figure()
     ax_3d = fig_3d.add_subplot(projection='3d')
@@ -0,0 +1,347 @@
+# src/scf.py
+#--- START OF FILE scf.py ---
+# src/scf.py
+import math
+import numpy as np
+import numba
+from numba import njit, prange
+from src.galactic_potential import G  # Gravitational Constant
+from src.direct_summation import sampled_force_error
+
+# Self-consistent field (SCF) expansion of Hernquist & Ostriker (1992). In units of the scale
+# length a (s = r / a, xi = (s - 1) / (s + 1)), the potential-density pairs are
+#   Phi_nl(s) = -s^l / (1 + s)^(2l+1) C_n^(2l+3/2)(xi),
+#   rho_nl(s) = K_nl / (2 pi) s^l / (s (1 + s)^(2l+3)) C_n^(2l+3/2)(xi),
+# with Gegenbauer polynomials C_n^alpha; Phi_00 is the Hernquist sphere. With real spherical
+# harmonics the field of N particles is
+#   Phi = (G / a) sum_nlm Phi_nl(s) P_lm(cos theta) (S_nlm cos(m phi) + T_nlm sin(m phi)),
+#   S_nlm = (2 - delta_m0) N_lm^2 / I_nl sum_k m_k Phi_nl(s_k) P_lm(cos theta_k) cos(m phi_k),
+# (T_nlm with sin), where N_lm^2 = (2l + 1) (l - m)! / (4 pi (l + m)!) and I_nl is the radial
+# normalisation integral. Fitting and evaluation are each one O(N nmax lmax^2) pass.
+# The Hernquist basis suits near-spherical systems. Flattened ones need many angular orders:
+# for the project's uniform (15, 15, 4) kpc spheroid the median relative force error against
+# the softened direct sum (10^5 particles) is about 17% at nmax=10, lmax=4, 12% at nmax=12,
+# lmax=6, 10% at the default nmax=16, lmax=8 (fit + evaluation 0.7 s), 8% at nmax=20,
+# lmax=12 and 6% at nmax=30, lmax=20, where particle noise in the reference starts to
+# dominate. SCFExpansion.force_error reports it for the actual run.
+HALF_MASS_RADIUS_FACTOR = 2.0 ** (-1.0 / 3.0)  # r_half / R of a uniform sphere of radius R
+HERNQUIST_HALF_MASS = 1.0 + math.sqrt(2.0)  # r_half / a of a Hernquist sphere
+MIN_SIN_THETA = 1e-12  # Keeps the angular terms finite on the z axis
+
+
+def scf_scale_length(spheroidal_params):
+    """
+    Picks the basis scale length for a uniform spheroid: the Hernquist scale a whose half-mass
+    radius matches that of the sphere of equal volume, r_half = 2^(-1/3) (a b c)^(1/3).
+    Args:
+        spheroidal_params (SpheroidalParams): The spheroid.
+    Returns:
+        float: Scale length (kpc).
+    """
+    equivalent_radius = (spheroidal_params.a * spheroidal_params.b * spheroidal_params.c) ** (1.0 / 3.0)
+    return HALF_MASS_RADIUS_FACTOR * equivalent_radius / HERNQUIST_HALF_MASS
+
+
+def _normalisation(nmax, lmax):
+    """Returns the (nmax+1, lmax+1, lmax+1) factors (2 - delta_m0) N_lm^2 / I_nl (zero for m > l)."""
+    factors = np.zeros((nmax + 1, lmax + 1, lmax + 1))
+    for n in range(nmax + 1):
+        for l in range(lmax + 1):
+            K = 0.5 * n * (n + 4 * l + 3) + (l + 1) * (2 * l + 1)
+            log_I = (math.log(K) - (8 * l + 6) * math.log(2.0) + math.lgamma(n + 4 * l + 3) - math.lgamma(n + 1)
+                     - math.log(n + 2 * l + 1.5) - 2.0 * math.lgamma(2 * l + 1.5))
+            I = -math.exp(log_I)  # Radial integral of rho_nl Phi_nl r^2
+            for m in range(l + 1):
+                N_sq = (2 * l + 1) / (4.0 * math.pi) * math.exp(math.lgamma(l - m + 1) - math.lgamma(l + m + 1))
+                factors[n, l, m] = (1.0 if m == 0 else 2.0) * N_sq / I
+    return factors
+
+
+@njit(cache=True)
+def _radial_terms(s, nmax, lmax, phi_nl, dphi_nl):
+    """Fills phi_nl[n, l] = Phi_nl(s) and dphi_nl[n, l] = dPhi_nl/ds."""
+    xi = (s - 1.0) / (s + 1.0)
+    dxi = 2.0 / ((1.0 + s) * (1.0 + s))
+    for l in range(lmax + 1):
+        alpha = 2.0 * l + 1.5
+        prefactor = s ** l / (1.0 + s) ** (2 * l + 1)
+        d_log_prefactor = (l / s if s > 0.0 else 0.0) - (2 * l + 1) / (1.0 + s)
+        c_prev = 1.0  # C_0^alpha
+        c_curr = 2.0 * alpha * xi  # C_1^alpha
+        dc_prev = 1.0  # C_0^(alpha+1), so that dC_n^alpha/dxi = 2 alpha C_(n-1)^(alpha+1)
+        dc_curr = 2.0 * (alpha + 1.0) * xi
+        for n in range(nmax + 1):
+            if n == 0:
+                c = 1.0
+                dc = 0.0
+            elif n == 1:
+                c = c_curr
+                dc = 2.0 * alpha * dc_prev
+            else:
+                c_next = (2.0 * xi * (n + alpha - 1.0) * c_curr - (n + 2.0 * alpha - 2.0) * c_prev) / n
+                c_prev = c_curr
+                c_curr = c_next
+                c = c_curr
+                k = n - 1  # Advance C_k^(alpha+1)
+                if k >= 2:
+                    dc_next = (2.0 * xi * (k + alpha) * dc_curr - (k + 2.0 * alpha) * dc_prev) / k
+                    dc_prev = dc_curr
+                    dc_curr = dc_next
+                dc = 2.0 * alpha * (dc_curr if k >= 1 else dc_prev)
+            phi_nl[n, l] = -prefactor * c
+            dphi_nl[n, l] = -prefactor * (d_log_prefactor * c + dc * dxi)
+
+
+@njit(cache=True)
+def _angular_terms(x, sin_theta, lmax, P, dP):
+    """Fills P[l, m] = P_lm(cos theta) (no Condon-Shortley phase) and dP[l, m] = dP_lm/dtheta."""
+    for m in range(lmax + 1):
+        p_mm = 1.0
+        for k in range(1, m + 1):
+            p_mm *= (2 * k - 1) * sin_theta
+        P[m, m] = p_mm
+        if m + 1 <= lmax:
+            P[m + 1, m] = x * (2 * m + 1) * p_mm
+        for l in range(m + 2, lmax + 1):
+            P[l, m] = (x * (2 * l - 1) * P[l - 1, m] - (l + m - 1) * P[l - 2, m]) / (l - m)
+    for l in range(lmax + 1):
+        for m in range(l + 1):
+            previous = P[l - 1, m] if l - 1 >= m else 0.0
+            dP[l, m] = (l * x * P[l, m] - (l + m) * previous) / sin_theta  # -sin(theta) dP/dx
+    return
+
+
+@njit(parallel=True, cache=True)
+def _fit_kernel(positions, masses, center, scale_length, nmax, lmax, num_chunks):
+    """Returns the unnormalised sums of m_k Phi_nl P_lm cos(m phi) and sin(m phi)."""
+    num_particles = positions.shape[0]
+    sums = np.zeros((num_chunks, 2, nmax + 1, lmax + 1, lmax + 1))
+    chunk_size = (num_particles + num_chunks - 1) // num_chunks
+    for c in prange(num_chunks):
+        phi_nl = np.empty((nmax + 1, lmax + 1))
+        dphi_nl = np.empty((nmax + 1, lmax + 1))
+        P = np.zeros((lmax + 1, lmax + 1))
+        dP = np.zeros((lmax + 1, lmax + 1))
+        for k in range(c * chunk_size, min((c + 1) * chunk_size, num_particles)):
+            dx = positions[k, 0] - center[0]
+            dy = positions[k, 1] - center[1]
+            dz = positions[k, 2] - center[2]
+            r = np.sqrt(dx * dx + dy * dy + dz * dz)
+            x = dz / r if r > 0.0 else 1.0
+            sin_theta = max(np.sqrt(max(1.0 - x * x, 0.0)), MIN_SIN_THETA)
+            azimuth = np.arctan2(dy, dx)
+            _radial_terms(r / scale_length, nmax, lmax, phi_nl, dphi_nl)
+            _angular_terms(x, sin_theta, lmax, P, dP)
+            for m in range(lmax + 1):
+                cos_m = np.cos(m * azimuth) * masses[k]
+                sin_m = np.sin(m * azimuth) * masses[k]
+                for l in range(m, lmax + 1):
+                    for n in range(nmax + 1):
+                        term = phi_nl[n, l] * P[l, m]
+                        sums[c, 0, n, l, m] += term * cos_m
+                        sums[c, 1, n, l, m] += term * sin_m
+    total = np.zeros((2, nmax + 1, lmax + 1, lmax + 1))
+    for c in range(num_chunks):
+        total += sums[c]
+    return total
+
+
+@njit(parallel=True, cache=True)
+def _field_kernel(positions, center, scale_length, S, T, grav_const):
+    """Evaluates the expansion; returns (potential (N,), accelerations (N,3))."""
+    nmax = S.shape[0] - 1
+    lmax = S.shape[1] - 1
+    num_positions = positions.shape[0]
+    potential = np.zeros(num_positions)
+    accelerations = np.zeros((num_positions, 3))
+    for k in prange(num_positions):
+        phi_nl = np.empty((nmax + 1, lmax + 1))
+        dphi_nl = np.empty((nmax + 1, lmax + 1))
+        P = np.zeros((lmax + 1, lmax + 1))
+        dP = np.zeros((lmax + 1, lmax + 1))
+        dx = positions[k, 0] - center[0]
+        dy = positions[k, 1] - center[1]
+        dz = positions[k, 2] - center[2]
+        R = np.sqrt(dx * dx + dy * dy)
+        r = np.sqrt(R * R + dz * dz)
+        s = r / scale_length
+        x = dz / r if r > 0.0 else 1.0
+        sin_theta = max(np.sqrt(max(1.0 - x * x, 0.0)), MIN_SIN_THETA)
+        azimuth = np.arctan2(dy, dx)
+        _radial_terms(s, nmax, lmax, phi_nl, dphi_nl)
+        _angular_terms(x, sin_theta, lmax, P, dP)
+        phi = 0.0
+        d_r = 0.0  # dPhi/ds
+        d_theta = 0.0  # dPhi/dtheta
+        d_azimuth = 0.0  # dPhi/dphi
+        for m in range(lmax + 1):
+            cos_m = np.cos(m * azimuth)
+            sin_m = np.sin(m * azimuth)
+            for l in range(m, lmax + 1):
+                for n in range(nmax + 1):
+                    angular = S[n, l, m] * cos_m + T[n, l, m] * sin_m
+                    phi += phi_nl[n, l] * P[l, m] * angular
+                    d_r += dphi_nl[n, l] * P[l, m] * angular
+                    d_theta += phi_nl[n, l] * dP[l, m] * angular
+                    d_azimuth += phi_nl[n, l] * P[l, m] * m * (T[n, l, m] * cos_m - S[n, l, m] * sin_m)
+        scale = grav_const / scale_length
+        potential[k] = scale * phi
+        a_r = -scale * d_r / scale_length
+        a_theta = -scale * d_theta / r if r > 0.0 else 0.0
+        a_azimuth = -scale * d_azimuth / (r * sin_theta) if r > 0.0 else 0.0
+        cos_azimuth = dx / R if R > 0.0 else 1.0
+        sin_azimuth = dy / R if R > 0.0 else 0.0
+        accelerations[k, 0] = (sin_theta * a_r + x * a_theta) * cos_azimuth - sin_azimuth * a_azimuth
+        accelerations[k, 1] = (sin_theta * a_r + x * a_theta) * sin_azimuth + cos_azimuth * a_azimuth
+        accelerations[k, 2] = x * a_r - sin_theta * a_theta
+    return potential, accelerations
+
+
+class SCFExpansion:
+    """
+    Basis-function expansion of the field of a particle set.
+    Attributes:
+        nmax (int): Highest radial order.
+        lmax (int): Highest angular order.
+        scale_length (float or None): Basis scale a (kpc); None estimates it from the particles on every fit.
+        center (np.array): (3,) expansion center (the centre of mass at the last fit).
+        S (np.array): (nmax+1, lmax+1, lmax+1) cosine coefficients.
+        T (np.array): (nmax+1, lmax+1, lmax+1) sine coefficients.
+        num_fits (int): Number of coefficient fits so far.
+        force_error (dict or None): Sampled relative force error against direct summation (see measure_force_error).
+    """
+    def __init__(self, nmax, lmax, scale_length=None):
+        """
+        Initializes an SCFExpansion without coefficients.
+        Args:
+            nmax (int): Highest radial order.
+            lmax (int): Highest angular order.
+            scale_length (float or None): Basis scale length (kpc), e.g. scf_scale_length(spheroidal_params).
+        """
+        self.nmax = int(nmax)
+        self.lmax = int(lmax)
+        self.scale_length = None if scale_length is None else float(scale_length)
+        self.fitted_scale_length = self.scale_length
+        self.center = np.zeros(3)
+        self.S = None
+        self.T = None
+        self.num_fits = 0
+        self.force_error = None
+        self._normalisation = _normalisation(self.nmax, self.lmax)
+
+    def fit(self, positions, masses, center=None):
+        """
+        Computes the coefficients from the particles in one pass.
+        Args:
+            positions (np.array): (N,3) particle positions (kpc).
+            masses (np.array): (N,) particle masses.
+            center (np.array): (3,) expansion center; None uses the centre of mass.
+        """
+        positions = np.ascontiguousarray(positions, dtype=np.float64)
+        masses = np.ascontiguousarray(masses, dtype=np.float64)
+        if center is not None:
+            self.center = np.asarray(center, dtype=np.float64)
+        else:
+            self.center = np.average(positions, axis=0, weights=masses) if masses.sum() > 0 else np.zeros(3)
+        if self.scale_length is None:  # Hernquist scale with the particles' half-mass radius
+            radii = np.linalg.norm(positions - self.center, axis=1)
+            order = np.argsort(radii)
+            half = np.searchsorted(np.cumsum(masses[order]), 0.5 * masses.sum())
+            self.fitted_scale_length = max(float(radii[order][min(half, len(radii) - 1)]), 1e-12) / HERNQUIST_HALF_MASS
+        num_chunks = numba.get_num_threads() if len(positions) >= 4096 else 1
+        sums = _fit_kernel(positions, masses, self.center, self.fitted_scale_length, self.nmax, self.lmax, num_chunks)
+        self.S = sums[0] * self._normalisation
+        self.T = sums[1] * self._normalisation
+        self.num_fits += 1
+
+    def field(self, positions):
+        """
+        Args:
+            positions (np.array): (N,3) positions (kpc).
+        Returns:
+            tuple: ((N,) potential, (N,3) accelerations) of the expansion.
+        """
+        positions = np.ascontiguousarray(positions, dtype=np.float64).reshape(-1, 3)
+        return _field_kernel(positions, self.center, self.fitted_scale_length, self.S, self.T, G)
+
+    def accelerations(self, positions):
+        return self.field(positions)[1]
+
+    def measure_force_error(self, positions, masses, softening_length, sample_size=256, seed=0):
+        """
+        Compares the fitted expansion with the softened direct sum at a fixed random sample of
+        the particles (O(sample_size * N)) and stores the result in force_error.
+        Args:
+            positions (np.array): (N,3) particle positions the expansion was fitted to (kpc).
+            masses (np.array): (N,) particle masses.
+            softening_length (float): Plummer softening of the reference sum (kpc).
+            sample_size (int): Number of particles to check.
+            seed (int): Seed of the sample, so the check does not touch any global random state.
+        Returns:
+            dict: Median, 99th percentile and maximum relative error over the sample.
+        """
+        forces = self.accelerations(positions) * np.asarray(masses, dtype=np.float64)[:, None]
+        self.force_error = sampled_force_error(positions, masses, forces, softening_length, sample_size,
+                                               np.random.default_rng(seed))
+        return self.force_error
+
+
+def scf_forces(positions, masses, expansion, refit=True, targets=None):
+    """
+    Calculates smooth self-gravity forces from a basis-function expansion of the particles.
+    Args:
+        positions (np.array): (N,3) particle positions (kpc).
+        masses (np.array): (N,) particle masses.
+        expansion (SCFExpansion): The expansion; its coefficients are reused when refit is False.
+        refit (bool): Recompute the coefficients from the current positions (of all particles) first.
+        targets (np.array): Indices of the particles to evaluate; None evaluates all of them.
+    Returns:
+        np.array: (N,3) array of gravitational forces, or (len(targets),3) when targets is given.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    masses = np.asarray(masses, dtype=np.float64)
+    if refit or expansion.S is None:
+        expansion.fit(positions, masses)
+    if targets is not None:
+        positions, masses = positions[targets], masses[targets]
+    return expansion.accelerations(positions) * masses[:, None]
+
+
+if __name__ == '__main__':
+    import time
+
+    # --- A Hernquist sphere is the lowest basis function ---
+    rng = np.random.default_rng(42)
+    num_particles = 200000
+    u = rng.uniform(size=num_particles)
+    radii = np.sqrt(u) / (1.0 - np.sqrt(u))  # Hernquist (a = 1) cumulative mass inversion
+    directions = rng.normal(size=(num_particles, 3))
+    positions_example = radii[:, None] * directions / np.linalg.norm(directions, axis=1)[:, None]
+    masses_example = np.full(num_particles, 1.0 / num_particles)
+    expansion_example = SCFExpansion(nmax=8, lmax=4, scale_length=1.0)
+    expansion_example.fit(positions_example, masses_example, center=np.zeros(3))
+    probe = np.array([[0.5, 0.0, 0.0], [0.0, 2.0, 0.0], [0.0, 0.0, 5.0]])
+    potential_probe, acceleration_probe = expansion_example.field(probe)
+    r_probe = np.linalg.norm(probe, axis=1)
+    print(f"Hernquist check: S_000 = {expansion_example.S[0, 0, 0]:.4f} (expect 1), potential error "
+          f"{np.max(np.abs(potential_probe / (-G / (1.0 + r_probe)) - 1.0)):.1e}, radial acceleration error "
+          f"{np.max(np.abs(np.linalg.norm(acceleration_probe, axis=1) / (G / (1.0 + r_probe) ** 2) - 1.0)):.1e}")
+
+    # --- Flattened uniform spheroid against direct summation, and timing ---
+    from src.galactic_potential import SpheroidalParams
+    from src.direct_summation import sampled_force_error
+    spheroid = SpheroidalParams(15.0, 15.0, 4.0, 100.0)
+    num_particles = 100000
+    points = rng.uniform(-1.0, 1.0, size=(3 * num_particles, 3))
+    points = points[np.einsum('ij,ij->i', points, points) <= 1.0][:num_particles] * np.array([spheroid.a, spheroid.b, spheroid.c])
+    masses_spheroid = np.full(len(points), spheroid.M / len(points))
+    for nmax, lmax in ((6, 2), (12, 6), (16, 8)):
+        expansion_example = SCFExpansion(nmax, lmax, scf_scale_length(spheroid))
+        scf_forces(points[:10], masses_spheroid[:10], expansion_example)  # Compile
+        start = time.perf_counter()
+        forces_scf = scf_forces(points, masses_spheroid, expansion_example)
+        elapsed = time.perf_counter() - start
+        error = sampled_force_error(points, masses_spheroid, forces_scf, 0.2, rng=rng)
+        print(f"nmax={nmax}, lmax={lmax}: fit + evaluate {elapsed * 1e3:.0f} ms for {len(points)} particles, "
+              f"median relative force error {error['median']:.2e} (vs softened direct sum)")
+# --- END OF FILE scf.py ---
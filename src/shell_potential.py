@@ -2,7 +2,7 @@
 #--- START OF FILE shell_potential.py ---
 # src/shell_potential.py
 import numpy as np
-from numba import njit # Corrected import: removed 'overload'
+from numba import njit, prange # Corrected import: removed 'overload'
 import kingdon as kg # Import kingdon
 from typing import TYPE_CHECKING
 
@@ -12,7 +12,7 @@ if TYPE_CHECKING:
     from typing import Tuple, Any
 
 # Assume ga_utils.py provides these (define placeholders here if not available for demonstration)
-from src.ga_utils import ga_vector_add, ga_vector_subtract, ga_scalar_mul, ga_vector_norm_sq, ga_vector_normalize, to_ga_point, from_ga_vector # Corrected import - using ga_vector_subtract, removed typo
+from src.ga_utils import ga_vector_add, ga_vector_subtract, ga_scalar_mul, ga_vector_norm_sq, ga_vector_normalize, to_ga_point, from_ga_vector, to_ga_vectors, from_ga_vectors # Corrected import - using ga_vector_subtract, removed typo
 
 def ga_vector_add(v1, v2):
     return v1 + v2
@@ -36,8 +36,9 @@ def to_ga_point(np_array):
     # Corrected to use keyword 'values' to pass components
     return alg.multivector(values=[np_array[0], np_array[1], np_array[2]], grades=(1,)) # Explicitly pass values and grades
 
-def from_ga_vector(ga_vector):
-    return np.array([float(ga_vector[0]), float(ga_vector[1]), float(ga_vector[2])]) # Assuming vector parts are indices 0, 1, 2
+
+SHELL_G = 1.0  # Gravitational constant of the shell background (adjust as needed)
+SHELL_SOFTENING_SQ = 1e-9  # Small softening to avoid singularities
 
 
 class SpheroidalShell:
@@ -45,65 +46,221 @@ class SpheroidalShell:
         self.mass = mass
         self.semimajor_axis = semimajor_axis
         self.semiminor_axis = semiminor_axis
+        self.center_np = np.array(center_np, dtype=np.float64) # Center as Cartesian array
         self.center_ga = to_ga_point(center_np) # Center as kingdon GA point
 
 
-# ---  Implementation of spheroidal_shell_force_approximation without overload ---
+class ShellSet:
+    """
+    Struct-of-arrays view of a list of SpheroidalShell objects, for evaluating the shell
+    background at many positions at once.
+    Attributes:
+        masses (np.array): (S,) shell masses.
+        semimajor_axes (np.array): (S,) shell semi-major axes.
+        semiminor_axes (np.array): (S,) shell semi-minor axes.
+        centers (np.array): (S,3) shell centers.
+    """
+    def __init__(self, masses, semimajor_axes, semiminor_axes, centers):
+        """
+        Initializes a ShellSet.
+        Args:
+            masses (np.array): (S,) shell masses.
+            semimajor_axes (np.array): (S,) shell semi-major axes.
+            semiminor_axes (np.array): (S,) shell semi-minor axes.
+            centers (np.array): (S,3) shell centers.
+        """
+        self.masses = np.ascontiguousarray(masses, dtype=np.float64).reshape(-1)
+        self.semimajor_axes = np.ascontiguousarray(semimajor_axes, dtype=np.float64).reshape(-1)
+        self.semiminor_axes = np.ascontiguousarray(semiminor_axes, dtype=np.float64).reshape(-1)
+        self.centers = np.ascontiguousarray(centers, dtype=np.float64).reshape(-1, 3)
+        if not len(self.masses) == len(self.semimajor_axes) == len(self.semiminor_axes) == len(self.centers):
+            raise ValueError("All shell arrays must have the same length.")
+
+    @classmethod
+    def from_shells(cls, shells):
+        """
+        Builds a ShellSet from a list of shells; entries that are not SpheroidalShell objects are skipped.
+        Args:
+            shells (list of SpheroidalShell): The shells.
+        Returns:
+            ShellSet: The shells as arrays, in list order.
+        """
+        shells = [shell for shell in shells if isinstance(shell, SpheroidalShell)]
+        return cls([shell.mass for shell in shells],
+                   [shell.semimajor_axis for shell in shells],
+                   [shell.semiminor_axis for shell in shells],
+                   np.array([shell.center_np for shell in shells]).reshape(-1, 3))
+
+    def __len__(self):
+        return len(self.masses)
+
+
+def as_shell_set(shells):
+    """Returns shells as a ShellSet (a ShellSet is passed through unchanged)."""
+    return shells if isinstance(shells, ShellSet) else ShellSet.from_shells(shells)
+
+
+class ConcentricShellTable:
+    """
+    Radial force table for shells that share one center.
+    With the shells sorted by semi-major axis a_s, the shells with a_s < r act as point
+    masses and the rest contribute their linear inner ramp, so the force magnitude at radius r is
+        G * (sum_{a_s < r} M_s) / (r^2 + eps) + G * r * sum_{a_s >= r} M_s / (a_s (a_s^2 + eps)).
+    Both sums are tabulated once (a prefix and a suffix sum), so each lookup is one
+    searchsorted plus two multiply-adds, independent of the number of shells. The result
+    equals the shell-by-shell sum up to floating-point rounding.
+    Attributes:
+        center (np.array): (3,) common shell center.
+        radii (np.array): (S,) sorted semi-major axes.
+        enclosed_mass (np.array): (S+1,) mass of the first k shells (prefix sum).
+        inner_coefficient (np.array): (S+1,) sum of M / (a (a^2 + eps)) over shells k and beyond (suffix sum).
+    """
+    def __init__(self, shell_set):
+        """
+        Builds the table.
+        Args:
+            shell_set (ShellSet): Shells with identical centers.
+        """
+        if not is_concentric(shell_set):
+            raise ValueError("ConcentricShellTable needs shells with a common center.")
+        order = np.argsort(shell_set.semimajor_axes, kind='stable')
+        masses = shell_set.masses[order]
+        self.radii = np.ascontiguousarray(shell_set.semimajor_axes[order])
+        self.center = shell_set.centers[0].copy()
+        self.enclosed_mass = np.concatenate(([0.0], np.cumsum(masses)))
+        inner_terms = masses / (self.radii * (self.radii ** 2 + SHELL_SOFTENING_SQ))
+        self.inner_coefficient = np.concatenate((np.cumsum(inner_terms[::-1])[::-1], [0.0]))
+
+    def __len__(self):
+        return len(self.radii)
+
+    def forces(self, positions):
+        """
+        Args:
+            positions (np.array): (N,3) Cartesian positions.
+        Returns:
+            np.array: (N,3) shell forces.
+        """
+        return _table_forces_kernel(positions, self.center, self.radii, self.enclosed_mass, self.inner_coefficient,
+                                    SHELL_G, SHELL_SOFTENING_SQ)
+
+
+def is_concentric(shell_set):
+    """Returns True if every shell of the ShellSet has exactly the same center."""
+    return len(shell_set) > 0 and bool(np.all(shell_set.centers == shell_set.centers[0]))
+
+
+def build_shell_background(shells):
+    """
+    Prepares a shell list for repeated evaluation: a ConcentricShellTable when all shells
+    share one center, otherwise a ShellSet for the exact shell-by-shell path.
+    Args:
+        shells (list, ShellSet or ConcentricShellTable): The shells.
+    Returns:
+        ConcentricShellTable or ShellSet: Input accepted by shell_forces.
+    """
+    if isinstance(shells, ConcentricShellTable):
+        return shells
+    shell_set = as_shell_set(shells)
+    return ConcentricShellTable(shell_set) if is_concentric(shell_set) else shell_set
+
+
+@njit(parallel=True, cache=True)
+def _table_forces_kernel(positions, center, radii, enclosed_mass, inner_coefficient, grav_const, softening_sq):
+    """Looks up the tabulated radial shell force at every position."""
+    num_positions = positions.shape[0]
+    forces = np.zeros((num_positions, 3))
+    for n in prange(num_positions):
+        rx = center[0] - positions[n, 0]  # Vector from position to shell center
+        ry = center[1] - positions[n, 1]
+        rz = center[2] - positions[n, 2]
+        r_sq = rx * rx + ry * ry + rz * rz
+        if r_sq <= softening_sq:
+            continue  # Inside softening radius of every shell
+        r = r_sq ** 0.5
+        k = np.searchsorted(radii, r)  # Shells [0, k) have a < r and act from outside
+        force_magnitude = -grav_const * (enclosed_mass[k] / (r_sq + softening_sq) + r * inner_coefficient[k])
+        forces[n, 0] = force_magnitude * (rx / r)
+        forces[n, 1] = force_magnitude * (ry / r)
+        forces[n, 2] = force_magnitude * (rz / r)
+    return forces
+
+
+@njit(parallel=True, cache=True)
+def _shell_forces_kernel(positions, masses, semimajor_axes, centers, grav_const, softening_sq):
+    """Sums the piecewise shell force of every shell at every position (shells in list order)."""
+    num_positions = positions.shape[0]
+    num_shells = masses.shape[0]
+    forces = np.zeros((num_positions, 3))
+    for n in prange(num_positions):
+        fx = 0.0
+        fy = 0.0
+        fz = 0.0
+        for s in range(num_shells):
+            rx = centers[s, 0] - positions[n, 0]  # Vector from position to shell center
+            ry = centers[s, 1] - positions[n, 1]
+            rz = centers[s, 2] - positions[n, 2]
+            r_sq = rx * rx + ry * ry + rz * rz
+            if r_sq <= softening_sq:
+                continue  # Inside softening radius, force from this shell is zero
+            r = r_sq ** 0.5
+            a = semimajor_axes[s]
+            if r > a:  # Outside shell - Shell Theorem applies
+                force_magnitude = -grav_const * masses[s] / (r_sq + softening_sq)
+            else:  # Inside shell - Linearized approximation
+                force_magnitude = -grav_const * masses[s] / (a ** 2 + softening_sq) * (r / a)
+            fx += force_magnitude * (rx / r)
+            fy += force_magnitude * (ry / r)
+            fz += force_magnitude * (rz / r)
+        forces[n, 0] = fx
+        forces[n, 1] = fy
+        forces[n, 2] = fz
+    return forces
+
+
+def shell_forces(positions, shells):
+    """
+    Evaluates the spheroidal shell background at many positions in one compiled pass.
+    Computes exactly the piecewise force of spheroidal_shell_force_approximation (Shell Theorem
+    outside the semi-major axis, linear ramp inside) for all N x S position/shell combinations.
+    Each position is handled by one thread looping over the shells, so no (N,S) temporaries
+    are allocated. Prepared backgrounds (a ConcentricShellTable from build_shell_background, or
+    any object with a forces(positions) method such as a homoeoid.HomoeoidGrid) evaluate themselves.
+    Args:
+        positions (np.array): (N,3) Cartesian positions.
+        shells (ShellSet, list of SpheroidalShell or prepared background): The shells.
+    Returns:
+        np.array: (N,3) shell forces.
+    """
+    positions = np.ascontiguousarray(positions, dtype=np.float64).reshape(-1, 3)
+    if callable(getattr(shells, "forces", None)):
+        return shells.forces(positions)
+    shell_set = as_shell_set(shells)
+    if len(shell_set) == 0 or len(positions) == 0:
+        return np.zeros((len(positions), 3))
+    return _shell_forces_kernel(positions, shell_set.masses, shell_set.semimajor_axes, shell_set.centers,
+                                SHELL_G, SHELL_SOFTENING_SQ)
+
 
 def spheroidal_shell_force_approximation(position_ga, shells): # Changed shell to shells to match forces.py
     """
-    Approximates the gravitational force exerted by a spheroidal shell on a given position.
-
-    This function uses type-based specialization via @overload to handle different input types efficiently.
-    Currently specialized for:
-        - position_ga: kingdon.MultiVector (GA point representing position)
-        - shell: SpheroidalShell object
+    Approximates the gravitational force exerted by a list of spheroidal shells on a given position.
+    Thin GA wrapper around shell_forces for a single position, or for all positions of a
+    batched GA point (see ga_utils.to_ga_points).
 
     Args:
-        position_ga (MultiVector): The position at which to calculate the force (GA point).
-        shells (list of SpheroidalShell): A list of SpheroidalShell objects defining the shells. # Changed shell to shells
+        position_ga (MultiVector): The position at which to calculate the force (GA point), or a batched GA point.
+        shells (list of SpheroidalShell, ShellSet or ConcentricShellTable): The shells; list entries that are
+            not SpheroidalShell are skipped.
 
     Returns:
-        kingdon.MultiVector: The gravitational force vector (GA vector).
+        kingdon.MultiVector: The gravitational force vector (GA vector; batched for a batched input).
     """
-
-    # --- Specialized implementation for kingdon MultiVector and list of SpheroidalShell ---
-    if isinstance(position_ga, kg.MultiVector) and isinstance(shells, list): # Specialize for list of shells and kingdon MultiVector
-        total_force_ga = kg.MultiVector(alg, values=None) # Initialize zero force using kingdon zero vector
-        for shell in shells: # Iterate over shells
-            if not isinstance(shell, SpheroidalShell): # Basic type check inside loop for robustness
-                continue # Skip if not a SpheroidalShell, or raise error if strict type enforcement is needed
-
-            G = 1.0  # Gravitational constant (adjust as needed)
-            softening_radius_sq = 1e-9 # Small softening to avoid singularities
-
-            relative_pos_ga = ga_vector_sub(position_ga, shell.center_ga) # Vector from shell center to position
-            r_vec_ga = ga_vector_subtract(shell.center_ga, position_ga) # Use ga_vector_subtract
-            r_sq_ga = ga_vector_norm_sq(r_vec_ga) # Kingdon GA norm_sq
-            # Corrected line to access scalar part using .e attribute
-            r_sq_val = r_sq_ga.e
-            r_sq = float(r_sq_val) if r_sq_val is not None else 0.0 # Extract scalar value and convert to float, handle None case
-            # --- End of corrected line ---
-
-            if r_sq <= softening_radius_sq:
-                continue # Inside softening radius, force from this shell is zero, move to next shell
-
-            r = r_sq**0.5
-
-            if r > shell.semimajor_axis: # Outside shell - Shell Theorem applies
-                force_magnitude = -G * shell.mass / (r_sq + softening_radius_sq) # Softened force magnitude
-                force_direction = ga_vector_normalize(r_vec_ga) # Kingdon GA normalize
-                force_ga = ga_scalar_mul(force_magnitude, force_direction) # Scalar multiply
-                total_force_ga = ga_vector_add(total_force_ga, force_ga) # Accumulate force
-            else: # Inside shell - Linearized approximation
-                normalized_r = r / shell.semimajor_axis # Distance as fraction of semi-major axis
-                force_magnitude_inner = -G * shell.mass / (shell.semimajor_axis**2 + softening_radius_sq) # Force at outer "radius"
-                force_magnitude = force_magnitude_inner * normalized_r # Linearly reduce force inwards
-                force_direction = ga_vector_normalize(r_vec_ga) # Kingdon GA normalize
-                force_ga = ga_scalar_mul(force_magnitude, force_direction) # Scalar multiply
-                total_force_ga = ga_vector_add(total_force_ga, force_ga) # Accumulate force
-
-        return total_force_ga # Return total force from all shells
+    if isinstance(position_ga, kg.MultiVector) and isinstance(shells, (list, ShellSet, ConcentricShellTable)):
+        if np.ndim(position_ga.e1) > 0:  # Batched GA point: all positions in one call
+            return to_ga_vectors(shell_forces(np.ascontiguousarray(from_ga_vectors(position_ga)), shells))
+        force_np = shell_forces(np.array(from_ga_vector(position_ga), dtype=np.float64), shells)[0]
+        return to_ga_point(force_np)
 
     # --- Fallback implementation or error for unsupported types ---
     else:
@@ -152,4 +309,24 @@ if __name__ == '__main__':
         print(f"Total Force (GA): {force_ga}")
         print(f"Total Force (NumPy vector): {force_np}")
         print("-" * 30)
+
+    # --- Tabulated background versus the shell-by-shell sum ---
+    import time
+    rng = np.random.default_rng(42)
+    positions_sample = rng.normal(scale=8.0, size=(200000, 3))
+    for num_shells in (20, 200, 2000):
+        radii = np.linspace(0.1, 20.0, num_shells)
+        shells_many = [SpheroidalShell(1e11 / num_shells, a, 0.6 * a, np.zeros(3)) for a in radii]
+        exact_set = ShellSet.from_shells(shells_many)
+        table = build_shell_background(shells_many)
+        shell_forces(positions_sample[:10], exact_set), shell_forces(positions_sample[:10], table)  # Compile
+        start = time.perf_counter()
+        exact = shell_forces(positions_sample, exact_set)
+        exact_time = time.perf_counter() - start
+        start = time.perf_counter()
+        tabulated = shell_forces(positions_sample, table)
+        table_time = time.perf_counter() - start
+        error = np.max(np.linalg.norm(tabulated - exact, axis=1) / np.linalg.norm(exact, axis=1))
+        print(f"{num_shells} shells, {len(positions_sample)} positions: exact {exact_time * 1e3:.1f} ms, "
+              f"table {table_time * 1e3:.1f} ms, max relative difference {error:.1e}")
 # --- END OF FILE shell_potential.py ---
\ No newline at end of file
@@ -6,9 +6,13 @@ import random
 import logging
 import time
 import os
-from src.particles import Star, BlackHole
-from src.forces import localized_gravity_force
-from src.integrator import velocity_verlet_step, velocity_verlet_second_half_kick, adaptive_timestep
+from src.particles import Star, BlackHole, ParticleSet
+from src.force_engines import compute_forces, compute_forces_and_jerks, ForceEngineState
+from src.reordering import reorder_particle_set
+from src.checkpoint import CheckpointWriter, snapshot_run_state, load_checkpoint
+from src.integrator import (velocity_verlet_step, velocity_verlet_second_half_kick, adaptive_timestep,
+                            particle_timesteps, timestep_levels, max_timestep_level, kick, drift,
+                            yoshida4_step, hermite4_step)
 from src.initialization import initialize_particles, form_disk
 from src.shell_potential import total_spheroidal_force_approximation, SpheroidalShell # Import shell class and corrected potential function name
 from src.galactic_potential import SpheroidalParams, DiskParams, SpiralParams # Parameter classes
@@ -55,6 +59,8 @@ def calculate_bh_halo_mass(particles):
 
 def calculate_max_bh_mass(particles):
     """Calculates max BH mass (placeholder - adapt if needed)."""
+    if isinstance(particles, ParticleSet):
+        return float(np.max(particles.masses[particles.is_black_hole], initial=0.0))
     max_mass = 0.0
     for p in particles:
         if isinstance(p, BlackHole) and p.mass > max_mass:
@@ -66,15 +72,23 @@ def collect_diagnostics(particles, stars, step, dt, sim_params):
     global star_positions_over_time, rotation_curves, bh_density_profiles, star_counts, velocity_dispersions, bh_halo_masses, max_bh_mass
 
     if step % sim_params.output_interval == 0:
-        if particles:
-            star_positions_over_time.append([from_ga_point(star.position_ga).copy() for star in stars]) # Convert GA to Cartesian for diagnostics
+        if len(particles) > 0:
+            if isinstance(particles, ParticleSet):
+                stars_by_id = np.flatnonzero(particles.is_star)
+                stars_by_id = stars_by_id[np.argsort(particles.ids[stars_by_id], kind='stable')] # Same order under reordering
+                star_positions_over_time.append(list(particles.positions[stars_by_id])) # Row copies
+                velocity_disp = list(np.linalg.norm(particles.velocities[stars_by_id], axis=1))
+                num_stars = int(np.count_nonzero(particles.is_star))
+            else:
+                star_positions_over_time.append([from_ga_point(star.position_ga).copy() for star in stars]) # Convert GA to Cartesian for diagnostics
+                velocity_disp = [np.linalg.norm(p.velocity) for p in particles if isinstance(p, Star)]
+                num_stars = len(stars)
             rotation_curves.append(calculate_rotation_curve(particles))
             bh_density_profiles.append(calculate_bh_radial_density(particles))
-            star_counts.append(len(stars))
-            velocity_disp = [np.linalg.norm(p.velocity) for p in particles if isinstance(p, Star)]
+            star_counts.append(num_stars)
 
             # --- Debug Prints ---
-            print(f"Debug - Step {step}: Number of stars = {len(stars)}") # Check star count
+            print(f"Debug - Step {step}: Number of stars = {num_stars}") # Check star count
             print(f"Debug - Step {step}: velocity_disp before std = {velocity_disp}") # Check velocity_disp list
 
             velocity_dispersions_val = np.std(velocity_disp) if velocity_disp else 0.0
@@ -86,49 +100,163 @@ def collect_diagnostics(particles, stars, step, dt, sim_params):
             bh_halo_masses.append(calculate_bh_halo_mass(particles))
             max_bh_mass.append(calculate_max_bh_mass(particles))
 
-            log_message(sim_params, 2, f"Step: {step}, Stars: {len(stars)}, BHs: {len([p for p in particles if isinstance(p, BlackHole)])}, "
+            log_message(sim_params, 2, f"Step: {step}, Stars: {num_stars}, BHs: {len(particles) - num_stars}, "
                                         f"Max BH Mass: {max_bh_mass[-1] if max_bh_mass else 0.0:.2f}, Time: {step * dt:.2f}")
         else:
             log_message(sim_params, 1, f"Warning: No particles remaining at step {step}")
 
-def run_one_step_ga(particles, shells, dt, sim_params, disk_params, spiral_params, step, disk_formation_step, ln_Lambda, rng):
-    """Performs one step of the GA-based simulation."""
+def run_one_step_ga(particles, shells, dt, sim_params, disk_params, spiral_params, step, disk_formation_step, ln_Lambda, rng,
+                    force_state=None, sim_time=0.0, forces_ga=None):
+    """Performs one kick-drift-kick step of the GA-based simulation.
+    forces_ga are the forces at the current positions, normally the end-of-step forces of the
+    previous step; pass None to evaluate them (first step, or after positions were changed
+    outside the integrator). The returned forces are valid at the returned positions.
+    With sim_params.integrator "yoshida4" or "hermite4" (ParticleSet only) the step is taken
+    by step_fourth_order instead."""
     logging.info(f"Starting run_one_step_ga for step: {step}")
+    if sim_params.integrator != "verlet":
+        return step_fourth_order(particles, shells, sim_params, disk_params, spiral_params, step, disk_formation_step,
+                                 force_state, sim_time, forces_ga, rng)
 
-    stars = [p for p in particles if isinstance(p, Star)]
-    bhs = [p for p in particles if isinstance(p, BlackHole)]
-
-    forces_ga = [localized_gravity_force(p, particles, shells, sim_params.interaction_radius_kpc) for p in particles]
+    if forces_ga is None:
+        forces_ga = compute_forces(particles, shells, sim_params, force_state, sim_time) # (N,3) forces from the selected engine
     dt = adaptive_timestep(particles, sim_params, forces_ga) # Adaptive time step
 
-    particles = velocity_verlet_step(particles, forces_ga, dt) # Velocity Verlet - first half & drift
+    particles = velocity_verlet_step(particles, forces_ga, dt) # Kick (half step) and drift
 
     if step == disk_formation_step: # Disk formation
-        form_disk(particles, disk_params, spiral_params)
-        stars = [p for p in particles if isinstance(p, Star)]
-        bhs = [p for p in particles if isinstance(p, BlackHole)]
+        form_disk(particles, disk_params, spiral_params, rng)
 
     # --- Placeholder for Encounters and Mergers (Adapt if needed) ---
     # particles_to_remove_indices = handle_encounters(stars, bhs, sim_params, spheroidal_params, rng, step)
     # bhs_to_remove_indices = merge_black_holes(bhs, sim_params.merger_radius)
     # particles[:] = [star for i, star in enumerate(stars) if i not in particles_to_remove_indices] + [bh for i, bh in enumerate(bhs) if i not in bhs_to_remove_indices]
 
-    forces_ga_next_step = [localized_gravity_force(p, particles, shells, sim_params.interaction_radius_kpc) for p in particles] # Recalculate forces
-    velocity_verlet_second_half_kick(particles, forces_ga_next_step, dt) # Velocity Verlet - second half kick
+    if force_state is not None:
+        force_state.step = step # Drifted positions belong to this step (SCF refit schedule)
+    forces_ga_next_step = compute_forces(particles, shells, sim_params, force_state, sim_time + dt) # The only force evaluation of the step
+    velocity_verlet_second_half_kick(particles, forces_ga_next_step, dt) # Kick (half step)
 
     logging.info(f"Finished run_one_step_ga for step: {step}, dt = {dt}")
     return particles, forces_ga_next_step, dt # Return forces for next step and dt for diagnostics
 
+def step_fourth_order(particles, shells, sim_params, disk_params, spiral_params, step, disk_formation_step,
+                      force_state=None, sim_time=0.0, forces_ga=None, rng=None):
+    """Performs one Yoshida or Hermite step of a ParticleSet with the adaptive global time step.
+    The Hermite jerks are carried between steps in force_state.jerks (without a state they are
+    re-evaluated every step). Disk formation happens after the step (drawing from rng, see
+    form_disk), followed by a fresh force evaluation. Returns the particles, the forces at the
+    new positions and dt."""
+    hermite = sim_params.integrator == "hermite4"
+    jerks = force_state.jerks if force_state is not None else None
+    if hermite and (forces_ga is None or jerks is None):
+        forces_ga, jerks = compute_forces_and_jerks(particles, shells, sim_params, force_state, sim_time)
+    elif forces_ga is None:
+        forces_ga = compute_forces(particles, shells, sim_params, force_state, sim_time)
+    forces_ga = np.asarray(forces_ga, dtype=np.float64)
+    dt = adaptive_timestep(particles, sim_params, forces_ga)
+    if force_state is not None:
+        force_state.step = step # Positions inside the step belong to this step (SCF refit schedule)
+
+    if hermite:
+        forces_next, jerks = hermite4_step(particles, forces_ga, jerks, dt, lambda p, elapsed: compute_forces_and_jerks(
+            p, shells, sim_params, force_state, sim_time + elapsed))
+    else:
+        forces_next = yoshida4_step(particles, forces_ga, dt, lambda p, elapsed: compute_forces(
+            p, shells, sim_params, force_state, sim_time + elapsed))
+
+    if step == disk_formation_step: # Disk formation, then forces at the new positions
+        form_disk(particles, disk_params, spiral_params, rng)
+        if hermite:
+            forces_next, jerks = compute_forces_and_jerks(particles, shells, sim_params, force_state, sim_time + dt)
+        else:
+            forces_next = compute_forces(particles, shells, sim_params, force_state, sim_time + dt)
+    if hermite and force_state is not None:
+        force_state.jerks = jerks
+
+    logging.info(f"Finished run_one_step_ga for step: {step}, dt = {dt}")
+    return particles, forces_next, dt
+
+def run_block_step_ga(particles, shells, sim_params, disk_params, spiral_params, step, disk_formation_step,
+                      force_state=None, sim_time=0.0, forces_ga=None, rng=None):
+    """Advances a ParticleSet by one block of dt_max with hierarchical power-of-two time-steps.
+    Each particle steps with dt_max / 2^level, its level set from its own acceleration and
+    velocity (see particle_timesteps) whenever it starts a step; a particle may only move to a
+    coarser level when the block time is a multiple of that level's step. At each substep all
+    particles drift (inactive ones are predicted along their half-kicked velocities), forces are
+    evaluated for the particles whose step ends there only, and those particles are kicked.
+    forces_ga are the forces at the current positions (None evaluates them); rng is the run's
+    random number generator, used for disk formation (see form_disk). Returns the
+    particles, the forces at the end of the block (all particles are synchronised there), dt_max
+    and a dict with the particle-force evaluations of the block, the number a global step at the
+    finest level used would have needed, and the number of substeps."""
+    max_level = max_timestep_level(sim_params)
+    num_ticks = 1 << max_level # Block length in units of the finest step
+    dt_tick = sim_params.dt_max / num_ticks
+    if force_state is not None:
+        force_state.step = step
+    if step == disk_formation_step: # Disk formation, before the block so the forces see it
+        form_disk(particles, disk_params, spiral_params, rng)
+        forces_ga = None
+    if forces_ga is None:
+        forces_ga = compute_forces(particles, shells, sim_params, force_state, sim_time)
+    forces = np.array(forces_ga, dtype=np.float64) # Active rows are replaced as the block proceeds
+
+    levels = timestep_levels(particle_timesteps(forces, particles.velocities, particles.masses, sim_params), sim_params.dt_max, max_level)
+    step_ticks = num_ticks >> levels
+    end_tick = step_ticks.copy()
+    finest_level = int(levels.max(initial=0))
+    kick(particles.velocities, forces, particles.masses, 0.5 * dt_tick * step_ticks) # Opening half-kicks
+    tick = 0
+    particle_forces = 0
+    num_substeps = 0
+    while tick < num_ticks:
+        next_tick = int(end_tick.min())
+        drift(particles.positions, particles.velocities, (next_tick - tick) * dt_tick) # Active particles drift, inactive ones are predicted
+        tick = next_tick
+        active = end_tick == tick
+        active_forces = compute_forces(particles, shells, sim_params, force_state, sim_time + tick * dt_tick, active)
+        forces[active] = active_forces[active]
+        particle_forces += int(np.count_nonzero(active))
+        num_substeps += 1
+        kick(particles.velocities, forces, particles.masses, 0.5 * dt_tick * step_ticks, active) # Closing half-kicks
+        if tick == num_ticks:
+            break
+        coarsest_allowed = max_level - ((tick & -tick).bit_length() - 1) # Levels whose steps start at this tick
+        new_levels = timestep_levels(particle_timesteps(forces, particles.velocities, particles.masses, sim_params), sim_params.dt_max, max_level)
+        levels[active] = np.maximum(new_levels[active], coarsest_allowed)
+        step_ticks[active] = num_ticks >> levels[active]
+        end_tick[active] = tick + step_ticks[active]
+        finest_level = max(finest_level, int(levels.max(initial=0)))
+        kick(particles.velocities, forces, particles.masses, 0.5 * dt_tick * step_ticks, active) # Opening half-kicks of the next steps
+
+    block_stats = {
+        "particle_forces": particle_forces,
+        "global_particle_forces": len(particles) << finest_level,
+        "substeps": num_substeps,
+    }
+    return particles, forces, sim_params.dt_max, block_stats
+
 def run_n_body_simulation_ga(n_steps, initial_particles, shells, sim_params,
                                disk_formation_step, disk_params, spiral_params,
-                               ln_Lambda, spheroidal_params, rng_seed):
-    """Runs the GA-based N-body simulation."""
-    rng = random.Random(rng_seed)
-    particles = [ # Deepcopy initial particles and use GA representation
-        Star(particle_init.position.copy(), particle_init.velocity.copy(), particle_init.mass) if isinstance(particle_init, Star)
-        else BlackHole(particle_init.position.copy(), particle_init.velocity.copy(), particle_init.mass)
-        for particle_init in initial_particles # Changed loop variable name here to particle_init
-    ]
+                               ln_Lambda, spheroidal_params, rng_seed, external_potential=None, resume=None):
+    """Runs the GA-based N-body simulation. external_potential is an optional GalacticPotential added to the forces.
+    initial_particles may be a list of Star/BlackHole objects or a ParticleSet; the run works on a
+    ParticleSet copy and returns the final particles in the same form as the input. With
+    sim_params.block_timestep_levels > 0 every step is one block of dt_max (see run_block_step_ga).
+    With sim_params.checkpoint_interval > 0 the run state is written to sim_params.checkpoint_path
+    every checkpoint_interval steps by a background thread. resume is a RunCheckpoint to continue
+    from (see resume_from); initial_particles and rng_seed are then ignored, and the diagnostics
+    cover the steps after the checkpoint. Disk formation draws from the run's random.Random(rng_seed)."""
+    if resume is None:
+        rng = random.Random(rng_seed)
+        return_particle_set = isinstance(initial_particles, ParticleSet)
+        particles = ParticleSet.from_particles(initial_particles) # Copy of the initial particles as arrays
+    else:
+        resume.check_compatible(sim_params)
+        rng = resume.restore_random_states()
+        return_particle_set = resume.return_particle_set
+        particles = resume.particles()
     zero_force_ga = kg.MultiVector(algebra=alg, values=None) # Initialize zero force using kingdon, adjust if needed - keyword values
 
 
@@ -141,18 +269,88 @@ def run_n_body_simulation_ga(n_steps, initial_particles, shells, sim_params,
     bh_halo_masses = []
     max_bh_mass = []
 
-    dt = sim_params.dt_max # Initial time step
-    log_message(sim_params, 1, "Starting GA-based N-body simulation...")
+    force_state = ForceEngineState(sim_params, external_potential, spheroidal_params) # Caches reused across force evaluations
+    if resume is None:
+        dt = sim_params.dt_max # Initial time step
+        log_message(sim_params, 1, "Starting GA-based N-body simulation...")
+        first_step = 1
+        sim_time = 0.0
+        permutation = np.arange(len(particles)) # Row k holds initial particle permutation[k]
+        forces_ga_current_step = compute_forces(particles, shells, sim_params, force_state) # Initial forces
+    else:
+        dt = resume.dt
+        log_message(sim_params, 1, f"Resuming GA-based N-body simulation after step {resume.step} from {resume.path}...")
+        first_step = resume.step + 1
+        sim_time = resume.sim_time
+        permutation = resume.permutation()
+        forces_ga_current_step = resume.forces() # Forces carried out of the checkpointed step
+        resume.restore_force_state(force_state)
+    checkpoint_writer = CheckpointWriter(sim_params.checkpoint_path) if sim_params.checkpoint_interval > 0 else None
+    grid_error = getattr(force_state.background_for(shells), "interpolation_error", None)
+    if grid_error is not None:
+        log_message(sim_params, 1, f"Background grid interpolation error: median {grid_error['median']:.1e}, "
+                                   f"99th percentile {grid_error['p99']:.1e}, max {grid_error['max']:.1e}")
+    scf_error = getattr(force_state.scf_expansion, "force_error", None)
+    if scf_error is not None:
+        log_message(sim_params, 1, f"SCF force error against direct summation (sampled after the first fit): median "
+                                   f"{scf_error['median']:.1e}, 99th percentile {scf_error['p99']:.1e}, max {scf_error['max']:.1e}"
+                                   f" (nmax={sim_params.scf_nmax}, lmax={sim_params.scf_lmax})")
 
-    forces_ga_current_step = [localized_gravity_force(p, particles, shells, sim_params.interaction_radius_kpc) for p in particles] # Initial forces
+    force_time_per_step = []
+    force_evaluations_per_step = []
+    reorder_steps = []
+    block_particle_forces_per_step = []
+    block_global_particle_forces_per_step = []
+    for step in range(first_step, n_steps + 1):
+        force_time_before = force_state.force_time
+        evaluations_before = force_state.num_evaluations
+        if sim_params.block_timestep_levels > 0:
+            particles, forces_ga_next_step, dt, block_stats = run_block_step_ga(particles, shells, sim_params, disk_params, spiral_params, step, disk_formation_step,
+                                                                                force_state, sim_time, forces_ga_current_step, rng)
+            block_particle_forces_per_step.append(block_stats["particle_forces"])
+            block_global_particle_forces_per_step.append(block_stats["global_particle_forces"])
+        else:
+            particles, forces_ga_next_step, dt = run_one_step_ga(particles, shells, dt, sim_params, disk_params, spiral_params, step, disk_formation_step, ln_Lambda, rng,
+                                                             force_state, sim_time, forces_ga_current_step)
+        force_time_per_step.append(force_state.force_time - force_time_before)
+        force_evaluations_per_step.append(force_state.num_evaluations - evaluations_before)
+        sim_time += dt
+        collect_diagnostics(particles, None, step, dt, sim_params) # Collect diagnostics
+        forces_ga_current_step = forces_ga_next_step # Carried into the next step's first kick
 
-    for step in range(1, n_steps + 1):
-        particles, forces_ga_next_step, dt = run_one_step_ga(particles, shells, dt, sim_params, disk_params, spiral_params, step, disk_formation_step, ln_Lambda, rng)
-        stars = [p for p in particles if isinstance(p, Star)]
-        collect_diagnostics(particles, stars, step, dt, sim_params) # Collect diagnostics
-        forces_ga_current_step = forces_ga_next_step # Update forces for next step
+        if sim_params.reorder_interval and step % sim_params.reorder_interval == 0 and step < n_steps: # Morton re-sort
+            order, (forces_ga_current_step, force_state.jerks) = reorder_particle_set(particles, (forces_ga_current_step, force_state.jerks))
+            permutation = permutation[order]
+            force_state.particles_reordered()
+            reorder_steps.append(step)
+
+        if checkpoint_writer is not None and step % sim_params.checkpoint_interval == 0: # Written while the next steps run
+            checkpoint_writer.submit(*snapshot_run_state(step, sim_time, dt, particles, permutation, forces_ga_current_step,
+                                                         force_state, rng, return_particle_set))
+
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+        log_message(sim_params, 1, f"Checkpoints: {checkpoint_writer.num_writes} written to {sim_params.checkpoint_path}, "
+                                   f"{checkpoint_writer.wait_time * 1e3:.1f} ms spent waiting for the writer")
 
     log_message(sim_params, 1, "GA-based Simulation complete!")
+    neighbour_list = force_state.neighbour_list
+    if neighbour_list is not None:
+        log_message(sim_params, 1, f"Neighbour list: {neighbour_list.num_builds} rebuilds over {neighbour_list.num_updates} force evaluations")
+    log_message(sim_params, 1, f"Force evaluations: {force_state.num_evaluations} for {n_steps} steps "
+                               f"({np.mean(force_evaluations_per_step) if force_evaluations_per_step else 0.0:.2f} per step)")
+    if reorder_steps:
+        first = reorder_steps[0] - first_step + 1 # Steps run before the first re-sort
+        log_message(sim_params, 1, f"Particle reordering: {len(reorder_steps)} re-sorts, force time per step "
+                                   f"{np.mean(force_time_per_step[:first]) * 1e3:.2f} ms before the first, "
+                                   f"{np.mean(force_time_per_step[first:]) * 1e3:.2f} ms after")
+    if block_particle_forces_per_step:
+        block_total = sum(block_particle_forces_per_step)
+        global_total = sum(block_global_particle_forces_per_step)
+        log_message(sim_params, 1, f"Block time-steps: {block_total} particle-force evaluations against {global_total} "
+                                   f"with a global step at the finest level used ({1.0 - block_total / global_total:.1%} saved)")
+    if force_state.scf_expansion is not None:
+        log_message(sim_params, 1, f"SCF expansion: {force_state.scf_expansion.num_fits} coefficient fits over {n_steps} steps")
 
     diagnostics = { # Return collected diagnostics
         "star_positions_over_time": star_positions_over_time,
@@ -161,7 +359,26 @@ def run_n_body_simulation_ga(n_steps, initial_particles, shells, sim_params,
         "star_counts": star_counts,
         "velocity_dispersions": velocity_dispersions,
         "bh_halo_masses": bh_halo_masses,
-        "max_bh_mass": max_bh_mass
+        "max_bh_mass": max_bh_mass,
+        "neighbour_list_builds": neighbour_list.num_builds if neighbour_list is not None else None,
+        "neighbour_list_updates": neighbour_list.num_updates if neighbour_list is not None else None,
+        "force_time_per_step": force_time_per_step,
+        "force_evaluations_per_step": force_evaluations_per_step,
+        "reorder_steps": reorder_steps,
+        "block_particle_forces_per_step": block_particle_forces_per_step,
+        "block_global_particle_forces_per_step": block_global_particle_forces_per_step
     }
+    particles.permute(np.argsort(permutation)) # Back to the input order
+    if not return_particle_set:
+        particles = particles.to_particles()
     return particles, diagnostics
+
+def resume_from(checkpoint_path, n_steps, shells, sim_params, disk_formation_step, disk_params, spiral_params,
+                ln_Lambda, spheroidal_params, external_potential=None):
+    """Continues a run of run_n_body_simulation_ga from a checkpoint file up to step n_steps.
+    The remaining arguments must match the checkpointed run; the particles, time, carried forces,
+    engine caches and random states come from the checkpoint, so the continued run is
+    bit-identical to one that was never interrupted. Returns the same as run_n_body_simulation_ga."""
+    return run_n_body_simulation_ga(n_steps, None, shells, sim_params, disk_formation_step, disk_params, spiral_params,
+                                    ln_Lambda, spheroidal_params, None, external_potential, resume=load_checkpoint(checkpoint_path))
 # --- END OF FILE simulation.py ---
\ No newline at end of file
@@ -1,6 +1,29 @@
 # src/simulation_params.py
 #--- START OF FILE simulation_params.py ---
 # src/simulation_params.py
+import logging
+
+# Force engines understood by src.force_engines.compute_forces
+FORCE_ENGINES = ("localized", "direct", "barnes_hut", "fmm", "treepm", "scf")
+
+# Force engines with a jerk (force time derivative) kernel, as needed by the Hermite integrator
+JERK_ENGINES = ("direct", "localized")
+
+# Time integrators: second-order kick-drift-kick leapfrog, Yoshida's fourth-order composition of
+# three leapfrog steps, and the fourth-order Hermite predictor-corrector (needs JERK_ENGINES)
+INTEGRATORS = ("verlet", "yoshida4", "hermite4")
+
+# Precision policies for the pair forces: "mixed" evaluates star-star interactions in float32
+# with float64 accumulation, keeping black holes and the integrator state in float64. It only
+# pays off on the direct engine (~1.5x); the localized engine's cutoff pairs are bound by
+# memory traffic and the extra float32 copies make it ~20% slower (see benchmark_force_precision)
+FORCE_PRECISIONS = ("float64", "mixed")
+
+# Shell background models: "spherical" treats every shell as a sphere of radius semimajor_axis,
+# "homoeoid" uses true ellipsoidal shells (semiminor_axis along z) tabulated on an (R, z) grid
+SHELL_MODELS = ("spherical", "homoeoid")
+
+
 class SimulationParams:
     """
     Parameters for the N-body simulation.
@@ -8,14 +31,48 @@ class SimulationParams:
         dt_min (float): Minimum time step.
         dt_max (float): Maximum time step.
         CFL (float): CFL condition coefficient for adaptive time step.
-        softening_length (float): Softening length for gravitational forces.
+        softening_length (float): Plummer softening length for gravitational forces (direct, tree and mesh engines).
         interaction_radius_kpc (float): Interaction radius for localized N-body force calculation (kpc).
         verbosity (int): Verbosity level (0: None, 1: Basic, 2: Detailed).
         output_interval (int): Interval (in steps) for outputting diagnostics.
         log_level (str): Logging level ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL").
+        force_engine (str): Particle-particle gravity solver, one of FORCE_ENGINES.
+        opening_angle (float): Barnes-Hut opening angle theta.
+        fmm_order (int): Expansion order of the FMM engine.
+        fmm_theta (float): FMM separation parameter (pairs with r_a + r_b < theta * d use expansions).
+        pm_grid_size (int): TreePM mesh points per dimension.
+        pm_split_scale (float or None): TreePM force split scale r_s (kpc); None uses 1.25 mesh cells.
+        fft_workers (int): Worker threads for the TreePM FFTs (-1 uses all cores).
+        neighbour_skin (float): Verlet skin of the localized engine's cached neighbour list (kpc); 0 disables the cache.
+        force_precision (str): Pair-force precision policy of the localized and direct engines, one of FORCE_PRECISIONS.
+            "mixed" speeds up the direct engine only; it slows the localized engine down (a warning is logged).
+        pair_tile_size (int): Particles per k-d tree leaf tile in the localized engine; 0 builds the full pair list instead.
+        pair_memory_limit_mb (float): Budget for expanded neighbour-list pair indices per chunk or tile pairs per
+            batch, and separately for the per-thread force and jerk buffers of the pair kernels (MB).
+        shell_model (str): Shell background model, one of SHELL_MODELS.
+        background_grid_size (int): Points along R and |z| of the homoeoid background grid.
+        background_cache_dir (str or None): Directory for cached background grids; None disables the disk cache.
+        scf_nmax (int): Highest radial order of the SCF engine's basis expansion.
+        scf_lmax (int): Highest angular order of the SCF engine's basis expansion. The default (nmax=16, lmax=8) is
+            set for the flattened (15, 15, 4) kpc spheroid simulated here: about a 10% median force error, against
+            17% at (10, 4); near-spherical systems can use fewer orders (see src/scf.py).
+        scf_scale_length (float or None): SCF basis scale length (kpc); None derives it from the spheroid (or the particles).
+        scf_update_interval (int): Steps between SCF coefficient fits.
+        reorder_interval (int): Steps between Morton (Z-order) re-sorts of the particle arrays; 0 disables them.
+        block_timestep_levels (int): Power-of-two time-step bins below dt_max for hierarchical block time-steps
+            (each step then advances dt_max); 0 uses one global adaptive step.
+        integrator (str): Time integrator, one of INTEGRATORS.
+        checkpoint_interval (int): Steps between checkpoints written to checkpoint_path; 0 disables them.
+        checkpoint_path (str or None): Checkpoint file, overwritten atomically at every checkpoint.
     """
     def __init__(self, dt_min, dt_max, CFL, softening_length, interaction_radius_kpc,
-                 verbosity, output_interval, log_level):
+                 verbosity, output_interval, log_level, force_engine="localized", opening_angle=0.5,
+                 fmm_order=4, fmm_theta=0.5, pm_grid_size=64, pm_split_scale=None, fft_workers=-1,
+                 neighbour_skin=0.0, force_precision="float64",
+                 pair_tile_size=32, pair_memory_limit_mb=256.0, shell_model="spherical", background_grid_size=256,
+                 background_cache_dir="simulation_data/background_cache", scf_nmax=16, scf_lmax=8, scf_scale_length=None,
+                 scf_update_interval=1, reorder_interval=0, block_timestep_levels=0,
+                 integrator="verlet", checkpoint_interval=0, checkpoint_path=None):
         """
         Initializes SimulationParams.
         Args:
@@ -27,6 +84,29 @@ class SimulationParams:
             verbosity (int): Verbosity level.
             output_interval (int): Output interval.
             log_level (str): Logging level.
+            force_engine (str): Force engine name, one of FORCE_ENGINES.
+            opening_angle (float): Barnes-Hut opening angle, in (0, 1].
+            fmm_order (int): FMM expansion order, from 1 to 10.
+            fmm_theta (float): FMM separation parameter, in (0, 1).
+            pm_grid_size (int): TreePM mesh points per dimension (at least 8).
+            pm_split_scale (float or None): TreePM split scale (kpc), or None for 1.25 mesh cells.
+            fft_workers (int): FFT worker threads, or -1 for all cores.
+            neighbour_skin (float): Neighbour-list skin radius (kpc), or 0 to query neighbours every call.
+            force_precision (str): Pair-force precision policy, one of FORCE_PRECISIONS.
+            pair_tile_size (int): Localized-engine tile size (0 or at least 2).
+            pair_memory_limit_mb (float): Pair chunk / tile-pair batch and force buffer budget (MB).
+            shell_model (str): Shell background model, one of SHELL_MODELS.
+            background_grid_size (int): Homoeoid grid points per axis (at least 8).
+            background_cache_dir (str or None): Background grid cache directory, or None.
+            scf_nmax (int): SCF radial order, from 0 to 40.
+            scf_lmax (int): SCF angular order, from 0 to 20.
+            scf_scale_length (float or None): SCF basis scale length (kpc), or None.
+            scf_update_interval (int): Steps between SCF coefficient fits (at least 1).
+            reorder_interval (int): Steps between particle re-sorts, or 0 to keep the initial order.
+            block_timestep_levels (int): Block time-step levels, from 0 (global step) to 30.
+            integrator (str): Time integrator, one of INTEGRATORS.
+            checkpoint_interval (int): Steps between checkpoints, or 0 to disable them.
+            checkpoint_path (str or None): Checkpoint file (required when checkpoint_interval > 0).
         """
         if not all(isinstance(arg, (int, float)) and arg > 0 for arg in [dt_min, dt_max, CFL, softening_length, interaction_radius_kpc]):
             raise ValueError("All numeric parameters must be positive.")
@@ -40,6 +120,87 @@ class SimulationParams:
         if not isinstance(log_level, str) or log_level.upper() not in ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]:
             raise ValueError("Invalid log level.")
 
+        if force_engine not in FORCE_ENGINES:
+            raise ValueError(f"Force engine must be one of {FORCE_ENGINES}.")
+
+        if not isinstance(opening_angle, (int, float)) or not 0 < opening_angle <= 1:
+            raise ValueError("Opening angle must be in (0, 1].")
+
+        if not isinstance(fmm_order, int) or not 1 <= fmm_order <= 10:
+            raise ValueError("FMM order must be an integer from 1 to 10.")
+
+        if not isinstance(fmm_theta, (int, float)) or not 0 < fmm_theta < 1:
+            raise ValueError("FMM theta must be in (0, 1).")
+
+        if not isinstance(pm_grid_size, int) or pm_grid_size < 8:
+            raise ValueError("PM grid size must be an integer of at least 8.")
+
+        if pm_split_scale is not None and (not isinstance(pm_split_scale, (int, float)) or pm_split_scale <= 0):
+            raise ValueError("PM split scale must be positive or None.")
+
+        if not isinstance(fft_workers, int) or fft_workers == 0 or fft_workers < -1:
+            raise ValueError("FFT workers must be a positive integer or -1.")
+
+        if not isinstance(neighbour_skin, (int, float)) or neighbour_skin < 0:
+            raise ValueError("Neighbour skin must be non-negative.")
+
+        if force_precision not in FORCE_PRECISIONS:
+            raise ValueError(f"Force precision must be one of {FORCE_PRECISIONS}.")
+
+        if force_precision == "mixed" and force_engine == "localized":
+            logging.warning("Mixed precision is slower than float64 on the localized engine; it only speeds up the direct engine.")
+
+        if not isinstance(pair_tile_size, int) or pair_tile_size < 0 or pair_tile_size == 1:
+            raise ValueError("Pair tile size must be 0 or an integer of at least 2.")
+
+        if not isinstance(pair_memory_limit_mb, (int, float)) or pair_memory_limit_mb <= 0:
+            raise ValueError("Pair memory limit must be positive.")
+
+        if shell_model not in SHELL_MODELS:
+            raise ValueError(f"Shell model must be one of {SHELL_MODELS}.")
+
+        if not isinstance(background_grid_size, int) or background_grid_size < 8:
+            raise ValueError("Background grid size must be an integer of at least 8.")
+
+        if background_cache_dir is not None and not isinstance(background_cache_dir, str):
+            raise ValueError("Background cache directory must be a string or None.")
+
+        if not isinstance(scf_nmax, int) or not 0 <= scf_nmax <= 40:
+            raise ValueError("SCF nmax must be an integer from 0 to 40.")
+
+        if not isinstance(scf_lmax, int) or not 0 <= scf_lmax <= 20:
+            raise ValueError("SCF lmax must be an integer from 0 to 20.")
+
+        if scf_scale_length is not None and (not isinstance(scf_scale_length, (int, float)) or scf_scale_length <= 0):
+            raise ValueError("SCF scale length must be positive or None.")
+
+        if not isinstance(scf_update_interval, int) or scf_update_interval < 1:
+            raise ValueError("SCF update interval must be a positive integer.")
+
+        if not isinstance(reorder_interval, int) or reorder_interval < 0:
+            raise ValueError("Reorder interval must be a non-negative integer.")
+
+        if not isinstance(block_timestep_levels, int) or not 0 <= block_timestep_levels <= 30:
+            raise ValueError("Block time-step levels must be an integer from 0 to 30.")
+
+        if integrator not in INTEGRATORS:
+            raise ValueError(f"Integrator must be one of {INTEGRATORS}.")
+
+        if integrator == "hermite4" and force_engine not in JERK_ENGINES:
+            raise ValueError(f"The hermite4 integrator needs a force engine with a jerk kernel, one of {JERK_ENGINES}.")
+
+        if integrator != "verlet" and block_timestep_levels > 0:
+            raise ValueError("Block time-steps are only available with the verlet integrator.")
+
+        if not isinstance(checkpoint_interval, int) or checkpoint_interval < 0:
+            raise ValueError("Checkpoint interval must be a non-negative integer.")
+
+        if checkpoint_path is not None and not isinstance(checkpoint_path, str):
+            raise ValueError("Checkpoint path must be a string or None.")
+
+        if checkpoint_interval > 0 and checkpoint_path is None:
+            raise ValueError("A checkpoint path is needed when checkpoint_interval is positive.")
+
         self.dt_min = float(dt_min)
         self.dt_max = float(dt_max)
         self.CFL = float(CFL)
@@ -48,4 +209,27 @@ class SimulationParams:
         self.verbosity = verbosity
         self.output_interval = output_interval
         self.log_level = log_level
+        self.force_engine = force_engine
+        self.opening_angle = float(opening_angle)
+        self.fmm_order = fmm_order
+        self.fmm_theta = float(fmm_theta)
+        self.pm_grid_size = pm_grid_size
+        self.pm_split_scale = None if pm_split_scale is None else float(pm_split_scale)
+        self.fft_workers = fft_workers
+        self.neighbour_skin = float(neighbour_skin)
+        self.force_precision = force_precision
+        self.pair_tile_size = pair_tile_size
+        self.pair_memory_limit_mb = float(pair_memory_limit_mb)
+        self.shell_model = shell_model
+        self.background_grid_size = background_grid_size
+        self.background_cache_dir = background_cache_dir
+        self.scf_nmax = scf_nmax
+        self.scf_lmax = scf_lmax
+        self.scf_scale_length = None if scf_scale_length is None else float(scf_scale_length)
+        self.scf_update_interval = scf_update_interval
+        self.reorder_interval = reorder_interval
+        self.block_timestep_levels = block_timestep_levels
+        self.integrator = integrator
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_path = checkpoint_path
 # --- END OF FILE simulation_params.py ---
\ No newline at end of file